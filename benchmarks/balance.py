@@ -0,0 +1,91 @@
+"""Balance reads and utxo updates: scanning every utxo against the pool's BalanceIndex
+
+    python3 benchmarks/balance.py [--utxos 100000] [--assets 50] [--reads 100]
+
+The scan is the former wallet balance, hex encoding the asset of every
+utxo. Updates go through UtxoPool, which also maintains the selection
+index, so their cost is an upper bound for the balance index alone.
+"""
+import argparse
+import os
+import random
+import time
+
+from selw.pool import UtxoPool
+from selw.utils import b2h_rev
+
+
+class Utxo(object):
+    __slots__ = ('txid', 'vout', 'value', 'asset', 'height')
+
+    def __init__(self, value, asset, height):
+        self.txid = os.urandom(32)
+        self.vout = 0
+        self.value = value
+        self.asset = asset
+        self.height = height
+
+    @property
+    def outpoint(self):
+        return b2h_rev(self.txid), self.vout
+
+
+def scan_balance(utxos):
+    ret = {}
+    for utxo in utxos:
+        asset_hex = b2h_rev(utxo.asset)
+        if asset_hex in ret:
+            ret[asset_hex] += utxo.value
+        else:
+            ret[asset_hex] = utxo.value
+    return ret
+
+
+def timed(func, n):
+    start = time.perf_counter()
+    for _ in range(n):
+        result = func()
+    return (time.perf_counter() - start) / n, result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--utxos', type=int, default=100000)
+    parser.add_argument('--assets', type=int, default=50)
+    parser.add_argument('--reads', type=int, default=100)
+    args = parser.parse_args()
+    rng = random.Random(0)
+
+    assets = [os.urandom(32) for _ in range(args.assets)]
+    utxos = [Utxo(rng.randrange(1, 10**8), rng.choice(assets), rng.choice([None, 1, 2])) for _ in range(args.utxos)]
+    pool = UtxoPool()
+    start = time.perf_counter()
+    for utxo in utxos:
+        pool.add(utxo)
+    add = (time.perf_counter() - start) / len(utxos)
+
+    scan, expected = timed(lambda: scan_balance(utxos), max(1, args.reads // 10))
+    read, balance = timed(lambda: {b2h_rev(a): v for a, v in pool.balance().items()}, args.reads)
+    confirmed, _ = timed(lambda: pool.balance('confirmed'), args.reads)
+    assert balance == expected
+
+    sample = rng.sample(utxos, min(10000, len(utxos)))
+    reserve, _ = timed(lambda: pool.reserve(sample), 1)
+    release, _ = timed(lambda: pool.release(sample), 1)
+    start = time.perf_counter()
+    for utxo in sample:
+        pool.remove(utxo.outpoint)
+    remove = (time.perf_counter() - start) / len(sample)
+
+    print('{} utxos, {} assets'.format(args.utxos, args.assets))
+    print('  balance, scanning utxos   {:10.3f} ms'.format(scan * 1e3))
+    print('  balance, index            {:10.3f} ms ({:.0f}x)'.format(read * 1e3, scan / read))
+    print('  confirmed balance, index  {:10.3f} ms'.format(confirmed * 1e3))
+    print('  add                       {:10.2f} us/utxo'.format(add * 1e6))
+    print('  reserve                   {:10.2f} us/utxo'.format(reserve / len(sample) * 1e6))
+    print('  release                   {:10.2f} us/utxo'.format(release / len(sample) * 1e6))
+    print('  remove                    {:10.2f} us/utxo'.format(remove * 1e6))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+"""Payout throughput: one transaction per recipient against batch payments
+
+    python3 benchmarks/batch_payments.py [--recipients 10 50 200] [--max-outputs 50]
+
+Both paths build, blind and sign every transaction paying the recipients
+at the minimum feerate, then report payments per second and total fees.
+"""
+import argparse
+import time
+import wallycore as wally
+
+from selw.constants import LBTC_HEX
+from selw.fee import DEFAULT_FEERATE
+from selw.wallet import WalletP2wpkh
+
+from common import fund
+
+
+def fees(builders):
+    total = 0
+    for builder in builders:
+        tx = wally.psbt_extract(builder.psbt, wally.WALLY_PSBT_EXTRACT_NON_FINAL)
+        for i in range(wally.tx_get_num_outputs(tx)):
+            if not wally.tx_get_output_script(tx, i):
+                total += wally.tx_confidential_value_to_satoshi(wally.tx_get_output_value(tx, i))
+    return total
+
+
+def sign_all(w, builders):
+    for builder in builders:
+        w.blind_psbt(builder, builder.utxos)
+        w.sign_psbt(builder, builder.utxos)
+    return builders
+
+
+def one_per_recipient(w, recipients):
+    builders = []
+    for address, asset_hex, value in recipients:
+        # Spent utxos are reserved, so they are not selected twice
+        builders.append(w.build_psbt(None, address, asset_hex, value, DEFAULT_FEERATE))
+    return sign_all(w, builders)
+
+
+def batch(w, recipients, max_outputs):
+    return sign_all(w, w.build_batch_psbts(recipients, DEFAULT_FEERATE, max_outputs))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--recipients', type=int, nargs='+', default=[10, 50, 200])
+    parser.add_argument('--max-outputs', type=int, default=None)
+    args = parser.parse_args()
+
+    address = WalletP2wpkh(b'\x03' * 32, b'\x04' * 32).address()
+    for n in args.recipients:
+        recipients = [(address, LBTC_HEX, 1000 + i) for i in range(n)]
+        results = []
+        for run in (lambda w: one_per_recipient(w, recipients), lambda w: batch(w, recipients, args.max_outputs)):
+            w = WalletP2wpkh(b'\x02' * 32, b'\x01' * 32)
+            fund(w, n, value=100000)
+            start = time.perf_counter()
+            builders = run(w)
+            results.append((time.perf_counter() - start, len(builders), fees(builders)))
+        print('{:5} recipients: one per recipient {:7.1f} payments/s, {:4} txs, fees {:7}; '
+              'batch {:7.1f} payments/s, {:4} txs, fees {:7}'.format(
+                  n, n / results[0][0], results[0][1], results[0][2], n / results[1][0], results[1][1], results[1][2]))
+
+
+if __name__ == '__main__':
+    main()
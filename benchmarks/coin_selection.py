@@ -0,0 +1,51 @@
+"""Coin selection latency and input counts against spending every UTXO
+
+    python3 benchmarks/coin_selection.py [--utxos 10000 50000] [--payments 20]
+
+UTXO values are log-uniform between 1k and 10M sats, payments between 10k
+and 1M sats. Selection works on plain values, no transaction is built.
+"""
+import argparse
+import os
+import random
+import time
+
+from selw.coinselect import BNB, KNAPSACK, LARGEST_FIRST, UtxoIndex, select_coins
+
+ASSET = b'\xaa' * 32
+
+
+class Utxo(object):
+    __slots__ = ('txid', 'vout', 'value', 'asset')
+
+    def __init__(self, value):
+        self.txid = os.urandom(32)
+        self.vout = 0
+        self.value = value
+        self.asset = ASSET
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--utxos', type=int, nargs='+', default=[10000, 50000])
+    parser.add_argument('--payments', type=int, default=20)
+    args = parser.parse_args()
+    rng = random.Random(0)
+
+    for n_utxos in args.utxos:
+        utxos = [Utxo(int(10 ** rng.uniform(3, 7))) for _ in range(n_utxos)]
+        start = time.perf_counter()
+        index = UtxoIndex(utxos)
+        print('{} utxos, index built in {:.3f}s'.format(n_utxos, time.perf_counter() - start))
+        print('  {:14} inputs {:8}'.format('spend all', n_utxos))
+        payments = [int(10 ** rng.uniform(4, 6)) for _ in range(args.payments)]
+        for strategy in (BNB, LARGEST_FIRST, KNAPSACK):
+            n_inputs, start = 0, time.perf_counter()
+            for amount in payments:
+                n_inputs += len(select_coins(index, {ASSET: amount}, strategy, cost_of_change=1000))
+            elapsed = (time.perf_counter() - start) / len(payments)
+            print('  {:14} inputs {:8.1f}, {:8.2f}ms per selection'.format(strategy, n_inputs / len(payments), elapsed * 1000))
+
+
+if __name__ == '__main__':
+    main()
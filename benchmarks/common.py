@@ -0,0 +1,26 @@
+import os
+import wallycore as wally
+
+from selw.constants import LBTC_HEX
+from selw.fakechain import blinded_txout, unspent
+from selw.utils import h2b_rev
+from selw.utxo import SpendableElementsUTXO
+
+
+def fund(wallet, n_utxos, value=10000, asset_hex=LBTC_HEX):
+    """Add n_utxos utxos of value to wallet
+
+    Rangeproofs are expensive to create, so all the utxos come from a single
+    transaction repeating the same blinded output.
+    """
+    output = wallet.output
+    txout = blinded_txout(output.scriptpubkey, output.blinding_key.pub, h2b_rev(asset_hex), value)
+    tx = wally.tx_init(2, 0, 1, n_utxos)
+    wally.tx_add_elements_raw_input(
+        tx, os.urandom(32), 0, 0xffffffff, None, None, None, None, None, None, None, None, None, 0)
+    for _ in range(n_utxos):
+        wally.tx_add_output(tx, txout)
+    utxos = [SpendableElementsUTXO(unspent(tx, vout), output, wallet.private_blinding_key) for vout in range(n_utxos)]
+    for utxo in utxos:
+        wallet.pool.add(utxo)
+    return utxos
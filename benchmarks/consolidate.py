@@ -0,0 +1,64 @@
+"""Sync and build time before and after consolidating many small utxos, against an in-process FakeChain
+
+    python3 benchmarks/consolidate.py [--utxos 2000] [--max-inputs 200] [--payment 100000]
+
+Sync is a full one (not incremental), so every utxo is listed, parsed and
+unblinded. Build is build_psbt, blind_psbt and sign_psbt of a payment
+that needs many of the small utxos before consolidation.
+"""
+import argparse
+import time
+
+from selw.consolidate import Consolidator
+from selw.fakechain import FakeChain
+from selw.wallet import WalletP2wpkh
+
+
+def timed(func):
+    start = time.perf_counter()
+    func()
+    return time.perf_counter() - start
+
+
+def pay(w, address, value):
+    builder = w.build_psbt(None, address, w.network.policy_asset_hex, value, feerate=0.1, lease=0)
+    w.blind_psbt(builder, builder.utxos)
+    w.sign_psbt(builder, builder.utxos)
+    return builder
+
+
+def measure(w, chain, address, payment):
+    sync = timed(lambda: w.sync(chain, incremental=False))
+    holder = []
+    build = timed(lambda: holder.append(pay(w, address, payment)))
+    return len(w.utxos), sync, build, holder[0].num_inputs
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--utxos', type=int, default=2000)
+    parser.add_argument('--max-inputs', type=int, default=200)
+    parser.add_argument('--payment', type=int, default=100000)
+    args = parser.parse_args()
+
+    w = WalletP2wpkh(b'\x02' * 32, b'\x01' * 32)
+    chain = FakeChain(w.network)
+    chain.fund(w.scriptpubkey, [1000 + i % 10 for i in range(args.utxos)], blinding_pubkey=w.public_blinding_key(),
+               reuse_proofs=True)
+    address = WalletP2wpkh(b'\x03' * 32, b'\x04' * 32).address()
+
+    before = measure(w, chain, address, args.payment)
+    start = time.perf_counter()
+    report = Consolidator(w, chain, max_inputs=args.max_inputs).run_once()
+    elapsed = time.perf_counter() - start
+    chain.mine()
+    after = measure(w, chain, address, args.payment)
+
+    print('consolidation: {} sweeps in {:.2f}s, fee {} sat'.format(len(report['sweeps']), elapsed, report['fee']))
+    for label, (utxos, sync, build, inputs) in (('before', before), ('after', after)):
+        print('{:6}: {:6} utxos, full sync {:7.3f}s, build+blind+sign {:7.3f}s ({} inputs)'.format(
+            label, utxos, sync, build, inputs))
+
+
+if __name__ == '__main__':
+    main()
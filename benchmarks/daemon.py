@@ -0,0 +1,64 @@
+"""Payment latency of a fresh script against a daemon call, against an in-process FakeChain
+
+    python3 benchmarks/daemon.py [--utxos 200] [--requests 20] [--concurrency 1 4]
+
+A fresh script creates the wallet, syncs (fetching and unblinding every
+utxo), then builds, blinds, signs and sends, as examples/p2wpkh.py does.
+Interpreter startup and imports are not counted. The daemon keeps the
+wallet synced, a request only builds, blinds, signs and sends.
+"""
+import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from selw.backend import ElementsRpc
+from selw.daemon import Daemon
+from selw.fakechain import FakeChain
+from selw.wallet import WalletP2wpkh
+
+
+def fresh_script(chain, address):
+    w = WalletP2wpkh(b'\x02' * 32, b'\x01' * 32)
+    w.sync(chain)
+    builder = w.build_psbt(None, address, w.network.policy_asset_hex, 1000, feerate=0.1)
+    w.blind_psbt(builder, builder.utxos)
+    w.sign_psbt(builder)
+    return w.send_psbt(builder, chain)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--utxos', type=int, default=200)
+    parser.add_argument('--requests', type=int, default=20)
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 4])
+    args = parser.parse_args()
+
+    w = WalletP2wpkh(b'\x02' * 32, b'\x01' * 32)
+    address = WalletP2wpkh(b'\x03' * 32, b'\x04' * 32).address()
+    chain = FakeChain(w.network)
+    chain.fund(w.scriptpubkey, [10**6 + i % 10 for i in range(args.utxos)], blinding_pubkey=w.public_blinding_key(),
+               reuse_proofs=True)
+
+    start = time.perf_counter()
+    fresh_script(chain, address)
+    print('fresh script: {:8.1f} ms per payment ({} utxos)'.format((time.perf_counter() - start) * 1e3, args.utxos))
+
+    with Daemon({'hot': w}, chain, port=0, refresh=3600) as daemon:
+        url = daemon.url + '/wallet/hot'
+
+        def send(_):
+            start = time.perf_counter()
+            ElementsRpc(url, *daemon.auth).call('send', [{'address': address, 'value': 1000}], 0.1)
+            return time.perf_counter() - start
+
+        for concurrency in args.concurrency:
+            start = time.perf_counter()
+            with ThreadPoolExecutor(concurrency) as executor:
+                latencies = sorted(executor.map(send, range(args.requests)))
+            elapsed = time.perf_counter() - start
+            print('daemon, {} concurrent: {:8.1f} ms median latency, {:6.1f} payments/s'.format(
+                concurrency, latencies[len(latencies) // 2] * 1e3, args.requests / elapsed))
+
+
+if __name__ == '__main__':
+    main()
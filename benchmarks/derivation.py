@@ -0,0 +1,48 @@
+"""Address pool generation: derive_range against one derive_pub per address
+
+    python3 benchmarks/derivation.py [--addresses 100000] [--naive 5000]
+
+The naive loop derives m/84'/1'/0'/0/i from the master key for each i, as
+callers did before the derivation cache; it runs on fewer addresses and is
+extrapolated.
+"""
+import argparse
+import time
+import wallycore as wally
+
+from selw.key import Bip32Key, derivation_cache
+
+HARDENED = 0x80000000
+PREFIX = [84 | HARDENED, 1 | HARDENED, 0 | HARDENED, 0]
+
+
+def naive(master, count):
+    for i in range(count):
+        pub = Bip32Key(wally.bip32_key_from_parent_path(
+            master.extkey, PREFIX + [i], wally.BIP32_FLAG_KEY_PUBLIC | wally.BIP32_FLAG_SKIP_HASH)).pub
+        wally.witness_program_from_bytes(pub, wally.WALLY_SCRIPT_HASH160)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--addresses', type=int, default=100000)
+    parser.add_argument('--naive', type=int, default=5000)
+    args = parser.parse_args()
+    master = Bip32Key.from_seed(b'\x01' * 32, is_testnet=True)
+
+    start = time.perf_counter()
+    naive(master, args.naive)
+    elapsed = (time.perf_counter() - start) * args.addresses / args.naive
+    print('naive path derivation: {:7.2f}s for {} scriptpubkeys (extrapolated)'.format(elapsed, args.addresses))
+
+    for output in ('key', 'pub', 'scriptpubkey'):
+        derivation_cache.clear()
+        start = time.perf_counter()
+        master.derive_range(PREFIX, 0, args.addresses, output)
+        elapsed = time.perf_counter() - start
+        print('derive_range {:12}: {:7.2f}s for {} children, {:8.0f}/s'.format(
+            output, elapsed, args.addresses, args.addresses / elapsed))
+
+
+if __name__ == '__main__':
+    main()
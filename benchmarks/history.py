@@ -0,0 +1,50 @@
+"""Memory and throughput of the transaction history walk, against an in-process FakeChain
+
+    python3 benchmarks/history.py [--txs 500 2000]
+
+The wallet receives one blinded output per transaction. Peak is the
+tracemalloc peak while walking the history, streaming the records, or
+collecting them in a list as an accounting job without the generator
+would. Unblinding dominates the time.
+"""
+import argparse
+import time
+import tracemalloc
+
+from selw.fakechain import FakeChain
+from selw.wallet import WalletP2wpkh
+
+
+def walk(w, chain, collect):
+    tracemalloc.start()
+    base = tracemalloc.get_traced_memory()[0]
+    start = time.perf_counter()
+    if collect:
+        records = list(w.history(chain))
+        n = len(records)
+    else:
+        n = sum(1 for _ in w.history(chain))
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1] - base
+    tracemalloc.stop()
+    return n, elapsed, peak
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--txs', type=int, nargs='+', default=[500, 2000])
+    args = parser.parse_args()
+
+    for txs in args.txs:
+        w = WalletP2wpkh(b'\x02' * 32, b'\x01' * 32)
+        chain = FakeChain(w.network)
+        chain.fund(w.scriptpubkey, [1000] * txs, blinding_pubkey=w.public_blinding_key(), outputs_per_tx=1, reuse_proofs=True)
+        # Index the server side history outside of the measures
+        chain.get_address_txs_chain(w.unconf_address())
+        for label, collect in (('stream', False), ('list', True)):
+            n, elapsed, peak = walk(w, chain, collect)
+            print('{:6} txs, {:6}: {:7.1f} records/s, peak {:8.1f} KiB'.format(n, label, n / elapsed, peak / 1024))
+
+
+if __name__ == '__main__':
+    main()
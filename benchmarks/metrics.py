@@ -0,0 +1,72 @@
+"""Where time goes in a payout, and the cost of the instrumentation, against an in-process FakeChain
+
+    python3 benchmarks/metrics.py [--utxos 200] [--payments 20] [--profile sign_psbt]
+
+A payout is a full sync of a wallet with many utxos, then payments built,
+blinded, signed and sent. It runs with instrumentation off, then on with
+libwally calls counted, and prints the spans and counters of the second
+run. The cost of a span and a counter when off is measured alone.
+"""
+import argparse
+import time
+import timeit
+
+from selw import metrics
+from selw.fakechain import FakeChain
+from selw.wallet import WalletP2wpkh
+
+
+def payout(utxos, payments):
+    w = WalletP2wpkh(b'\x02' * 32, b'\x01' * 32)
+    chain = FakeChain(w.network)
+    chain.fund(w.scriptpubkey, [10**6 + i % 10 for i in range(utxos)], blinding_pubkey=w.public_blinding_key(),
+               reuse_proofs=True)
+    address = WalletP2wpkh(b'\x03' * 32, b'\x04' * 32).address()
+    start = time.perf_counter()
+    w.sync(chain)
+    for _ in range(payments):
+        builder = w.build_psbt(None, address, w.network.policy_asset_hex, 1000, feerate=0.1)
+        w.blind_psbt(builder, builder.utxos)
+        w.sign_psbt(builder)
+        w.send_psbt(builder, chain)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--utxos', type=int, default=200)
+    parser.add_argument('--payments', type=int, default=20)
+    parser.add_argument('--profile', nargs='*', default=[], help='spans to run under cProfile')
+    args = parser.parse_args()
+
+    n = 10**6
+    span = timeit.timeit(lambda: metrics.span('sync'), number=n) / n
+    count = timeit.timeit(lambda: metrics.count('utxos_parsed'), number=n) / n
+    print('off: span {:.0f} ns, count {:.0f} ns per call'.format(span * 1e9, count * 1e9))
+
+    off = payout(args.utxos, args.payments)
+    m = metrics.enable(wally_calls=True, profile=args.profile)
+    on = payout(args.utxos, args.payments)
+    metrics.disable()
+    print('payout, {} utxos, {} payments: off {:.3f}s, on {:.3f}s ({:+.1f}%)'.format(
+        args.utxos, args.payments, off, on, (on / off - 1) * 100))
+
+    stats = m.stats()
+    print('\n{:<16} {:>6} {:>10} {:>10}'.format('span', 'calls', 'total ms', 'mean ms'))
+    for name, span in sorted(stats['spans'].items(), key=lambda item: -item[1]['total']):
+        print('{:<16} {:>6} {:>10.1f} {:>10.3f}'.format(name, span['calls'], span['total'] * 1e3, span['mean'] * 1e3))
+    counters = stats['counters']
+    print()
+    for name in sorted(name for name in counters if not name.startswith('wally_calls')):
+        print('{:<32} {:>10}'.format(name, counters[name]))
+    wally_calls = sorted(((value, name) for name, value in counters.items() if name.startswith('wally_calls')), reverse=True)
+    print('\nlibwally: {} calls, most called:'.format(sum(value for value, _ in wally_calls)))
+    for value, name in wally_calls[:10]:
+        print('{:<48} {:>10}'.format(name, value))
+    for name, profile in m.profiles.items():
+        print('\nprofile of {}:'.format(name))
+        profile.sort_stats('cumulative').print_stats(15)
+
+
+if __name__ == '__main__':
+    main()
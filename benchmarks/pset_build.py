@@ -0,0 +1,54 @@
+"""End-to-end PSET build time: base64 stages against PsetBuilder
+
+    python3 benchmarks/pset_build.py [--inputs 1 10 50 100 200]
+
+Both paths create, blind, sign, finalize and extract the same transaction.
+The base64 path serializes and parses the PSET between every stage.
+"""
+import argparse
+import time
+
+from selw.constants import LBTC_HEX
+from selw.pset import PsetBuilder
+from selw.wallet import WalletP2wpkh
+
+from common import fund
+
+
+def base64_stages(w, address):
+    psbt = w.create_psbt(w.utxos, address, LBTC_HEX, 1000)
+    psbt = w.blind_psbt(psbt, w.utxos)
+    psbt = w.sign_psbt(psbt, w.utxos)
+    builder = PsetBuilder.from_base64(psbt)
+    builder.finalize()
+    return builder.tx_hex()
+
+
+def builder_stages(w, address):
+    builder = w.build_psbt(w.utxos, address, LBTC_HEX, 1000)
+    w.blind_psbt(builder, w.utxos)
+    w.sign_psbt(builder, w.utxos)
+    builder.finalize()
+    return builder.tx_hex()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--inputs', type=int, nargs='+', default=[1, 10, 50, 100, 200])
+    args = parser.parse_args()
+
+    for n_inputs in args.inputs:
+        w = WalletP2wpkh(b'\x02' * 32, b'\x01' * 32)
+        fund(w, n_inputs)
+        address = w.address()
+        timings = []
+        for stages in (base64_stages, builder_stages):
+            start = time.perf_counter()
+            stages(w, address)
+            timings.append(time.perf_counter() - start)
+        print('{:4} inputs: base64 stages {:7.3f}s, builder {:7.3f}s ({:.2f}x)'.format(
+            n_inputs, timings[0], timings[1], timings[0] / timings[1]))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,55 @@
+"""2-of-3 multisig signing time: one psbt_sign pass per key against PsetBuilder.sign
+
+    python3 benchmarks/sign.py [--inputs 10 100 500 1000] [--workers 4]
+
+psbt_sign hashes every input again for each key, PsetBuilder.sign hashes
+each input once and signs each (input, key) pair once, optionally in
+worker processes. Wallet.sign_psbt finds its keys through the keypaths
+in the wallet's KeyStore, rather than deriving the public key of every
+private key it is given.
+"""
+import argparse
+import time
+import wallycore as wally
+
+from selw.constants import LBTC_HEX
+from selw.pset import PsetBuilder
+from selw.wallet import WalletP2wsh2of3
+
+from common import fund
+
+KEYS = [b'\x02' * 32, b'\x03' * 32]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--inputs', type=int, nargs='+', default=[10, 100, 500, 1000])
+    parser.add_argument('--workers', type=int, default=None)
+    args = parser.parse_args()
+
+    for n_inputs in args.inputs:
+        w = WalletP2wsh2of3(KEYS + [wally.ec_public_key_from_private_key(b'\x05' * 32)], b'\x01' * 32)
+        fund(w, n_inputs)
+        psbt = w.create_psbt(w.utxos, w.address(), LBTC_HEX, 1000)
+
+        builder = PsetBuilder.from_base64(psbt)
+        start = time.perf_counter()
+        for key in KEYS:
+            wally.psbt_sign(builder.psbt, key, 0)
+        per_key = time.perf_counter() - start
+
+        builder = PsetBuilder.from_base64(psbt)
+        start = time.perf_counter()
+        builder.sign(KEYS, args.workers)
+        engine = time.perf_counter() - start
+
+        builder = PsetBuilder.from_base64(psbt)
+        start = time.perf_counter()
+        w.sign_psbt(builder, workers=args.workers)
+        keystore = time.perf_counter() - start
+        print('{:5} inputs: psbt_sign per key {:7.3f}s, PsetBuilder.sign {:7.3f}s ({:.2f}x), Wallet.sign_psbt {:7.3f}s'.format(
+            n_inputs, per_key, engine, per_key / engine, keystore))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,176 @@
+"""Offline benchmark suite of the wallet hot path, with a regression check
+
+    python3 benchmarks/suite.py [--types p2wpkh p2wsh2of3] [--inputs 1 10 50] [--outputs 1 10]
+                                [--derive 10000] [--repeat 3] [--output benchmarks/results.json]
+                                [--baseline baseline.json] [--threshold 0.25]
+
+Stages, for each output type, input count and output count:
+utxo (SpendableElementsUTXO construction), unblind, create_psbt,
+blind_psbt and sign_psbt, plus derive (Bip32Key.derive_range) once.
+Keys are fixed and transactions synthetic, on the elements regtest
+network, nothing goes to the network.
+
+Each stage reports its best time over repeat runs, operations per second
+(utxos, outputs or signatures) and the peak growth of the Python heap
+while it runs, measured with
+tracemalloc in a separate run so that tracing does not skew the times.
+
+Results are written as JSON, by default next to this script. With
+--baseline, stages slower than the baseline by more than threshold (a
+fraction) are listed and the exit status is 1.
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+import wallycore as wally
+
+from selw.fakechain import blinded_txout, unspent
+from selw.key import Bip32Key, derivation_cache
+from selw.network import ELEMENTS_REGTEST
+from selw.utxo import SpendableElementsUTXO
+from selw.wallet import WalletP2wpkh, WalletP2wsh2of3
+
+HARDENED = 0x80000000
+DERIVE_PREFIX = [84 | HARDENED, 1 | HARDENED, 0 | HARDENED, 0]
+UTXO_VALUE = 10**6
+DEFAULT_OUTPUT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results.json')
+
+
+def wallet(output_type):
+    if output_type == 'p2wpkh':
+        return WalletP2wpkh(b'\x02' * 32, b'\x01' * 32, network=ELEMENTS_REGTEST)
+    if output_type == 'p2wsh2of3':
+        keys = [b'\x02' * 32, b'\x03' * 32, wally.ec_public_key_from_private_key(b'\x05' * 32)]
+        return WalletP2wsh2of3(keys, b'\x01' * 32, network=ELEMENTS_REGTEST)
+    raise ValueError('Unknown output type: {}'.format(output_type))
+
+
+def unspents(w, n_inputs):
+    """Unspent dicts of n_inputs outputs of a synthetic transaction, sharing one blinded output"""
+    txout = blinded_txout(w.scriptpubkey, w.public_blinding_key(), w.network.policy_asset, UTXO_VALUE)
+    tx = wally.tx_init(2, 0, 1, n_inputs)
+    wally.tx_add_elements_raw_input(
+        tx, b'\x07' * 32, 0, 0xffffffff, None, None, None, None, None, None, None, None, None, 0)
+    for _ in range(n_inputs):
+        wally.tx_add_output(tx, txout)
+    return [unspent(tx, vout) for vout in range(n_inputs)]
+
+
+class Recorder(object):
+    """Run stages, keeping the best time and the peak memory of each"""
+
+    def __init__(self, traced):
+        self.traced = traced
+        self.results = {}
+
+    def __call__(self, name, ops, func):
+        if self.traced:
+            tracemalloc.reset_peak()
+            before = tracemalloc.get_traced_memory()[0]
+            result = func()
+            self.results[name] = {'peak_kb': (tracemalloc.get_traced_memory()[1] - before) / 1024}
+            return result
+        start = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - start
+        best = self.results.get(name)
+        if best is None or elapsed < best['seconds']:
+            self.results[name] = {'seconds': elapsed, 'ops': ops, 'ops_per_sec': ops / elapsed if elapsed else None}
+        return result
+
+
+def pipeline(measure, w, entries, recipients, prefix):
+    key = w.private_blinding_key
+    utxos = measure(prefix + 'utxo', len(entries),
+                    lambda: [SpendableElementsUTXO(u, w.output, key, unblind=False) for u in entries])
+    measure(prefix + 'unblind', len(utxos), lambda: [u.unblind(key) for u in utxos])
+    builder = measure(prefix + 'create_psbt', 1, lambda: w.build_batch_psbt(utxos, recipients, lease=0))
+    measure(prefix + 'blind_psbt', len(builder.blinded_outputs()), lambda: w.blind_psbt(builder, utxos))
+    n_signatures = len(utxos) * (2 if isinstance(w, WalletP2wsh2of3) else 1)
+    measure(prefix + 'sign_psbt', n_signatures, lambda: w.sign_psbt(builder, utxos))
+
+
+def derive(measure, count):
+    master = Bip32Key.from_seed(b'\x01' * 32, is_testnet=True)
+    derivation_cache.clear()
+    measure('derive', count, lambda: master.derive_range(DERIVE_PREFIX, 0, count))
+
+
+def run(args):
+    timed, traced = Recorder(False), Recorder(True)
+    address = WalletP2wpkh(b'\x03' * 32, b'\x04' * 32, network=ELEMENTS_REGTEST).address()
+    for output_type in args.types:
+        w = wallet(output_type)
+        for n_inputs in args.inputs:
+            entries = unspents(w, n_inputs)
+            for n_outputs in args.outputs:
+                recipients = [(address, w.network.policy_asset_hex, 1000 + i) for i in range(n_outputs)]
+                prefix = '{}/in={}/out={}/'.format(output_type, n_inputs, n_outputs)
+                for _ in range(args.repeat):
+                    pipeline(timed, w, entries, recipients, prefix)
+                tracemalloc.start()
+                pipeline(traced, w, entries, recipients, prefix)
+                tracemalloc.stop()
+    if args.derive:
+        for _ in range(args.repeat):
+            derive(timed, args.derive)
+        tracemalloc.start()
+        derive(traced, args.derive)
+        tracemalloc.stop()
+    for name, result in timed.results.items():
+        result.update(traced.results[name])
+    return timed.results
+
+
+def compare(results, baseline, threshold):
+    """Return the stages slower than in baseline by more than threshold, as (name, ratio)"""
+    regressions = []
+    for name, result in results.items():
+        if name in baseline and baseline[name]['seconds']:
+            ratio = result['seconds'] / baseline[name]['seconds']
+            if ratio > 1 + threshold:
+                regressions.append((name, ratio))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--types', nargs='+', default=['p2wpkh', 'p2wsh2of3'])
+    parser.add_argument('--inputs', type=int, nargs='+', default=[1, 10, 50])
+    parser.add_argument('--outputs', type=int, nargs='+', default=[1, 10])
+    parser.add_argument('--derive', type=int, default=10000)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--output', default=DEFAULT_OUTPUT)
+    parser.add_argument('--baseline')
+    parser.add_argument('--threshold', type=float, default=0.25)
+    args = parser.parse_args()
+
+    results = run(args)
+    for name, result in results.items():
+        print('{:40} {:9.2f} ms {:11.1f} ops/s {:10.1f} KiB peak'.format(
+            name, result['seconds'] * 1e3, result['ops_per_sec'] or 0, result['peak_kb']))
+    with open(args.output, 'w') as f:
+        json.dump({
+            'python': platform.python_version(),
+            'wallycore': getattr(wally, '__version__', None),
+            'cpus': os.cpu_count(),
+            'results': results,
+        }, f, indent=1, sort_keys=True)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+        regressions = compare(results, baseline, args.threshold)
+        for name, ratio in regressions:
+            print('REGRESSION {:40} {:.2f}x slower than baseline'.format(name, ratio))
+        if regressions:
+            sys.exit(1)
+        print('No stage slower than baseline by more than {:.0%}'.format(args.threshold))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,38 @@
+"""Sync throughput against an in-process FakeChain, without network latency
+
+    python3 benchmarks/sync.py [--utxos 1000 10000] [--outputs-per-tx 100]
+
+Measures the wallet side of sync: listing, parsing and unblinding utxos.
+Outputs of the same value share their rangeproof, see FakeChain.fund.
+"""
+import argparse
+import time
+
+from selw.fakechain import FakeChain
+from selw.wallet import WalletP2wpkh
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--utxos', type=int, nargs='+', default=[1000, 10000])
+    parser.add_argument('--outputs-per-tx', type=int, default=100)
+    args = parser.parse_args()
+
+    for n in args.utxos:
+        w = WalletP2wpkh(b'\x02' * 32, b'\x01' * 32)
+        chain = FakeChain(w.network)
+        chain.fund(w.scriptpubkey, [1000 + i % 10 for i in range(n)], blinding_pubkey=w.public_blinding_key(),
+                   outputs_per_tx=args.outputs_per_tx, reuse_proofs=True)
+        start = time.perf_counter()
+        w.sync(chain)
+        full = time.perf_counter() - start
+        start = time.perf_counter()
+        w.sync(chain)
+        incremental = time.perf_counter() - start
+        assert len(w.utxos) == n
+        print('{:7} utxos: full sync {:7.3f}s ({:8.0f} utxos/s), incremental {:7.3f}s, calls {}'.format(
+            n, full, n / full, incremental, chain.calls))
+
+
+if __name__ == '__main__':
+    main()
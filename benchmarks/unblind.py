@@ -0,0 +1,40 @@
+"""Unblinding throughput of unblind_many for an increasing number of workers
+
+    python3 benchmarks/unblind.py [--utxos 1000] [--max-workers N]
+"""
+import argparse
+import os
+import time
+import wallycore as wally
+
+from selw.constants import LBTC_HEX
+from selw.fakechain import blinded_tx, unspent
+from selw.utils import h2b_rev
+from selw.utxo import ElementsUTXO, unblind_many
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--utxos', type=int, default=1000)
+    parser.add_argument('--max-workers', type=int, default=os.cpu_count())
+    args = parser.parse_args()
+
+    key = b'\x01' * 32
+    output = (b'\x00\x14' + b'\x11' * 20, wally.ec_public_key_from_private_key(key), h2b_rev(LBTC_HEX), 1000)
+    tx = blinded_tx([output] * 10)
+    utxos = [ElementsUTXO(unspent(tx, i % 10)) for i in range(args.utxos)]
+
+    workers, baseline = 1, None
+    while workers <= args.max_workers:
+        start = time.perf_counter()
+        results = unblind_many(utxos, key, workers=workers)
+        elapsed = time.perf_counter() - start
+        assert all(results)
+        baseline = baseline or elapsed
+        print('{:3} workers: {:7.3f}s, {:8.1f} utxos/s, speedup {:.2f}x'.format(
+            workers, elapsed, len(utxos) / elapsed, baseline / elapsed))
+        workers *= 2
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+"""Memory used by 10k UTXOs, with and without keeping the parent transaction
+
+    python3 benchmarks/utxo_memory.py [--utxos 10000] [--outputs-per-tx 10]
+
+Each representation is measured in a fresh interpreter, reporting the growth
+of the resident set (which includes libwally allocations, Linux only) and of
+the Python heap (tracemalloc) while building the UTXO list.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import tracemalloc
+import wallycore as wally
+
+from selw.constants import LBTC_HEX
+from selw.fakechain import blinded_txout, esplora_utxo
+from selw.output import P2wpkhElementsOutput
+from selw.pset import TX_FLAGS
+from selw.utils import b2h, h2b, h2b_rev
+from selw.utxo import ElementsUTXO
+
+
+class LegacyElementsUTXO(object):
+    """ElementsUTXO as it was before __slots__, keeping the parsed parent tx"""
+
+    def __init__(self, unspent):
+        self.txid = h2b_rev(unspent.get('txid'))
+        self.vout = unspent.get('vout')
+        self.scriptpubkey = h2b(unspent.get('scriptpubkey'))
+        self.height = unspent.get('height')
+        self.asset = self.value = self.abf = self.vbf = None
+        self.asset_commitment = h2b(unspent.get('assetcommitment'))
+        self.value_commitment = h2b(unspent.get('valuecommitment'))
+        self.nonce_commitment = h2b(unspent.get('noncecommitment'))
+        self.tx = wally.tx_from_hex(unspent['tx'], TX_FLAGS)
+        self.rangeproof = wally.tx_get_output_rangeproof(self.tx, self.vout)
+
+
+def rss_kb():
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') // 1024
+
+
+def generate(path, n_utxos, outputs_per_tx):
+    output = P2wpkhElementsOutput(b'\x02' * 32, b'\x01' * 32)
+    spk = output.scriptpubkey
+    # Rangeproofs are expensive to create, share a single blinded output
+    txout = blinded_txout(spk, output.blinding_key.pub, h2b_rev(LBTC_HEX), 1000)
+    unspents = []
+    while len(unspents) < n_utxos:
+        tx = wally.tx_init(2, 0, 1, outputs_per_tx)
+        wally.tx_add_elements_raw_input(
+            tx, os.urandom(32), 0, 0xffffffff, None, None, None, None, None, None, None, None, None, 0)
+        for _ in range(outputs_per_tx):
+            wally.tx_add_output(tx, txout)
+        txhex = wally.tx_to_hex(tx, TX_FLAGS)
+        for vout in range(min(outputs_per_tx, n_utxos - len(unspents))):
+            unspent = esplora_utxo(tx, vout)
+            unspent.update(scriptpubkey=b2h(spk), tx=txhex)
+            unspents.append(unspent)
+    with open(path, 'w') as f:
+        json.dump(unspents, f)
+
+
+def measure(path, representation):
+    with open(path) as f:
+        unspents = json.load(f)
+    cls = {'legacy': LegacyElementsUTXO, 'slotted': ElementsUTXO}[representation]
+    rss_before = rss_kb()
+    tracemalloc.start()
+    utxos = [cls(unspent) for unspent in unspents]
+    heap, _ = tracemalloc.get_traced_memory()
+    rss_after = rss_kb()
+    print(json.dumps({'utxos': len(utxos), 'rss_kb': rss_after - rss_before, 'heap_kb': heap // 1024}))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--utxos', type=int, default=10000)
+    parser.add_argument('--outputs-per-tx', type=int, default=10)
+    parser.add_argument('--measure', nargs=2, metavar=('PATH', 'REPRESENTATION'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.measure:
+        return measure(*args.measure)
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, 'unspents.json')
+        generate(path, args.utxos, args.outputs_per_tx)
+        for representation in ('legacy', 'slotted'):
+            out = subprocess.run(
+                [sys.executable, __file__, '--measure', path, representation],
+                check=True, capture_output=True, text=True).stdout
+            result = json.loads(out)
+            print('{:8} {:6} utxos: rss +{:8} KiB, python heap {:8} KiB'.format(
+                representation, result['utxos'], result['rss_kb'], result['heap_kb']))
+
+
+if __name__ == '__main__':
+    main()
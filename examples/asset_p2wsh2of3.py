@@ -24,8 +24,9 @@ ASSET_HEX = "REPLACE-THIS-WITH-AN-ASSET-YOU-OWN"
 assert len(ASSET_HEX) == 64, "Replace ASSET_HEX with an existing asset you own"
 assert balance.get(ASSET_HEX, 0) > 0, f'Asset {ASSET_HEX} balance is 0, send some {ASSET_HEX} to {w.address()} and run the script again'
 
-psbt = w.create_psbt(w.utxos, w.address(), ASSET_HEX, 1)
-psbt = w.blind_psbt(psbt, w.utxos)
-psbt = w.sign_psbt(psbt, w.utxos)
+utxos = w.select_utxos(ASSET_HEX, 1)
+psbt = w.create_psbt(utxos, w.address(), ASSET_HEX, 1)
+psbt = w.blind_psbt(psbt, utxos)
+psbt = w.sign_psbt(psbt, utxos)
 txid = w.send_psbt(psbt, url)
 print(f'{url}/tx/{txid}')
@@ -17,8 +17,9 @@ w.sync(url)
 balance = w.balance()
 assert balance.get(LBTC_HEX, 0) > 0, f'Balance is 0, send some funds to {w.address()} and run the script again'
 
-psbt = w.create_psbt(w.utxos, w.address(), LBTC_HEX, 1000)
-psbt = w.blind_psbt(psbt, w.utxos)
-psbt = w.sign_psbt(psbt, w.utxos)
+utxos = w.select_utxos(LBTC_HEX, 1000)
+psbt = w.create_psbt(utxos, w.address(), LBTC_HEX, 1000)
+psbt = w.blind_psbt(psbt, utxos)
+psbt = w.sign_psbt(psbt, utxos)
 txid = w.send_psbt(psbt, url)
 print(f'{url}/tx/{txid}')
@@ -0,0 +1,89 @@
+import wallycore as wally
+
+from selw.exceptions import InvalidAddress
+from selw.utils import LruCache
+
+ADDRESS_CACHE_SIZE = 4096
+HASH160_LEN = 20
+B58_FLAGS = wally.BASE58_FLAG_CHECKSUM
+
+
+class AddressCodec(object):
+    """Address encoding and decoding for a network, with LRU caches in both directions
+
+    Segwit addresses are bech32 or, if confidential, blech32. Legacy P2PKH and
+    P2SH addresses are base58, with the confidential prefix and the blinding
+    public key before the hash if confidential.
+    """
+
+    def __init__(self, network, maxsize=ADDRESS_CACHE_SIZE):
+        self.network = network
+        self.decoded = LruCache(maxsize)
+        self.encoded = LruCache(maxsize)
+
+    def decode(self, address):
+        """Return the scriptpubkey and the blinding public key, None if unconfidential, of address"""
+        decoded = self.decoded.get(address)
+        if decoded is None:
+            try:
+                decoded = self._decode(address)
+            except ValueError:
+                raise InvalidAddress(address)
+            self.decoded.put(address, decoded)
+            self.encoded.put(decoded, address)
+        return decoded
+
+    def encode(self, scriptpubkey, blinding_pubkey=None):
+        """Return the address of scriptpubkey, confidential if blinding_pubkey is given"""
+        key = (bytes(scriptpubkey), None if blinding_pubkey is None else bytes(blinding_pubkey))
+        address = self.encoded.get(key)
+        if address is None:
+            address = self._encode(*key)
+            self.encoded.put(key, address)
+            self.decoded.put(address, key)
+        return address
+
+    def _decode(self, address):
+        network = self.network
+        lower = address.lower()
+        if lower.startswith(network.blech32_hrp + '1'):
+            unconf_address = wally.confidential_addr_to_addr_segwit(address, network.blech32_hrp, network.bech32_hrp)
+            scriptpubkey = wally.addr_segwit_to_bytes(unconf_address, network.bech32_hrp, 0)
+            blinding_pubkey = wally.confidential_addr_segwit_to_ec_public_key(address, network.blech32_hrp)
+            return bytes(scriptpubkey), bytes(blinding_pubkey)
+        if lower.startswith(network.bech32_hrp + '1'):
+            return bytes(wally.addr_segwit_to_bytes(address, network.bech32_hrp, 0)), None
+
+        payload = wally.base58_to_bytes(address, B58_FLAGS)
+        blinding_pubkey = None
+        if len(payload) == 2 + wally.EC_PUBLIC_KEY_LEN + HASH160_LEN and payload[0] == network.confidential_prefix:
+            blinding_pubkey = bytes(payload[2:2 + wally.EC_PUBLIC_KEY_LEN])
+            wally.ec_public_key_verify(blinding_pubkey)
+            payload = payload[1:2] + payload[2 + wally.EC_PUBLIC_KEY_LEN:]
+        if len(payload) != 1 + HASH160_LEN:
+            raise ValueError('Invalid address length')
+        if payload[0] == network.p2pkh_version:
+            scriptpubkey = wally.scriptpubkey_p2pkh_from_bytes(payload[1:], 0)
+        elif payload[0] == network.p2sh_version:
+            scriptpubkey = wally.scriptpubkey_p2sh_from_bytes(payload[1:], 0)
+        else:
+            raise ValueError('Invalid address version')
+        return bytes(scriptpubkey), blinding_pubkey
+
+    def _encode(self, scriptpubkey, blinding_pubkey):
+        network = self.network
+        script_type = wally.scriptpubkey_get_type(scriptpubkey)
+        if script_type in (wally.WALLY_SCRIPT_TYPE_P2WPKH, wally.WALLY_SCRIPT_TYPE_P2WSH, wally.WALLY_SCRIPT_TYPE_P2TR):
+            address = wally.addr_segwit_from_bytes(scriptpubkey, network.bech32_hrp, 0)
+            if blinding_pubkey is None:
+                return address
+            return wally.confidential_addr_from_addr_segwit(address, network.bech32_hrp, network.blech32_hrp, blinding_pubkey)
+        if script_type == wally.WALLY_SCRIPT_TYPE_P2PKH:
+            version, script_hash = network.p2pkh_version, scriptpubkey[3:3 + HASH160_LEN]
+        elif script_type == wally.WALLY_SCRIPT_TYPE_P2SH:
+            version, script_hash = network.p2sh_version, scriptpubkey[2:2 + HASH160_LEN]
+        else:
+            raise ValueError('Scriptpubkey has no address')
+        if blinding_pubkey is None:
+            return wally.base58_from_bytes(bytes([version]) + script_hash, B58_FLAGS)
+        return wally.base58_from_bytes(bytes([network.confidential_prefix, version]) + blinding_pubkey + script_hash, B58_FLAGS)
@@ -0,0 +1,252 @@
+import time
+from decimal import Decimal
+
+import requests
+import wallycore as wally
+
+from selw import metrics
+from selw.exceptions import BroadcastError, RpcError
+from selw.network import LIQUID_TESTNET
+from selw.pset import TX_FLAGS
+from selw.utils import b2h, b2h_rev
+
+DEFAULT_RPC_BATCH_SIZE = 500
+# Confirmed transactions per page of get_address_txs_chain, as Esplora
+TXS_PAGE_SIZE = 25
+# Confirmation targets asked to estimatesmartfee
+FEE_TARGETS = (1, 2, 3, 6, 12, 24, 144, 504, 1008)
+# RPC errors for transactions already in the mempool or in a block
+RPC_VERIFY_ALREADY_IN_CHAIN = -27
+ALREADY_IN_MEMPOOL = ('txn-already-in-mempool', 'txn-already-known')
+
+
+class ChainBackend(object):
+    """Source of chain data and broadcaster used by wallets
+
+    Utxos are dicts as Esplora's /address/:address/utxo entries: txid,
+    vout, status with block_height, and value and asset if explicit. The
+    commitments of blinded outputs may be omitted, they are then read from
+    the parent transaction.
+
+    Batch methods make one call per item, backends override them with
+    concurrent requests or server side batches.
+    """
+
+    def get_address_utxos(self, address):
+        raise NotImplementedError
+
+    def get_address_tx_count(self, address):
+        """Number of transactions, confirmed or not, involving address"""
+        raise NotImplementedError
+
+    def get_address_txs_chain(self, address, last_seen=None):
+        """A page of the confirmed transactions of address, newest first, after txid last_seen
+
+        Transactions are dicts as Esplora's, only txid, status with
+        block_height, and vin with txid, vout and prevout scriptpubkey are
+        used. A page has TXS_PAGE_SIZE transactions, but the last one.
+        """
+        raise NotImplementedError
+
+    def get_tx_hex(self, txid):
+        raise NotImplementedError
+
+    def get_tx_status(self, txid):
+        """Return the status of txid, as {"confirmed": bool, "block_height": ...}, None if unknown"""
+        raise NotImplementedError
+
+    def broadcast(self, tx_hex):
+        """Broadcast a transaction, return its txid
+
+        Transactions already known count as broadcast, others raise
+        BroadcastError, with retry set if the failure may be temporary.
+        """
+        raise NotImplementedError
+
+    def get_tip_height(self):
+        raise NotImplementedError
+
+    def get_fee_estimates(self):
+        """Dict confirmation target (blocks) -> feerate (sat/vbyte)"""
+        raise NotImplementedError
+
+    def map(self, func, items, max_workers=None):
+        """Return [func(item) for item in items]"""
+        return [func(item) for item in items]
+
+    def get_addresses_utxos(self, addresses, max_workers=None):
+        """Return the utxos of each address, in order"""
+        return self.map(self.get_address_utxos, addresses, max_workers)
+
+    def get_address_tx_counts(self, addresses, max_workers=None):
+        return self.map(self.get_address_tx_count, addresses, max_workers)
+
+    def get_txs_hex(self, txids, max_workers=None):
+        """Fetch many transactions, return a dict txid -> tx hex
+
+        Duplicated txids are fetched once.
+        """
+        txids = list(dict.fromkeys(txids))
+        return dict(zip(txids, self.map(self.get_tx_hex, txids, max_workers)))
+
+    def get_txs_status(self, txids, max_workers=None):
+        """Fetch the status of many transactions, return a dict txid -> status as get_tx_status"""
+        txids = list(dict.fromkeys(txids))
+        return dict(zip(txids, self.map(self.get_tx_status, txids, max_workers)))
+
+
+def _txid(tx_hex):
+    return b2h_rev(wally.tx_get_txid(wally.tx_from_hex(tx_hex, TX_FLAGS)))
+
+
+class ElementsRpc(ChainBackend):
+    """Elements node JSON-RPC backend
+
+    Batch methods send a single JSON-RPC batch request, of at most
+    batch_size calls. Utxos come from scantxoutset, so only confirmed ones
+    are found. Transactions are fetched with gettransaction, so the node
+    wallet must watch the addresses, or with getrawtransaction if the node
+    has -txindex. Address transaction counts come from the node wallet.
+
+    The node has no address index, so address histories, and with them
+    Wallet.history, are not supported: get_address_txs_chain raises
+    NotImplementedError, use Esplora for them.
+    """
+
+    def __init__(self, url, user=None, password=None, network=LIQUID_TESTNET, timeout=60,
+                 batch_size=DEFAULT_RPC_BATCH_SIZE):
+        self.url = url
+        self.network = network
+        self.timeout = timeout
+        self.batch_size = batch_size
+        self.session = requests.Session()
+        if user is not None:
+            self.session.auth = (user, password)
+        self._id = 0
+
+    def _post(self, payload):
+        start = time.perf_counter()
+        r = self.session.post(self.url, json=payload, timeout=self.timeout)
+        if metrics.enabled():
+            route = 'batch' if isinstance(payload, list) else payload['method']
+            metrics.observe('http_request_seconds', time.perf_counter() - start, backend='rpc', route=route)
+            metrics.count('http_response_bytes', len(r.content), backend='rpc')
+        if r.status_code not in (200, 404, 500):
+            # The node replies 404 and 500 with a JSON-RPC error
+            r.raise_for_status()
+        return r.json(parse_float=Decimal)
+
+    @staticmethod
+    def _result(response):
+        if response.get('error'):
+            error = response['error']
+            return RpcError(error.get('message'), error.get('code'))
+        return response.get('result')
+
+    def call(self, method, *params):
+        self._id += 1
+        result = self._result(self._post({'jsonrpc': '1.0', 'id': self._id, 'method': method, 'params': list(params)}))
+        if isinstance(result, RpcError):
+            raise result
+        return result
+
+    def batch(self, calls):
+        """Run (method, params) calls in JSON-RPC batches, return their results in order
+
+        Failed calls are returned as RpcError instances, not raised.
+        """
+        results = []
+        calls = list(calls)
+        for start in range(0, len(calls), self.batch_size):
+            payload = [{'jsonrpc': '1.0', 'id': i, 'method': method, 'params': list(params)}
+                       for i, (method, params) in enumerate(calls[start:start + self.batch_size], start)]
+            by_id = {response['id']: self._result(response) for response in self._post(payload)}
+            results.extend(by_id[i] for i in range(start, start + len(payload)))
+        return results
+
+    def get_address_utxos(self, address):
+        return self.get_addresses_utxos([address])[0]
+
+    def get_addresses_utxos(self, addresses, max_workers=None):
+        addresses = list(addresses)
+        scriptpubkeys = [b2h(self.network.parse_address(address)[0]) for address in addresses]
+        if not scriptpubkeys:
+            return []
+        found = self.call('scantxoutset', 'start', ['raw({})'.format(spk) for spk in dict.fromkeys(scriptpubkeys)])
+        by_script = {}
+        for unspent in found.get('unspents', []):
+            utxo = {
+                'txid': unspent['txid'],
+                'vout': unspent['vout'],
+                'status': {'confirmed': True, 'block_height': unspent.get('height')},
+            }
+            if 'amount' in unspent and 'asset' in unspent:
+                utxo.update(value=int(Decimal(unspent['amount']) * 10**8), asset=unspent['asset'])
+            by_script.setdefault(unspent['scriptPubKey'], []).append(utxo)
+        return [by_script.get(spk, []) for spk in scriptpubkeys]
+
+    def get_address_tx_count(self, address):
+        return self.get_address_tx_counts([address])[0]
+
+    def get_address_tx_counts(self, addresses, max_workers=None):
+        received = self.call('listreceivedbyaddress', 0, True, True)
+        counts = {}
+        for entry in received:
+            for key in ('address', 'unconfidential', 'confidential'):
+                if entry.get(key):
+                    counts[entry[key]] = len(entry.get('txids', []))
+        return [counts.get(address, 0) for address in addresses]
+
+    def get_address_txs_chain(self, address, last_seen=None):
+        raise NotImplementedError('ElementsRpc has no address history, use Esplora to walk the history')
+
+    def get_tx_hex(self, txid):
+        return self.get_txs_hex([txid])[txid]
+
+    def get_txs_hex(self, txids, max_workers=None):
+        txids = list(dict.fromkeys(txids))
+        results = dict(zip(txids, self.batch(('gettransaction', [txid, True]) for txid in txids)))
+        missing = [txid for txid, result in results.items() if isinstance(result, RpcError)]
+        for txid, result in zip(missing, self.batch(('getrawtransaction', [txid]) for txid in missing)):
+            if isinstance(result, RpcError):
+                raise result
+            results[txid] = {'hex': result}
+        return {txid: result['hex'] for txid, result in results.items()}
+
+    def get_tx_status(self, txid):
+        return self.get_txs_status([txid])[txid]
+
+    def get_txs_status(self, txids, max_workers=None):
+        txids = list(dict.fromkeys(txids))
+        results = self.batch([('getblockcount', [])] + [('getrawtransaction', [txid, True]) for txid in txids])
+        tip = results[0]
+        statuses = {}
+        for txid, result in zip(txids, results[1:]):
+            if isinstance(result, RpcError):
+                statuses[txid] = None
+            elif result.get('confirmations'):
+                statuses[txid] = {'confirmed': True, 'block_height': tip - result['confirmations'] + 1}
+            else:
+                statuses[txid] = {'confirmed': False}
+        return statuses
+
+    def broadcast(self, tx_hex):
+        try:
+            return self.call('sendrawtransaction', tx_hex)
+        except RpcError as e:
+            if e.code == RPC_VERIFY_ALREADY_IN_CHAIN or any(message in str(e) for message in ALREADY_IN_MEMPOOL):
+                return _txid(tx_hex)
+            raise BroadcastError(str(e))
+        except requests.RequestException as e:
+            raise BroadcastError(str(e), retry=True)
+
+    def get_tip_height(self):
+        return self.call('getblockcount')
+
+    def get_fee_estimates(self):
+        estimates = {}
+        for target, result in zip(FEE_TARGETS, self.batch(('estimatesmartfee', [target]) for target in FEE_TARGETS)):
+            if not isinstance(result, RpcError) and 'feerate' in result:
+                # BTC/kvB to sat/vB
+                estimates[target] = float(result['feerate'] * 10**5)
+        return estimates
@@ -0,0 +1,187 @@
+import queue
+import threading
+import wallycore as wally
+
+from selw.exceptions import BroadcastError
+from selw.pset import TX_FLAGS, as_builder
+from selw.utils import b2h_rev
+
+QUEUED = 'queued'
+SENT = 'sent'
+CONFIRMED = 'confirmed'
+FAILED = 'failed'
+DROPPED = 'dropped'
+
+DEFAULT_QUEUE_SIZE = 1000
+DEFAULT_RETRIES = 5
+DEFAULT_BACKOFF = 0.5  # seconds, doubled at every retry
+DEFAULT_MAX_BACKOFF = 30
+# Polls not finding a sent transaction before it is considered dropped
+DEFAULT_DROP_AFTER = 3
+
+
+class Broadcast(object):
+    """A transaction submitted to a BroadcastQueue and its state"""
+
+    def __init__(self, tx_hex):
+        self.tx_hex = tx_hex
+        self.txid = b2h_rev(wally.tx_get_txid(wally.tx_from_hex(tx_hex, TX_FLAGS)))
+        self.state = QUEUED
+        self.attempts = 0
+        self.error = None
+        self.block_height = None
+        self.missing = 0
+        self.done = threading.Event()
+
+    def __repr__(self):
+        return 'Broadcast({}, {})'.format(self.txid, self.state)
+
+
+class BroadcastQueue(object):
+    """Broadcast transactions from a bounded queue with worker threads
+
+    Workers send transactions with the backend, a ChainBackend such as the
+    Esplora client, whose keep-alive connections are pooled, retrying
+    temporary failures with exponential backoff. Transactions the server
+    already knows count as sent.
+
+    poll checks the status of the sent transactions in a batch. If wallet
+    is given, submitted transactions are added to it as pending, so that
+    their change can be spent at once, then confirmed, or dropped if the
+    transaction failed or left the mempool. Wallet updates happen in
+    submit and poll, in the caller's thread.
+    """
+
+    def __init__(self, backend, wallet=None, maxsize=DEFAULT_QUEUE_SIZE, workers=1, retries=DEFAULT_RETRIES,
+                 backoff=DEFAULT_BACKOFF, max_backoff=DEFAULT_MAX_BACKOFF, drop_after=DEFAULT_DROP_AFTER):
+        self.backend = backend
+        self.wallet = wallet
+        self.queue = queue.Queue(maxsize)
+        self.workers = workers
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.drop_after = drop_after
+        self.broadcasts = {}  # txid -> Broadcast, not confirmed nor released yet
+        self.lock = threading.Lock()
+        self._stop = threading.Event()
+        self._threads = []
+
+    def start(self):
+        self._stop.clear()
+        self._threads = [threading.Thread(target=self._work, daemon=True) for _ in range(self.workers)]
+        for thread in self._threads:
+            thread.start()
+        return self
+
+    def stop(self):
+        """Stop the workers, transactions still queued are not sent"""
+        self._stop.set()
+        for _ in self._threads:
+            self.queue.put(None)
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def submit(self, tx_hex, block=True, timeout=None):
+        """Queue a finalized transaction, return its Broadcast
+
+        If the queue is full, wait for a free slot, or raise queue.Full if
+        block is False or timeout expires.
+        """
+        broadcast = Broadcast(tx_hex)
+        with self.lock:
+            if broadcast.txid in self.broadcasts:
+                return self.broadcasts[broadcast.txid]
+            self.broadcasts[broadcast.txid] = broadcast
+        try:
+            self.queue.put(broadcast, block, timeout)
+        except queue.Full:
+            with self.lock:
+                del self.broadcasts[broadcast.txid]
+            raise
+        if self.wallet is not None:
+            self.wallet.add_pending_tx(tx_hex)
+        return broadcast
+
+    def submit_psbt(self, psbt, block=True, timeout=None):
+        """Finalize a signed psbt and queue its transaction"""
+        builder = as_builder(psbt)
+        builder.finalize()
+        return self.submit(builder.tx_hex(), block, timeout)
+
+    def _work(self):
+        while True:
+            broadcast = self.queue.get()
+            if broadcast is None:
+                return
+            self._send(broadcast)
+
+    def _send(self, broadcast):
+        """Send broadcast until it is sent or fails, unexpected errors and stopping count as failures"""
+        try:
+            while not self._stop.is_set():
+                broadcast.attempts += 1
+                try:
+                    self.backend.broadcast(broadcast.tx_hex)
+                except BroadcastError as e:
+                    broadcast.error = e
+                    if e.retry and broadcast.attempts <= self.retries:
+                        self._stop.wait(min(self.backoff * 2 ** (broadcast.attempts - 1), self.max_backoff))
+                        continue
+                    broadcast.state = FAILED
+                except Exception as e:
+                    broadcast.error = e
+                    broadcast.state = FAILED
+                else:
+                    broadcast.error = None
+                    broadcast.state = SENT
+                return
+            broadcast.error = broadcast.error or BroadcastError('Stopped before the transaction was sent')
+            broadcast.state = FAILED
+        finally:
+            broadcast.done.set()
+
+    def pending(self):
+        """Broadcasts neither confirmed nor released"""
+        with self.lock:
+            return list(self.broadcasts.values())
+
+    def poll(self, max_workers=None):
+        """Update the state of the sent transactions, return the broadcasts that reached a final state
+
+        Statuses are fetched in one batch. Failed transactions, and sent ones
+        the server did not know drop_after polls in a row, are dropped from
+        the wallet.
+        """
+        broadcasts = self.pending()
+        sent = [b for b in broadcasts if b.state == SENT]
+        statuses = self.backend.get_txs_status([b.txid for b in sent], max_workers) if sent else {}
+        for broadcast in sent:
+            status = statuses[broadcast.txid]
+            if status is None:
+                broadcast.missing += 1
+                if broadcast.missing >= self.drop_after:
+                    broadcast.state = DROPPED
+            else:
+                broadcast.missing = 0
+                if status.get('confirmed'):
+                    broadcast.state = CONFIRMED
+                    broadcast.block_height = status.get('block_height')
+
+        finished = [b for b in broadcasts if b.state in (CONFIRMED, FAILED, DROPPED)]
+        for broadcast in finished:
+            if self.wallet is not None:
+                if broadcast.state == CONFIRMED:
+                    self.wallet.confirm_pending_tx(broadcast.txid, broadcast.block_height)
+                else:
+                    self.wallet.drop_pending_tx(broadcast.txid)
+            with self.lock:
+                self.broadcasts.pop(broadcast.txid, None)
+        return finished
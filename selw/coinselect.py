@@ -0,0 +1,214 @@
+import random
+from bisect import bisect_left
+
+from selw.exceptions import InsufficientFunds
+
+BNB = 'bnb'
+LARGEST_FIRST = 'largest_first'
+KNAPSACK = 'knapsack'
+
+BNB_MAX_TRIES = 100000
+KNAPSACK_ITERATIONS = 100
+# Knapsack only looks at the largest candidates below the target
+KNAPSACK_MAX_CANDIDATES = 1000
+
+
+class UtxoIndex(object):
+    """UTXOs sorted by value, for each asset
+
+    For each asset, values are kept in a list sorted ascending, so that
+    selection does not need to sort nor to build it again.
+    """
+
+    def __init__(self, utxos=()):
+        self.keys = {}  # asset -> sorted [(value, txid, vout)]
+        self._values = {}  # asset -> [value], parallel to keys
+        self.utxos = {}  # (txid, vout) -> utxo
+        # Bulk load sorting once, rather than inserting one at a time
+        for utxo in utxos:
+            outpoint = (bytes(utxo.txid), utxo.vout)
+            if outpoint not in self.utxos:
+                self.utxos[outpoint] = utxo
+                self.keys.setdefault(bytes(utxo.asset), []).append((utxo.value, *outpoint))
+        for asset, keys in self.keys.items():
+            keys.sort()
+            self._values[asset] = [key[0] for key in keys]
+
+    def __len__(self):
+        return len(self.utxos)
+
+    def add(self, utxo):
+        outpoint = (bytes(utxo.txid), utxo.vout)
+        if outpoint in self.utxos:
+            return
+        self.utxos[outpoint] = utxo
+        asset = bytes(utxo.asset)
+        keys = self.keys.setdefault(asset, [])
+        key = (utxo.value, *outpoint)
+        i = bisect_left(keys, key)
+        keys.insert(i, key)
+        self._values.setdefault(asset, []).insert(i, utxo.value)
+
+    def remove(self, utxo):
+        outpoint = (bytes(utxo.txid), utxo.vout)
+        if self.utxos.pop(outpoint, None) is None:
+            return
+        asset = bytes(utxo.asset)
+        keys = self.keys[asset]
+        i = bisect_left(keys, (utxo.value, *outpoint))
+        del keys[i]
+        del self._values[asset][i]
+
+    def values(self, asset):
+        """Values of asset (32 bytes) ascending, the returned list must not be modified"""
+        return self._values.get(bytes(asset), [])
+
+    def utxo_at(self, asset, i):
+        """The UTXO with the i-th value of asset"""
+        return self.utxos[self.keys[bytes(asset)][i][1:]]
+
+    def sorted(self, asset):
+        """UTXOs of asset (32 bytes), by ascending value"""
+        return [self.utxos[key[1:]] for key in self.keys.get(bytes(asset), [])]
+
+
+def largest_first(values, target):
+    """Pick the largest values until target is reached
+
+    values are sorted ascending, return the selected indexes.
+    """
+    selected, total = [], 0
+    for i in range(len(values) - 1, -1, -1):
+        if total >= target:
+            break
+        selected.append(i)
+        total += values[i]
+    return selected if total >= target else None
+
+
+def branch_and_bound(values, target, cost_of_change=0, max_tries=BNB_MAX_TRIES):
+    """Depth first search for a subset summing to [target, target + cost_of_change]
+
+    Among the subsets found within max_tries, the one with the lowest excess is
+    returned, so that no change output is needed.
+    values are sorted ascending, return the selected indexes or None.
+    """
+    # Explore the largest values first
+    order = list(range(len(values) - 1, -1, -1))
+    pool = [values[i] for i in order]
+    available = sum(pool)
+    if available < target:
+        return None
+    selection, value = [], 0
+    best, best_excess = None, None
+    i = 0
+    for _ in range(max_tries):
+        backtrack = False
+        if value + available < target or value > target + cost_of_change:
+            backtrack = True
+        elif value >= target:
+            excess = value - target
+            if best is None or excess < best_excess:
+                best, best_excess = list(selection), excess
+                if excess == 0:
+                    break
+            backtrack = True
+
+        if backtrack:
+            if not selection:
+                break
+            # Restore the values skipped after the last included one, then exclude it
+            i -= 1
+            while i > selection[-1]:
+                available += pool[i]
+                i -= 1
+            value -= pool[i]
+            selection.pop()
+        else:
+            available -= pool[i]
+            # Excluding a value and including an equal one is pointless
+            if not selection or i - 1 == selection[-1] or pool[i] != pool[i - 1]:
+                selection.append(i)
+                value += pool[i]
+        i += 1
+    return None if best is None else [order[j] for j in best]
+
+
+def knapsack(values, target, iterations=KNAPSACK_ITERATIONS, rng=random):
+    """Stochastic approximation of the smallest subset sum above target
+
+    Follows Bitcoin Core's knapsack solver: use the single smallest value above
+    target unless a combination of smaller values gets closer to it.
+    values are sorted ascending, return the selected indexes or None.
+    """
+    larger = bisect_left(values, target)
+    if larger < len(values) and values[larger] == target:
+        return [larger]
+    lowest_larger = larger if larger < len(values) else None
+
+    start = max(0, larger - KNAPSACK_MAX_CANDIDATES)
+    candidates = values[start:larger]
+    total_lower = sum(candidates)
+    if total_lower < target:
+        if lowest_larger is not None:
+            return [lowest_larger]
+        # Many small values, the capped candidates may not be enough but all of them are
+        return largest_first(values, target)
+    if total_lower == target:
+        return list(range(start, larger))
+
+    n = len(candidates)
+    best, best_value = [True] * n, total_lower
+    for _ in range(iterations):
+        included, total, reached = [False] * n, 0, False
+        for first_pass in (True, False):
+            if reached:
+                break
+            for j in range(n - 1, -1, -1):
+                if (rng.random() < 0.5) if first_pass else not included[j]:
+                    total += candidates[j]
+                    included[j] = True
+                    if total >= target:
+                        reached = True
+                        if total < best_value:
+                            best, best_value = list(included), total
+                        total -= candidates[j]
+                        included[j] = False
+    if lowest_larger is not None and best_value != target and values[lowest_larger] <= best_value:
+        return [lowest_larger]
+    return [start + j for j in range(n) if best[j]]
+
+
+def select(values, target, strategy=BNB, cost_of_change=0):
+    """Select from values, sorted ascending, enough to pay target, return their indexes
+
+    BNB falls back to KNAPSACK if there is no selection avoiding change.
+    """
+    if strategy == LARGEST_FIRST:
+        selected = largest_first(values, target)
+    elif strategy == KNAPSACK:
+        selected = knapsack(values, target)
+    elif strategy == BNB:
+        selected = branch_and_bound(values, target, cost_of_change)
+        if selected is None:
+            selected = knapsack(values, target)
+    else:
+        raise ValueError('Unknown strategy: {}'.format(strategy))
+    if selected is None:
+        raise InsufficientFunds('Need {}, have {}'.format(target, sum(values)))
+    return sorted(selected)
+
+
+def select_coins(index, targets, strategy=BNB, cost_of_change=0):
+    """Select utxos from index (UtxoIndex) paying targets, a dict asset (32 bytes) -> amount
+
+    Each asset is selected on its own, fees must be included in the policy
+    asset target. cost_of_change is the excess tolerated to avoid a change
+    output, only for BNB.
+    """
+    selected = []
+    for asset, target in targets.items():
+        if target > 0:
+            indexes = select(index.values(asset), target, strategy, cost_of_change)
+            selected += [index.utxo_at(asset, i) for i in indexes]
+    return selected
@@ -0,0 +1,187 @@
+import threading
+import wallycore as wally
+
+from selw.exceptions import InsufficientFunds
+from selw.fee import DEFAULT_FEERATE, DEFAULT_TARGET, fee_for, input_vsize
+from selw.pool import DEFAULT_LEASE
+from selw.utils import b2h_rev, h2b_rev
+
+# Assets with more utxos than this, not reserved, are consolidated
+DEFAULT_MIN_UTXOS = 50
+# Utxos left for each consolidated asset, so that concurrent payments do not wait on a single one
+DEFAULT_TARGET_UTXOS = 10
+# Inputs of a sweep, well within MAX_STANDARD_VSIZE for both output types
+DEFAULT_MAX_INPUTS = 200
+DEFAULT_MAX_FEERATE = DEFAULT_FEERATE
+DEFAULT_INTERVAL = 600  # seconds
+
+
+class Sweep(object):
+    """A consolidation transaction, merging utxos of an asset"""
+
+    def __init__(self, asset_hex, utxos, builder):
+        self.asset_hex = asset_hex
+        self.utxos = utxos
+        self.builder = builder
+        self.value = sum(utxo.value for utxo in utxos)
+        self.fee = None
+        self.txid = None
+        self.broadcast = None
+        self.error = None
+
+    def __repr__(self):
+        return 'Sweep({}, {} utxos, {})'.format(self.asset_hex, len(self.utxos), self.txid)
+
+
+class Consolidator(object):
+    """Merge the small utxos of a wallet into a few large ones, when fees are low
+
+    For each asset with more than min_utxos utxos not reserved, the
+    smallest ones are swept into a single change output, in transactions of
+    at most max_inputs inputs, until about target_utxos are left. Utxos
+    worth max_value (dict asset hex -> value) or more are never swept, nor
+    policy asset utxos worth less than the fee to spend them.
+
+    Sweeps only happen if the feerate to confirm within target blocks is at
+    most max_feerate. They are built, blinded and signed with the wallet,
+    then submitted to queue (BroadcastQueue) or, without a queue, sent with
+    backend and added to the wallet as pending. Either way the utxos they
+    spend leave the wallet at once and payments can spend their outputs
+    before confirmation.
+
+    run_once does one round and reports it, start runs one every interval
+    seconds in a thread.
+    """
+
+    def __init__(self, wallet, backend, queue=None, min_utxos=DEFAULT_MIN_UTXOS, target_utxos=DEFAULT_TARGET_UTXOS,
+                 max_inputs=DEFAULT_MAX_INPUTS, max_feerate=DEFAULT_MAX_FEERATE, max_value=None, target=DEFAULT_TARGET,
+                 interval=DEFAULT_INTERVAL, lease=DEFAULT_LEASE):
+        assert max_inputs > 1, "A sweep needs at least 2 inputs"
+        self.wallet = wallet
+        self.backend = wallet.backend(backend)
+        self.queue = queue
+        self.min_utxos = min_utxos
+        self.target_utxos = target_utxos
+        self.max_inputs = max_inputs
+        self.max_feerate = max_feerate
+        self.max_value = {bytes(h2b_rev(asset_hex)): value for asset_hex, value in (max_value or {}).items()}
+        self.target = target
+        self.interval = interval
+        self.lease = lease
+        self.report = None  # of the last round
+        self.error = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def utxo_counts(self):
+        """Dict asset hex -> number of utxos not reserved"""
+        with self.wallet.pool.lock:
+            index = self.wallet.pool.index
+            return {b2h_rev(asset): len(keys) for asset, keys in index.keys.items() if keys}
+
+    def plan(self, feerate):
+        """Return the utxos to sweep, as lists of at most max_inputs utxos of the same asset
+
+        The utxos are not reserved, hold the pool lock until they are.
+        """
+        pool = self.wallet.pool
+        policy_asset = self.wallet.network.policy_asset
+        chunks = []
+        with pool.lock:
+            pool.expire()
+            for asset in list(pool.index.keys):
+                values = pool.index.values(asset)
+                if len(values) <= self.min_utxos:
+                    continue
+                max_value = self.max_value.get(asset)
+                utxos = pool.index.sorted(asset)[:len(values) - self.target_utxos]
+                candidates = [utxo for utxo in utxos if max_value is None or utxo.value < max_value]
+                if asset == policy_asset:
+                    candidates = [utxo for utxo in candidates if utxo.value > fee_for(input_vsize(utxo.output), feerate)]
+                for i in range(0, len(candidates), self.max_inputs):
+                    chunk = candidates[i:i + self.max_inputs]
+                    if len(chunk) > 1:
+                        chunks.append(chunk)
+        return chunks
+
+    def _sweep(self, utxos, feerate):
+        w = self.wallet
+        sweep = Sweep(b2h_rev(utxos[0].asset), utxos, None)
+        try:
+            builder = w.build_sweep_psbt(utxos, feerate, self.lease)
+        except InsufficientFunds as e:
+            # Not enough of the policy asset for the fee
+            sweep.error = e
+            return sweep
+        sweep.builder = builder
+        # The fee output is the last one
+        sweep.fee = wally.psbt_get_output_amount(builder.psbt, builder.num_outputs - 1)
+        try:
+            w.blind_psbt(builder, builder.utxos)
+            w.sign_psbt(builder, builder.utxos)
+            if self.queue is not None:
+                sweep.broadcast = self.queue.submit_psbt(builder)
+                sweep.txid = sweep.broadcast.txid
+                return sweep
+            builder.finalize()
+            tx_hex = builder.tx_hex()
+            sweep.txid = self.backend.broadcast(tx_hex)
+        except Exception as e:
+            # Not sent, the other sweeps go on
+            sweep.error = e
+            w.release_utxos(builder.utxos)
+            return sweep
+        w.add_pending_tx(tx_hex)
+        return sweep
+
+    def run_once(self):
+        """Sweep if fees are low enough, return a report dict
+
+        The report has the feerate, the number of utxos not reserved for
+        each asset before and after, the sweeps and their total fee.
+        """
+        feerate = self.wallet.feerate(self.backend, self.target)
+        before = self.utxo_counts()
+        sweeps = []
+        if feerate <= self.max_feerate:
+            pool = self.wallet.pool
+            with pool.lock:
+                chunks = self.plan(feerate)
+                for chunk in chunks:
+                    pool.reserve(chunk, self.lease)
+            sweeps = [self._sweep(chunk, feerate) for chunk in chunks]
+        report = {
+            'feerate': feerate,
+            'utxos_before': before,
+            'utxos_after': self.utxo_counts(),
+            'sweeps': sweeps,
+            'fee': sum(s.fee for s in sweeps if s.txid is not None),
+        }
+        self.report = report
+        return report
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.run_once()
+            except Exception as e:
+                # Kept for the caller, e.g. the server is down, the next round tries again
+                self.error = e
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
@@ -1,3 +1,12 @@
 BECH32_FAMILY_TESTNET_LIQUID = 'tex'
 BLECH32_FAMILY_TESTNET_LIQUID = 'tlq'
 LBTC_HEX = '144c654344aa716d6f3abcc1ca90e5641e4e2a7f633bc09fe3baf64585819a49'
+
+BECH32_FAMILY_LIQUID = 'ex'
+BLECH32_FAMILY_LIQUID = 'lq'
+LBTC_HEX_LIQUID = '6f0279e9ed041c3d710a9f57d0c02928416460c4b722ae3457a11eec381c526d'
+
+BECH32_FAMILY_ELEMENTS_REGTEST = 'ert'
+BLECH32_FAMILY_ELEMENTS_REGTEST = 'el'
+# Default policy asset of elementsregtest, it depends on the chain parameters
+POLICY_ASSET_HEX_ELEMENTS_REGTEST = '5ac9f65c0efcc4775e0baec4ec03abdde22473cd3cf33c0419ca290e0751b225'
@@ -0,0 +1,492 @@
+import argparse
+import base64
+import hmac
+import inspect
+import ipaddress
+import json
+import os
+import secrets
+import threading
+import time
+import wallycore as wally
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from selw import metrics
+from selw.backend import ChainBackend, ElementsRpc
+from selw.broadcast import FAILED, BroadcastQueue
+from selw.esplora import Esplora
+from selw.exceptions import BroadcastError, InsufficientFunds, InvalidAddress, RpcError, SewError
+from selw.hdwallet import HDWalletP2wpkh, HDWalletP2wsh2of3
+from selw.key import Bip32Key, parse_origin
+from selw.network import LIQUID_TESTNET, NETWORKS
+from selw.pset import as_builder
+from selw.store import UtxoStore
+from selw.utils import b2h_rev, h2b
+from selw.wallet import WalletP2wpkh, WalletP2wsh2of3
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 18890
+DEFAULT_REFRESH = 30  # seconds between background syncs
+DEFAULT_SEND_TIMEOUT = 30  # seconds send waits for the broadcast
+# User of the generated credentials, as elementsd's -rpccookiefile
+COOKIE_USER = '__cookie__'
+LOCAL_HOSTS = ('localhost', '127.0.0.1', '::1')
+
+# JSON-RPC error codes, as Elements
+RPC_MISC_ERROR = -1
+RPC_PARSE_ERROR = -32700
+RPC_INVALID_REQUEST = -32600
+RPC_METHOD_NOT_FOUND = -32601
+RPC_INVALID_PARAMS = -32602
+RPC_WALLET_ERROR = -4
+RPC_INVALID_ADDRESS = -5
+RPC_WALLET_INSUFFICIENT_FUNDS = -6
+RPC_WALLET_NOT_FOUND = -18
+RPC_VERIFY_REJECTED = -26
+
+
+class LoadedWallet(object):
+    """A wallet served by the daemon, with its BroadcastQueue and sync state"""
+
+    def __init__(self, wallet, backend):
+        self.wallet = wallet
+        self.queue = BroadcastQueue(backend, wallet)
+        self.synced = threading.Event()
+        self.error = None
+
+
+class Daemon(object):
+    """Serve wallets, kept synced in memory, over a local JSON-RPC endpoint
+
+    wallets is a dict name -> Wallet, backend a ChainBackend or an Esplora
+    url. Wallet name is served at http://host:port/wallet/<name>, or at /
+    if it is the only one. Requests, batches too, run concurrently in a
+    thread each, the wallet pool keeps them from spending the same utxos.
+
+    Wallets are synced once when the daemon starts, then every refresh
+    seconds in a background thread, which also polls sent transactions and
+    refreshes fee estimates: requests never wait for a sync.
+
+    Methods, with params by position or by name:
+
+        getbalance [kind]             asset hex -> value, kind as in Wallet.balance
+        listunspent                   utxos, with reserved set if a transaction being built spends them
+        createpset recipients [feerate]   unsigned PSET (base64), utxos are reserved
+        blindpset pset                blinded PSET, inputs must be the wallet's utxos
+        signpset pset                 PSET signed with the wallet keys
+        send recipients [feerate]     build, blind, sign and broadcast, return the txid
+
+    recipients is a list of {"address", "value", "asset"}, asset defaults
+    to the policy asset. feerate (sat/vbyte) defaults to the backend
+    estimate.
+
+    If instrumentation is enabled with a Metrics sink, GET /metrics serves
+    it in the Prometheus text format, and requests are timed by method.
+
+    Every request needs HTTP Basic auth, as elementsd: rpcuser and
+    rpcpassword, or else __cookie__ and a random password, kept in auth and
+    written to cookie_file if given. Requests must have a local Host header
+    (or host), POSTs a JSON Content-Type, so that browsers cannot reach the
+    daemon. Listening on a non loopback host needs rpcuser and rpcpassword.
+    """
+
+    def __init__(self, wallets, backend, host=DEFAULT_HOST, port=DEFAULT_PORT, refresh=DEFAULT_REFRESH,
+                 send_timeout=DEFAULT_SEND_TIMEOUT, rpcuser=None, rpcpassword=None, cookie_file=None):
+        if not _is_loopback(host) and not (rpcuser and rpcpassword):
+            raise ValueError('Listening on {} needs rpcuser and rpcpassword'.format(host))
+        if rpcuser and rpcpassword:
+            self.auth = (rpcuser, rpcpassword)
+        else:
+            self.auth = (COOKIE_USER, secrets.token_hex(32))
+            if cookie_file is not None:
+                _write_cookie(cookie_file, self.auth)
+        self.cookie_file = cookie_file
+        self.hosts = set(LOCAL_HOSTS) | {host}
+        self.backend = backend if isinstance(backend, ChainBackend) else Esplora(backend)
+        self.wallets = {name: LoadedWallet(wallet, self.backend) for name, wallet in wallets.items()}
+        self.refresh = refresh
+        self.send_timeout = send_timeout
+        self.server = ThreadingHTTPServer((host, port), self._handler())
+        self.server.daemon_threads = True
+        self._stop = threading.Event()
+        self._threads = []
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return 'http://{}:{}'.format(host, port)
+
+    def start(self):
+        """Sync the wallets, then serve and refresh them in background threads"""
+        self._stop.clear()
+        for loaded in self.wallets.values():
+            loaded.queue.start()
+        self.sync()
+        self._threads = [threading.Thread(target=self.server.serve_forever, daemon=True),
+                         threading.Thread(target=self._refresh, daemon=True)]
+        for thread in self._threads:
+            thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self.server.shutdown()
+        self.server.server_close()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+        for loaded in self.wallets.values():
+            loaded.queue.stop()
+        if self.cookie_file is not None and self.auth[0] == COOKIE_USER and os.path.exists(self.cookie_file):
+            os.remove(self.cookie_file)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def serve_forever(self):
+        self.start()
+        try:
+            self._stop.wait()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.stop()
+
+    def sync(self):
+        """Sync every wallet and poll its sent transactions, errors are kept in LoadedWallet.error"""
+        for loaded in self.wallets.values():
+            try:
+                loaded.wallet.sync(self.backend)
+                loaded.queue.poll()
+                loaded.wallet.feerate(self.backend)
+                loaded.error = None
+                loaded.synced.set()
+            except Exception as e:
+                # e.g. the server is down, the next refresh tries again
+                loaded.error = e
+
+    def _refresh(self):
+        while not self._stop.wait(self.refresh):
+            self.sync()
+
+    def _wallet(self, path):
+        parts = path.strip('/').split('/')
+        if parts == [''] and len(self.wallets) == 1:
+            return next(iter(self.wallets.values()))
+        if len(parts) == 2 and parts[0] == 'wallet' and parts[1] in self.wallets:
+            return self.wallets[parts[1]]
+        raise RpcError('Wallet not found: {}'.format(path), RPC_WALLET_NOT_FOUND)
+
+    def _call(self, loaded, method, params):
+        func = getattr(self, 'rpc_' + method, None) if isinstance(method, str) else None
+        if func is None:
+            raise RpcError('Method not found: {}'.format(method), RPC_METHOD_NOT_FOUND)
+        args, kwargs = (params, {}) if isinstance(params, list) else ([], params or {})
+        try:
+            inspect.signature(func).bind(loaded, *args, **kwargs)
+        except TypeError as e:
+            raise RpcError(str(e), RPC_INVALID_PARAMS)
+        try:
+            return func(loaded, *args, **kwargs)
+        except RpcError:
+            raise
+        except InsufficientFunds as e:
+            raise RpcError(str(e), RPC_WALLET_INSUFFICIENT_FUNDS)
+        except InvalidAddress as e:
+            raise RpcError(str(e) or 'Invalid address', RPC_INVALID_ADDRESS)
+        except BroadcastError as e:
+            raise RpcError(str(e), RPC_VERIFY_REJECTED)
+        except (ValueError, KeyError) as e:
+            raise RpcError(str(e), RPC_INVALID_PARAMS)
+        except SewError as e:
+            raise RpcError(str(e) or type(e).__name__, RPC_WALLET_ERROR)
+
+    def handle(self, path, request):
+        """Return the JSON-RPC response to request, a dict, for the wallet at path"""
+        if not isinstance(request, dict):
+            return {'result': None, 'error': {'code': RPC_INVALID_REQUEST, 'message': 'Invalid request'}, 'id': None}
+        if not metrics.enabled():
+            return self._handle(path, request)
+        start = time.perf_counter()
+        response = self._handle(path, request)
+        method = request.get('method')
+        # Unknown methods share a label, a client cannot add series
+        method = method if isinstance(method, str) and hasattr(self, 'rpc_' + method) else 'unknown'
+        metrics.observe('rpc_request_seconds', time.perf_counter() - start, method=method)
+        if response['error'] is not None:
+            metrics.count('rpc_errors', method=method, code=response['error']['code'])
+        return response
+
+    def _handle(self, path, request):
+        try:
+            result = self._call(self._wallet(path), request.get('method'), request.get('params'))
+            return {'result': result, 'error': None, 'id': request.get('id')}
+        except RpcError as e:
+            error = {'code': e.code, 'message': str(e)}
+        except Exception as e:
+            error = {'code': RPC_MISC_ERROR, 'message': '{}: {}'.format(type(e).__name__, e)}
+        return {'result': None, 'error': error, 'id': request.get('id')}
+
+    def _handler(self):
+        daemon = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def _allowed(self, post=False):
+                """Check Host, credentials and Content-Type, reply with an error if they are not right"""
+                if _host_name(self.headers.get('Host', '')) not in daemon.hosts:
+                    self.send_error(403, 'Host not allowed')
+                    return False
+                if not daemon.authorized(self.headers.get('Authorization')):
+                    self.send_response(401)
+                    self.send_header('WWW-Authenticate', 'Basic realm="jsonrpc"')
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return False
+                content_type = self.headers.get('Content-Type', '').split(';')[0].strip().lower()
+                if post and content_type != 'application/json':
+                    self.send_error(415, 'Content-Type must be application/json')
+                    return False
+                return True
+
+            def do_GET(self):
+                if not self._allowed():
+                    return
+                sink = metrics.sink()
+                if self.path != '/metrics' or not isinstance(sink, metrics.Metrics):
+                    self.send_error(404)
+                    return
+                body = metrics.prometheus(sink).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', metrics.PROMETHEUS_CONTENT_TYPE)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_POST(self):
+                if not self._allowed(post=True):
+                    return
+                body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                try:
+                    request = json.loads(body)
+                except ValueError:
+                    response = {'result': None, 'error': {'code': RPC_PARSE_ERROR, 'message': 'Parse error'}, 'id': None}
+                else:
+                    if isinstance(request, list):
+                        response = [daemon.handle(self.path, r) for r in request]
+                    else:
+                        response = daemon.handle(self.path, request)
+                body = json.dumps(response).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        return Handler
+
+    def authorized(self, header):
+        """Whether the Authorization header has the daemon credentials"""
+        if not header or not header.startswith('Basic '):
+            return False
+        try:
+            credentials = base64.b64decode(header[len('Basic '):], validate=True)
+        except ValueError:
+            return False
+        expected = '{}:{}'.format(*self.auth).encode()
+        return hmac.compare_digest(credentials, expected)
+
+    @staticmethod
+    def _recipients(wallet, recipients):
+        if not isinstance(recipients, list) or not recipients:
+            raise RpcError('recipients must be a non empty list', RPC_INVALID_PARAMS)
+        parsed = []
+        for r in recipients:
+            if not isinstance(r, dict) or 'address' not in r or 'value' not in r:
+                raise RpcError('Invalid recipient: {}, needs address and value'.format(r), RPC_INVALID_PARAMS)
+            asset_hex, value = r.get('asset', wallet.network.policy_asset_hex), r['value']
+            if isinstance(value, bool) or not isinstance(value, int) or value <= 0:
+                raise RpcError('Invalid value: {}, must be a positive integer'.format(value), RPC_INVALID_PARAMS)
+            if not isinstance(asset_hex, str) or len(asset_hex) != 64 or not _is_hex(asset_hex):
+                raise RpcError('Invalid asset: {}'.format(asset_hex), RPC_INVALID_PARAMS)
+            parsed.append((r['address'], asset_hex.lower(), value))
+        return parsed
+
+    def _feerate(self, wallet, feerate):
+        return wallet.feerate(self.backend) if feerate is None else float(feerate)
+
+    @staticmethod
+    def _input_utxos(wallet, builder):
+        """The wallet utxos spent by builder, in input order"""
+        utxos = []
+        for idx in range(builder.num_inputs):
+            outpoint = (b2h_rev(wally.psbt_get_input_previous_txid(builder.psbt, idx)),
+                        wally.psbt_get_input_output_index(builder.psbt, idx))
+            utxo = wallet.pool.get(outpoint)
+            if utxo is None:
+                raise RpcError('Input {} does not spend a wallet utxo'.format(idx), RPC_WALLET_ERROR)
+            utxos.append(utxo)
+        return utxos
+
+    def rpc_getbalance(self, loaded, kind='total'):
+        return loaded.wallet.balance(kind)
+
+    def rpc_listunspent(self, loaded):
+        pool = loaded.wallet.pool
+        with pool.lock:
+            return [{
+                'txid': utxo.outpoint[0],
+                'vout': utxo.vout,
+                'asset': b2h_rev(utxo.asset),
+                'value': utxo.value,
+                'height': utxo.height,
+                'reserved': utxo.outpoint in pool.leases,
+            } for utxo in pool.utxos()]
+
+    def rpc_createpset(self, loaded, recipients, feerate=None):
+        w = loaded.wallet
+        return w.build_batch_psbt(None, self._recipients(w, recipients), self._feerate(w, feerate)).to_base64()
+
+    def rpc_blindpset(self, loaded, pset):
+        builder = as_builder(pset)
+        builder.utxos = self._input_utxos(loaded.wallet, builder)
+        return loaded.wallet.blind_psbt(builder, builder.utxos).to_base64()
+
+    def rpc_signpset(self, loaded, pset):
+        return loaded.wallet.sign_psbt(pset)
+
+    def rpc_send(self, loaded, recipients, feerate=None):
+        w = loaded.wallet
+        builder = w.build_batch_psbt(None, self._recipients(w, recipients), self._feerate(w, feerate))
+        try:
+            w.blind_psbt(builder, builder.utxos)
+            w.sign_psbt(builder)
+            broadcast = loaded.queue.submit_psbt(builder)
+        except Exception:
+            w.release_utxos(builder.utxos)
+            raise
+        broadcast.done.wait(self.send_timeout)
+        if broadcast.state == FAILED:
+            raise broadcast.error
+        return broadcast.txid
+
+
+def load_wallet(config, network=LIQUID_TESTNET):
+    """Wallet from a config dict, see main"""
+    store = UtxoStore(config['store']) if config.get('store') else None
+    blinding_key = h2b(config['blinding_key'])
+    kind = config['type']
+    if kind == 'p2wpkh':
+        return WalletP2wpkh(h2b(config['private_key']), blinding_key, store, network)
+    if kind == 'p2wsh2of3':
+        return WalletP2wsh2of3([h2b(key) for key in config['keys']], blinding_key, store, network)
+    if kind == 'hd_p2wpkh':
+        origin = parse_origin(config['origin']) if config.get('origin') else None
+        return HDWalletP2wpkh(Bip32Key.from_b58(config['account']), blinding_key, store=store, network=network, origin=origin)
+    if kind == 'hd_p2wsh2of3':
+        accounts = [Bip32Key.from_b58(account) for account in config['accounts']]
+        origins = [parse_origin(origin) if origin else None for origin in config.get('origins', [None] * 3)]
+        return HDWalletP2wsh2of3(accounts, blinding_key, store=store, network=network, origins=origins)
+    raise ValueError('Unknown wallet type: {}'.format(kind))
+
+
+def _is_loopback(host):
+    if host == 'localhost':
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+
+def _is_hex(s):
+    try:
+        bytes.fromhex(s)
+    except ValueError:
+        return False
+    return True
+
+
+def _host_name(header):
+    """Host of a Host header, without the port"""
+    if header.startswith('['):
+        return header[1:header.find(']')]
+    return header.rsplit(':', 1)[0] if header.count(':') == 1 else header
+
+
+def _write_cookie(path, auth):
+    """Write user:password to path, readable by the owner only"""
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, 'w') as f:
+        f.write('{}:{}'.format(*auth))
+
+
+def load_backend(config, network=LIQUID_TESTNET):
+    """ChainBackend from an Esplora url or a dict with the rpc url, user and password of an Elements node"""
+    if isinstance(config, str):
+        return Esplora(config)
+    return ElementsRpc(config['rpc'], config.get('user'), config.get('password'), network)
+
+
+def main():
+    """Run the daemon
+
+        selw-daemon --config daemon.json [--host 127.0.0.1] [--port 18890] [--refresh 30] [--metrics]
+                    [--rpcuser user --rpcpassword password] [--rpccookiefile path]
+
+    The config is a JSON object:
+
+        {"network": "liquidtestnet",
+         "backend": "https://blockstream.info/liquidtestnet",
+         "wallets": {"hot": {"type": "p2wpkh", "private_key": hex, "blinding_key": hex, "store": "hot.sqlite"}}}
+
+    backend can also be {"rpc": url, "user": user, "password": password}.
+    Wallet types are p2wpkh (private_key), p2wsh2of3 (keys, 3 private or
+    public keys), hd_p2wpkh (account, an extended key, and origin, its
+    master fingerprint and path as d34db33f/84h/1h/0h) and hd_p2wsh2of3
+    (accounts and origins), store and origins are optional. With --metrics, the wallet stages and
+    the libwally calls are instrumented and served at /metrics.
+
+    Clients authenticate with --rpcuser and --rpcpassword, or rpcuser and
+    rpcpassword in the config, else with the __cookie__ credentials written
+    to --rpccookiefile, by default .cookie next to the config.
+    """
+    parser = argparse.ArgumentParser(description='Serve selw wallets over a local JSON-RPC endpoint')
+    parser.add_argument('--config', required=True)
+    parser.add_argument('--host', default=DEFAULT_HOST)
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--refresh', type=float, default=DEFAULT_REFRESH)
+    parser.add_argument('--metrics', action='store_true', help='serve Prometheus metrics at /metrics')
+    parser.add_argument('--rpcuser')
+    parser.add_argument('--rpcpassword')
+    parser.add_argument('--rpccookiefile')
+    args = parser.parse_args()
+
+    if args.metrics:
+        metrics.enable(wally_calls=True)
+
+    with open(args.config) as f:
+        config = json.load(f)
+    network = NETWORKS[config.get('network', LIQUID_TESTNET.name)]
+    wallets = {name: load_wallet(wallet, network) for name, wallet in config['wallets'].items()}
+    rpcuser = args.rpcuser or config.get('rpcuser')
+    rpcpassword = args.rpcpassword or config.get('rpcpassword')
+    cookie_file = args.rpccookiefile or os.path.join(os.path.dirname(os.path.abspath(args.config)), '.cookie')
+    try:
+        daemon = Daemon(wallets, load_backend(config['backend'], network), args.host, args.port, args.refresh,
+                        rpcuser=rpcuser, rpcpassword=rpcpassword, cookie_file=cookie_file)
+    except ValueError as e:
+        parser.error(str(e))
+    print('Serving {} on {}'.format(', '.join(sorted(wallets)), daemon.url))
+    if daemon.auth[0] == COOKIE_USER:
+        print('Credentials in {}'.format(cookie_file))
+    daemon.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
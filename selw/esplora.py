@@ -0,0 +1,119 @@
+import requests
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+
+from selw import metrics
+from selw.backend import ChainBackend, _txid
+from selw.exceptions import BroadcastError
+
+DEFAULT_MAX_WORKERS = 8
+# Node errors for transactions already in the mempool or in a block
+ALREADY_KNOWN = ('txn-already-in-mempool', 'txn-already-known', 'already in block chain')
+
+
+def _route(path):
+    """path with addresses and txids replaced by placeholders, for the route label of the request metrics"""
+    parts = path.split('/')
+    if len(parts) > 1 and parts[0] == 'address':
+        parts[1] = ':address'
+    return '/'.join(':txid' if len(part) == 64 else part for part in parts)
+
+
+class Esplora(ChainBackend):
+    """Esplora REST client
+
+    All requests go through a single keep-alive session, whose connection
+    pool is sized to the number of concurrent workers. Batch calls run
+    concurrently, with max_workers workers unless the call asks for another
+    number, the pool then grows to match.
+    """
+
+    def __init__(self, url, max_workers=DEFAULT_MAX_WORKERS, timeout=30):
+        self.url = url.rstrip('/')
+        self.max_workers = max(1, max_workers)
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.pool_size = 0
+        self._pool_lock = threading.Lock()
+        self._size_pool(self.max_workers)
+
+    def _size_pool(self, size):
+        """Make room for size concurrent connections"""
+        with self._pool_lock:
+            if size <= self.pool_size:
+                return
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=size)
+            self.session.mount('http://', adapter)
+            self.session.mount('https://', adapter)
+            self.pool_size = size
+
+    def _request(self, method, path, **kwargs):
+        start = time.perf_counter()
+        r = self.session.request(method, f'{self.url}/api/{path}', timeout=self.timeout, **kwargs)
+        if metrics.enabled():
+            metrics.observe('http_request_seconds', time.perf_counter() - start, backend='esplora', route=_route(path))
+            metrics.count('http_response_bytes', len(r.content), backend='esplora')
+        return r
+
+    def _get(self, path):
+        r = self._request('GET', path)
+        r.raise_for_status()
+        return r
+
+    def map(self, func, items, max_workers=None):
+        """Return [func(item) for item in items], running up to max_workers calls concurrently"""
+        items = list(items)
+        max_workers = min(max_workers or self.max_workers, len(items))
+        if max_workers <= 1:
+            return [func(item) for item in items]
+        self._size_pool(max_workers)
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            return list(executor.map(func, items))
+
+    def get_address(self, address):
+        return self._get(f'address/{address}').json()
+
+    def get_address_utxos(self, address):
+        return self._get(f'address/{address}/utxo').json()
+
+    def get_address_txs_chain(self, address, last_seen=None):
+        path = f'address/{address}/txs/chain'
+        return self._get(f'{path}/{last_seen}' if last_seen else path).json()
+
+    def get_address_tx_count(self, address):
+        info = self.get_address(address)
+        return info['chain_stats']['tx_count'] + info['mempool_stats']['tx_count']
+
+    def get_tip_height(self):
+        return int(self._get('blocks/tip/height').text)
+
+    def get_fee_estimates(self):
+        return self._get('fee-estimates').json()
+
+    def get_tx_hex(self, txid):
+        return self._get(f'tx/{txid}/hex').text
+
+    def broadcast(self, tx_hex):
+        """Broadcast a transaction, return its txid
+
+        Failures are retried on connection errors, server errors and rate
+        limiting.
+        """
+        try:
+            r = self._request('POST', 'tx', data=tx_hex)
+        except requests.RequestException as e:
+            raise BroadcastError(str(e), retry=True)
+        if r.ok:
+            return r.text.strip()
+        if any(message in r.text for message in ALREADY_KNOWN):
+            return _txid(tx_hex)
+        raise BroadcastError(r.text, retry=r.status_code >= 500 or r.status_code == 429)
+
+    def get_tx_status(self, txid):
+        r = self._request('GET', f'tx/{txid}/status')
+        if r.status_code == 404:
+            return None
+        r.raise_for_status()
+        return r.json()
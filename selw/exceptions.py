@@ -12,3 +12,27 @@ class InvalidPrivateKey(SewError):
 
 class InvalidPublicKey(SewError):
     pass
+
+
+class InsufficientFunds(SewError):
+    pass
+
+
+class InvalidAddress(SewError):
+    pass
+
+
+class BroadcastError(SewError):
+    """The server did not accept a transaction, retry is set if the failure may be temporary"""
+
+    def __init__(self, message, retry=False):
+        super().__init__(message)
+        self.retry = retry
+
+
+class RpcError(SewError):
+    """JSON-RPC error returned by a node"""
+
+    def __init__(self, message, code=None):
+        super().__init__(message)
+        self.code = code
@@ -0,0 +1,237 @@
+import os
+import random
+import threading
+import wallycore as wally
+
+from selw.backend import TXS_PAGE_SIZE, ChainBackend
+from selw.exceptions import BroadcastError
+from selw.network import LIQUID_TESTNET
+from selw.pset import TX_FLAGS
+from selw.utils import b2h, b2h_rev, h2b_rev
+
+DEFAULT_SEED = 0
+DEFAULT_OUTPUTS_PER_TX = 100
+
+
+def blinded_txout(scriptpubkey, blinding_pubkey, asset, value, entropy=os.urandom):
+    """Create a confidential output that can be unblinded with blinding_pubkey's private key
+
+    entropy(n) returns the n random bytes of the blinders and ephemeral key.
+    """
+    abf, vbf, ephemeral_key = entropy(32), entropy(32), entropy(32)
+    generator = wally.asset_generator_from_bytes(asset, abf)
+    value_commitment = wally.asset_value_commitment(value, vbf, generator)
+    rangeproof = wally.asset_rangeproof(
+        value, blinding_pubkey, ephemeral_key, asset, abf, vbf, value_commitment, scriptpubkey, generator, 1, 0, 52)
+    nonce = wally.ec_public_key_from_private_key(ephemeral_key)
+    return wally.tx_elements_output_init(scriptpubkey, generator, value_commitment, nonce, None, rangeproof)
+
+
+def blinded_tx(outputs):
+    """Create a transaction with an output for each (scriptpubkey, blinding_pubkey, asset, value)"""
+    tx = wally.tx_init(2, 0, 1, len(outputs))
+    wally.tx_add_elements_raw_input(
+        tx, os.urandom(32), 0, 0xffffffff, None, None, None, None, None, None, None, None, None, 0)
+    for output in outputs:
+        wally.tx_add_output(tx, blinded_txout(*output))
+    return tx
+
+
+def esplora_utxo(tx, vout, height=1):
+    """Esplora /address/:address/utxo entry for the vout-th output of tx"""
+    return {
+        "txid": b2h_rev(wally.tx_get_txid(tx)),
+        "vout": vout,
+        "status": {"confirmed": height is not None, "block_height": height},
+        "valuecommitment": b2h(wally.tx_get_output_value(tx, vout)),
+        "assetcommitment": b2h(wally.tx_get_output_asset(tx, vout)),
+        "noncecommitment": b2h(wally.tx_get_output_nonce(tx, vout)),
+    }
+
+
+def unspent(tx, vout, height=1):
+    """ElementsUTXO input dict for the vout-th output of tx"""
+    ret = esplora_utxo(tx, vout, height)
+    ret.update(
+        height=height,
+        scriptpubkey=b2h(wally.tx_get_output_script(tx, vout)),
+        tx=wally.tx_to_hex(tx, TX_FLAGS))
+    return ret
+
+
+class FakeChain(ChainBackend):
+    """In-process chain, for tests and throughput benchmarks without a server
+
+    Transactions are indexed as they are added, broadcast ones go to the
+    mempool until mine is called. Inputs must spend known unspent outputs,
+    signatures and proofs are not checked. Generated outputs only depend on
+    seed, so runs are reproducible.
+    """
+
+    def __init__(self, network=LIQUID_TESTNET, seed=DEFAULT_SEED, height=1):
+        self.network = network
+        self.rng = random.Random(seed)
+        self.height = height
+        self.txs = {}  # txid -> tx hex
+        self.heights = {}  # txid -> block height, None if in the mempool
+        self.utxos = {}  # scriptpubkey -> {(txid, vout): utxo dict}
+        self.scripts = {}  # (txid, vout) -> scriptpubkey, of unspent outputs
+        self.history = {}  # scriptpubkey -> set of txids
+        self._chain_history = {}  # scriptpubkey -> (confirmed txids newest first, txid -> position), reset on changes
+        self.fee_estimates = {}
+        self.calls = {}  # method -> number of calls
+        self.lock = threading.RLock()
+
+    def _count(self, method):
+        with self.lock:
+            self.calls[method] = self.calls.get(method, 0) + 1
+
+    def _random(self, n=32):
+        return self.rng.getrandbits(8 * n).to_bytes(n, 'little')
+
+    def blinded_txout(self, scriptpubkey, blinding_pubkey, asset, value):
+        """Confidential output of value of asset (32 bytes), blinded to blinding_pubkey"""
+        return blinded_txout(scriptpubkey, blinding_pubkey, asset, value, self._random)
+
+    def fund(self, scriptpubkey, values, asset_hex=None, blinding_pubkey=None, outputs_per_tx=DEFAULT_OUTPUTS_PER_TX,
+             reuse_proofs=False, confirmed=True):
+        """Create transactions paying values to scriptpubkey, return their txids
+
+        Outputs are blinded if blinding_pubkey is given. Creating rangeproofs
+        takes milliseconds, with reuse_proofs outputs of the same value share
+        commitments and proofs, which is enough for throughput benchmarks.
+        asset_hex defaults to the network's policy asset.
+        """
+        asset = h2b_rev(asset_hex or self.network.policy_asset_hex)
+        values = list(values)
+        txouts = {}
+        txids = []
+        for start in range(0, len(values), outputs_per_tx):
+            chunk = values[start:start + outputs_per_tx]
+            tx = wally.tx_init(2, 0, 1, len(chunk))
+            wally.tx_add_elements_raw_input(
+                tx, self._random(), 0, 0xffffffff, None, None, None, None, None, None, None, None, None, 0)
+            for value in chunk:
+                txout = txouts.get(value) if reuse_proofs else None
+                if txout is None:
+                    if blinding_pubkey is None:
+                        txout = wally.tx_elements_output_init(
+                            scriptpubkey, b'\x01' + asset, wally.tx_confidential_value_from_satoshi(value))
+                    else:
+                        txout = self.blinded_txout(scriptpubkey, blinding_pubkey, asset, value)
+                    txouts[value] = txout
+                wally.tx_add_output(tx, txout)
+            txids.append(self.add_tx(tx, self.height if confirmed else None, check_inputs=False))
+        return txids
+
+    def add_tx(self, tx, height=None, check_inputs=True):
+        """Add tx, confirmed at height or in the mempool if None, return its txid"""
+        txid = b2h_rev(wally.tx_get_txid(tx))
+        with self.lock:
+            if txid in self.txs:
+                return txid
+            prevouts = [(b2h_rev(wally.tx_get_input_txhash(tx, i)), wally.tx_get_input_index(tx, i))
+                        for i in range(wally.tx_get_num_inputs(tx))]
+            if check_inputs and any(prevout not in self.scripts for prevout in prevouts):
+                raise BroadcastError('bad-txns-inputs-missingorspent')
+            for prevout in prevouts:
+                scriptpubkey = self.scripts.pop(prevout, None)
+                if scriptpubkey is not None:
+                    del self.utxos[scriptpubkey][prevout]
+                    self.history[scriptpubkey].add(txid)
+            self.txs[txid] = wally.tx_to_hex(tx, TX_FLAGS)
+            self.heights[txid] = height
+            self._chain_history.clear()
+            for vout in range(wally.tx_get_num_outputs(tx)):
+                scriptpubkey = bytes(wally.tx_get_output_script(tx, vout))
+                if not scriptpubkey:
+                    continue
+                asset, value = wally.tx_get_output_asset(tx, vout), wally.tx_get_output_value(tx, vout)
+                utxo = {'txid': txid, 'vout': vout}
+                if asset[0] == 1 and value[0] == 1:
+                    utxo.update(asset=b2h_rev(asset[1:]), value=wally.tx_confidential_value_to_satoshi(value))
+                else:
+                    utxo.update(assetcommitment=b2h(asset), valuecommitment=b2h(value),
+                                noncecommitment=b2h(wally.tx_get_output_nonce(tx, vout)))
+                self.utxos.setdefault(scriptpubkey, {})[(txid, vout)] = utxo
+                self.scripts[(txid, vout)] = scriptpubkey
+                self.history.setdefault(scriptpubkey, set()).add(txid)
+        return txid
+
+    def mine(self, blocks=1):
+        """Confirm the mempool transactions in the next block and move the tip by blocks"""
+        with self.lock:
+            for txid, height in self.heights.items():
+                if height is None:
+                    self.heights[txid] = self.height + 1
+            self.height += blocks
+            self._chain_history.clear()
+
+    def _status(self, txid):
+        height = self.heights[txid]
+        return {'confirmed': height is not None, 'block_height': height}
+
+    def get_address_utxos(self, address):
+        self._count('get_address_utxos')
+        scriptpubkey = self.network.parse_address(address)[0]
+        with self.lock:
+            return [dict(utxo, status=self._status(utxo['txid'])) for utxo in self.utxos.get(scriptpubkey, {}).values()]
+
+    def get_address_tx_count(self, address):
+        self._count('get_address_tx_count')
+        with self.lock:
+            return len(self.history.get(self.network.parse_address(address)[0], ()))
+
+    def get_address_txs_chain(self, address, last_seen=None):
+        self._count('get_address_txs_chain')
+        scriptpubkey = self.network.parse_address(address)[0]
+        with self.lock:
+            if scriptpubkey not in self._chain_history:
+                # Newest first, by height then by arrival
+                order = {txid: i for i, txid in enumerate(self.txs)}
+                confirmed = [txid for txid in self.history.get(scriptpubkey, ()) if self.heights[txid] is not None]
+                confirmed.sort(key=lambda txid: (self.heights[txid], order[txid]), reverse=True)
+                self._chain_history[scriptpubkey] = confirmed, {txid: i for i, txid in enumerate(confirmed)}
+            confirmed, positions = self._chain_history[scriptpubkey]
+            start = positions[last_seen] + 1 if last_seen else 0
+            return [self._esplora_tx(txid) for txid in confirmed[start:start + TXS_PAGE_SIZE]]
+
+    def _esplora_tx(self, txid):
+        tx = wally.tx_from_hex(self.txs[txid], TX_FLAGS)
+        vin = []
+        for i in range(wally.tx_get_num_inputs(tx)):
+            prev_txid, vout = b2h_rev(wally.tx_get_input_txhash(tx, i)), wally.tx_get_input_index(tx, i)
+            prevout = None
+            if prev_txid in self.txs:
+                parent = wally.tx_from_hex(self.txs[prev_txid], TX_FLAGS)
+                prevout = {'scriptpubkey': b2h(wally.tx_get_output_script(parent, vout))}
+            vin.append({'txid': prev_txid, 'vout': vout, 'prevout': prevout})
+        return {'txid': txid, 'status': self._status(txid), 'vin': vin}
+
+    def get_tx_hex(self, txid):
+        self._count('get_tx_hex')
+        with self.lock:
+            if txid not in self.txs:
+                raise ValueError('Unknown transaction {}'.format(txid))
+            return self.txs[txid]
+
+    def get_tx_status(self, txid):
+        self._count('get_tx_status')
+        with self.lock:
+            return self._status(txid) if txid in self.txs else None
+
+    def broadcast(self, tx_hex):
+        self._count('broadcast')
+        try:
+            tx = wally.tx_from_hex(tx_hex, TX_FLAGS)
+        except ValueError:
+            raise BroadcastError('TX decode failed')
+        return self.add_tx(tx)
+
+    def get_tip_height(self):
+        self._count('get_tip_height')
+        return self.height
+
+    def get_fee_estimates(self):
+        self._count('get_fee_estimates')
+        return dict(self.fee_estimates)
@@ -0,0 +1,109 @@
+import math
+import threading
+import time
+import wallycore as wally
+
+from selw.output import Multisig, P2wpkhElementsOutput
+
+# Sizes in bytes of the parts of an Elements transaction
+TX_OVERHEAD = 4 + 4 + 1  # version, locktime, witness flag
+INPUT_SIZE = 32 + 4 + 1 + 4  # prevout, empty scriptSig, sequence
+INPUT_WITNESS_OVERHEAD = 3  # empty issuance and inflation keys rangeproofs, empty pegin witness
+OUTPUT_WITNESS_EXPLICIT = 2  # empty surjection proof and rangeproof
+SIGNATURE_SIZE = 72  # DER, with the sighash byte
+COMMITMENT_SIZE = 33
+EXPLICIT_VALUE_SIZE = 9
+RANGEPROOF_SIZE = 4174  # 52 bits, as created by psbt_blind
+
+MAX_STANDARD_VSIZE = 100000  # from the 400000 weight units standardness limit
+DEFAULT_FEERATE = 0.1  # sat/vbyte, the Liquid minimum relay feerate
+DEFAULT_TARGET = 2  # blocks
+FEE_ESTIMATES_TTL = 60  # seconds
+# The surjection proof size stops growing past 3 inputs
+SURJECTION_MAX_INPUTS = 3
+
+
+def varint_size(n):
+    return 1 if n < 0xfd else 3 if n <= 0xffff else 5
+
+
+def witness_size(output):
+    """Size of the witness stack spending output"""
+    if isinstance(output, P2wpkhElementsOutput):
+        items = [SIGNATURE_SIZE, len(output.witness_script)]
+    elif isinstance(output, Multisig):
+        items = [0] + [SIGNATURE_SIZE] * output.threshold + [len(output.witness_script)]
+    else:
+        raise ValueError('Unknown output type: {}'.format(type(output).__name__))
+    return varint_size(len(items)) + sum(varint_size(item) + item for item in items)
+
+
+def output_size(scriptpubkey, blinded, n_inputs):
+    """Return (non witness, witness) size of an output"""
+    script_size = varint_size(len(scriptpubkey)) + len(scriptpubkey)
+    if not blinded:
+        return COMMITMENT_SIZE + EXPLICIT_VALUE_SIZE + 1 + script_size, OUTPUT_WITNESS_EXPLICIT
+    surjectionproof_size = wally.asset_surjectionproof_size(n_inputs)
+    witness = varint_size(surjectionproof_size) + surjectionproof_size + varint_size(RANGEPROOF_SIZE) + RANGEPROOF_SIZE
+    return 3 * COMMITMENT_SIZE + script_size, witness
+
+
+def input_vsize(output):
+    """Virtual size added by an input spending output"""
+    return INPUT_SIZE + (INPUT_WITNESS_OVERHEAD + witness_size(output)) / 4
+
+
+def estimate_vsize(inputs, outputs):
+    """Virtual size of the transaction once blinded and signed
+
+    inputs are the spent outputs (ElementsOutput), outputs are
+    (scriptpubkey, blinded) pairs, including the fee output (b'', False).
+    """
+    base = TX_OVERHEAD + varint_size(len(inputs)) + varint_size(len(outputs)) + INPUT_SIZE * len(inputs)
+    witness = sum(INPUT_WITNESS_OVERHEAD + witness_size(output) for output in inputs)
+    for scriptpubkey, blinded in outputs:
+        output_base, output_witness = output_size(scriptpubkey, blinded, len(inputs))
+        base += output_base
+        witness += output_witness
+    return (4 * base + witness + 3) // 4
+
+
+def change_cost(scriptpubkey, feerate):
+    """Fee in satoshi added by a blinded change output to scriptpubkey at feerate (sat/vbyte)"""
+    base, witness = output_size(scriptpubkey, True, SURJECTION_MAX_INPUTS)
+    return fee_for(base + witness / 4, feerate)
+
+
+def fee_for(vsize, feerate):
+    """Fee in satoshi for vsize at feerate (sat/vbyte)"""
+    return math.ceil(vsize * feerate)
+
+
+class FeeEstimator(object):
+    """Feerates from a ChainBackend fee estimates, fetched at most once every ttl seconds"""
+
+    def __init__(self, backend, ttl=FEE_ESTIMATES_TTL, min_feerate=DEFAULT_FEERATE, clock=time.monotonic):
+        self.backend = backend
+        self.ttl = ttl
+        self.min_feerate = min_feerate
+        self.clock = clock
+        self.lock = threading.Lock()
+        self._estimates = None
+        self._fetched_at = None
+
+    def estimates(self):
+        """Dict confirmation target (blocks) -> feerate (sat/vbyte)"""
+        with self.lock:
+            if self._estimates is None or self.clock() - self._fetched_at >= self.ttl:
+                estimates = self.backend.get_fee_estimates()
+                self._estimates = {int(blocks): feerate for blocks, feerate in estimates.items()}
+                self._fetched_at = self.clock()
+            return self._estimates
+
+    def feerate(self, target=DEFAULT_TARGET):
+        """Feerate to confirm within target blocks, never below min_feerate"""
+        estimates = self.estimates()
+        targets = [blocks for blocks in estimates if blocks <= target] or sorted(estimates)[:1]
+        if not targets:
+            return self.min_feerate
+        return max(estimates[max(targets)], self.min_feerate)
@@ -0,0 +1,135 @@
+from selw.network import LIQUID_TESTNET
+from selw.output import P2wpkhElementsOutput, P2wsh2of3ElementsOutput
+from selw.wallet import Wallet, WalletP2wsh2of3
+
+RECEIVE = 0
+CHANGE = 1
+DEFAULT_GAP_LIMIT = 20
+
+
+class HDWallet(Wallet):
+    """A wallet over the receive and change addresses derived from BIP32 account keys
+
+    Outputs are derived at account/chain/index, with chain 0 for receive and
+    1 for change. Addresses are scanned until gap_limit consecutive unused
+    ones are found. All addresses share the same blinding key.
+
+    origins are the (master fingerprint, account path) of the accounts, see
+    key.parse_origin, so that keypaths have the master fingerprint and the
+    full path from the master, as signers expect. Accounts without an origin
+    are taken as masters, their keypaths have their own fingerprint and the
+    chain/index path.
+
+    This class is abstract, subclasses implement _derive_outputs for their
+    script type: HDWalletP2wpkh and HDWalletP2wsh2of3.
+    """
+    def __init__(self, accounts, private_blinding_key, gap_limit=DEFAULT_GAP_LIMIT, store=None, network=LIQUID_TESTNET,
+                 origins=None):
+        self.accounts = accounts
+        self.origins = [(bytes(account.fingerprint), ()) if origin is None else (bytes(origin[0]), tuple(origin[1]))
+                        for account, origin in zip(accounts, origins or [None] * len(accounts))]
+        self.gap_limit = gap_limit
+        self.outputs = {}  # scriptpubkey -> output
+        self.paths = {}  # scriptpubkey -> (chain, index)
+        self.derived = {RECEIVE: [], CHANGE: []}
+        self.last_used = {RECEIVE: -1, CHANGE: -1}
+        super().__init__(None, private_blinding_key, store, network)
+        self.output = self.output_at(RECEIVE, 0)
+        self.scriptpubkey = self.output.scriptpubkey
+
+    def _derive_outputs(self, chain, start, count):
+        """The count outputs at chain/start, chain/start + 1..., abstract"""
+        raise NotImplementedError('{} does not derive outputs'.format(type(self).__name__))
+
+    def output_at(self, chain, index):
+        """Output at chain/index, deriving it (and the ones before it) if needed"""
+        derived = self.derived[chain]
+        if len(derived) <= index:
+            start = len(derived)
+            for i, output in enumerate(self._derive_outputs(chain, start, index + 1 - start), start):
+                self.outputs[bytes(output.scriptpubkey)] = output
+                self.paths[bytes(output.scriptpubkey)] = (chain, i)
+                for (fingerprint, path), key in zip(self.origins, self._keys(output)):
+                    self.keystore.add(key, fingerprint, path + (chain, i))
+                derived.append(output)
+        return derived[index]
+
+    def _unused_output(self, chain):
+        return self.output_at(chain, self.last_used[chain] + 1)
+
+    def unconf_address(self):
+        return self._unused_output(RECEIVE).unconf_address
+
+    def address(self):
+        return self._unused_output(RECEIVE).conf_address
+
+    def change_destination(self):
+        return self._unused_output(CHANGE).scriptpubkey, self.public_blinding_key()
+
+    def output_for(self, scriptpubkey):
+        return self.outputs.get(bytes(scriptpubkey))
+
+    def add_pending_tx(self, tx_hex):
+        """As Wallet.add_pending_tx, the addresses receiving are marked as used"""
+        created = super().add_pending_tx(tx_hex)
+        for utxo in created:
+            chain, index = self.paths[bytes(utxo.scriptpubkey)]
+            self.last_used[chain] = max(self.last_used[chain], index)
+        return created
+
+    def scan(self, backend, max_workers=None):
+        """Look for used addresses past the last used ones
+
+        Address histories are fetched in batches of gap_limit addresses,
+        backend is a ChainBackend or an Esplora url.
+        """
+        backend = self.backend(backend)
+        for chain in (RECEIVE, CHANGE):
+            start = self.last_used[chain] + 1
+            while start <= self.last_used[chain] + self.gap_limit:
+                stop = self.last_used[chain] + self.gap_limit + 1
+                outputs = [self.output_at(chain, index) for index in range(start, stop)]
+                tx_counts = backend.get_address_tx_counts([o.unconf_address for o in outputs], max_workers)
+                for index, tx_count in zip(range(start, stop), tx_counts):
+                    if tx_count:
+                        self.last_used[chain] = index
+                start = stop
+
+    def history_outputs(self, backend, max_workers=None):
+        """The used outputs, after a scan"""
+        self.scan(backend, max_workers)
+        return [self.output_at(chain, index) for chain in (RECEIVE, CHANGE) for index in range(self.last_used[chain] + 1)]
+
+    def _list_unspents(self, backend, max_workers):
+        used = self.history_outputs(backend, max_workers)
+        utxos = backend.get_addresses_utxos([o.unconf_address for o in used], max_workers)
+        return [(utxo, output) for output, output_utxos in zip(used, utxos) for utxo in output_utxos]
+
+
+class HDWalletP2wpkh(HDWallet):
+    """HD wallet of P2WPKH addresses derived from a single private account key, with origin"""
+    def __init__(self, account, private_blinding_key, gap_limit=DEFAULT_GAP_LIMIT, store=None, network=LIQUID_TESTNET,
+                 origin=None):
+        super().__init__([account], private_blinding_key, gap_limit, store, network, [origin])
+
+    def _derive_outputs(self, chain, start, count):
+        keys = self.accounts[0].derive_range([chain], start, count)
+        return [P2wpkhElementsOutput(key.prv, self.private_blinding_key, self.network) for key in keys]
+
+
+class HDWalletP2wsh2of3(HDWallet):
+    """HD wallet of P2WSH-2OF3 addresses derived from 3 account keys
+
+    Account keys can be public, but at least one must be private to sign.
+    """
+    def __init__(self, accounts, private_blinding_key, gap_limit=DEFAULT_GAP_LIMIT, store=None, network=LIQUID_TESTNET,
+                 origins=None):
+        assert len(accounts) == 3, "Need 3 account keys"
+        super().__init__(accounts, private_blinding_key, gap_limit, store, network, origins)
+
+    def _derive_outputs(self, chain, start, count):
+        keys = [[key.prv if account.has_prv else key.pub for key in account.derive_range([chain], start, count)]
+                for account in self.accounts]
+        return [P2wsh2of3ElementsOutput(list(child_keys), self.private_blinding_key, self.network) for child_keys in zip(*keys)]
+
+    set_witness_script = staticmethod(WalletP2wsh2of3.set_witness_script)
@@ -0,0 +1,140 @@
+import wallycore as wally
+from concurrent.futures import ThreadPoolExecutor
+
+from selw import metrics
+from selw.backend import TXS_PAGE_SIZE
+from selw.pset import TX_FLAGS
+from selw.utils import b2h, b2h_rev
+from selw.utxo import unblind_txout
+
+
+class HistoryTx(object):
+    """A confirmed transaction of a wallet address, with the address inputs and outputs unblinded
+
+    inputs are (txid, vout, asset hex, value) of the address outputs it
+    spends, outputs are (vout, asset hex, value) of the ones it creates.
+    Outputs that cannot be unblinded with the wallet key are left out. A
+    transaction involving several wallet addresses has a record for each,
+    so that the records of all the addresses add up.
+    """
+
+    __slots__ = ('txid', 'height', 'address', 'inputs', 'outputs', 'fee')
+
+    def __init__(self, txid, height, address, inputs, outputs, fee):
+        self.txid = txid
+        self.height = height
+        self.address = address
+        self.inputs = inputs
+        self.outputs = outputs
+        self.fee = fee  # of the whole transaction, in the policy asset
+
+    def __repr__(self):
+        return 'HistoryTx({}, {}, {})'.format(self.txid, self.height, self.net())
+
+    def net(self):
+        """Dict asset hex -> value received minus value spent by the address"""
+        net = {}
+        for _, asset_hex, value in self.outputs:
+            net[asset_hex] = net.get(asset_hex, 0) + value
+        for _, _, asset_hex, value in self.inputs:
+            net[asset_hex] = net.get(asset_hex, 0) - value
+        return net
+
+
+class HistoryCursor(object):
+    """Where a history walk is, to resume it or to get only the transactions confirmed since
+
+    state is a JSON serializable dict address -> {"stop", "top", "last_seen"}:
+    stop is the newest transaction of the last complete walk, where the
+    next one ends, top the newest one of the walk in progress and
+    last_seen the last one yielded, where an interrupted walk resumes.
+    """
+
+    def __init__(self, state=None):
+        self.state = {} if state is None else state
+
+    def _address(self, address):
+        return self.state.setdefault(address, {'stop': None, 'top': None, 'last_seen': None})
+
+
+def _fetch_page(backend, address, scriptpubkey_hex, last_seen, max_workers):
+    """The page after last_seen, and the hex of its transactions and of the parents of the address inputs"""
+    page = backend.get_address_txs_chain(address, last_seen)
+    txids = [tx['txid'] for tx in page]
+    txids += [vin['txid'] for tx in page for vin in tx.get('vin', [])
+              if (vin.get('prevout') or {}).get('scriptpubkey') == scriptpubkey_hex]
+    return page, backend.get_txs_hex(txids, max_workers)
+
+
+def _record(tx, txs, address, output, policy_asset):
+    scriptpubkey, key = bytes(output.scriptpubkey), output.blinding_key.prv
+    scriptpubkey_hex = b2h(scriptpubkey)
+    raw = wally.tx_from_hex(txs[tx['txid']], TX_FLAGS)
+    outputs, fee = [], 0
+    for vout in range(wally.tx_get_num_outputs(raw)):
+        script = wally.tx_get_output_script(raw, vout)
+        if not script:
+            unblinded = unblind_txout(raw, vout, None)
+            if unblinded is not None and unblinded[1] == policy_asset:
+                fee += unblinded[0]
+        elif script == scriptpubkey:
+            unblinded = unblind_txout(raw, vout, key)
+            if unblinded is not None:
+                outputs.append((vout, b2h_rev(unblinded[1]), unblinded[0]))
+    inputs = []
+    for vin in tx.get('vin', []):
+        if (vin.get('prevout') or {}).get('scriptpubkey') != scriptpubkey_hex:
+            continue
+        unblinded = unblind_txout(wally.tx_from_hex(txs[vin['txid']], TX_FLAGS), vin['vout'], key)
+        if unblinded is not None:
+            inputs.append((vin['txid'], vin['vout'], b2h_rev(unblinded[1]), unblinded[0]))
+    metrics.count('history_txs')
+    return HistoryTx(tx['txid'], tx.get('status', {}).get('block_height'), address, inputs, outputs, fee)
+
+
+def _address_history(backend, output, cursor, executor, policy_asset, max_workers):
+    address = output.unconf_address
+    state = cursor._address(address)
+    scriptpubkey_hex = b2h(output.scriptpubkey)
+    future = executor.submit(_fetch_page, backend, address, scriptpubkey_hex, state['last_seen'], max_workers)
+    while future is not None:
+        page, txs = future.result()
+        txids = [tx['txid'] for tx in page]
+        if state['stop'] in txids:
+            # Known from the last complete walk, and so are the older ones
+            page = page[:txids.index(state['stop'])]
+            future = None
+        elif len(page) < TXS_PAGE_SIZE:
+            future = None
+        else:
+            # Fetched while this page is processed
+            future = executor.submit(_fetch_page, backend, address, scriptpubkey_hex, txids[-1], max_workers)
+        for tx in page:
+            record = _record(tx, txs, address, output, policy_asset)
+            if state['top'] is None:
+                state['top'] = record.txid
+            state['last_seen'] = record.txid
+            yield record
+    state.update(stop=state['top'] or state['stop'], top=None, last_seen=None)
+
+
+def iter_history(wallet, backend, cursor=None, max_workers=None):
+    """Yield the confirmed transactions of the wallet addresses, as HistoryTx, newest first for each address
+
+    Pages of get_address_txs_chain are fetched, with their transactions and
+    the parents of the wallet inputs, while the previous one is processed.
+    Only a couple of pages are held in memory at a time, however long the
+    history.
+
+    cursor (HistoryCursor) is updated before each record is yielded: saved
+    after handling a record, it resumes the walk after it, saved after a
+    complete walk, the next one only yields the transactions confirmed
+    since. Unconfirmed transactions are not yielded, reorganizations below
+    the cursor are not detected.
+    """
+    backend = wallet.backend(backend)
+    cursor = HistoryCursor() if cursor is None else cursor
+    policy_asset = bytes(wallet.network.policy_asset)
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        for output in wallet.history_outputs(backend):
+            yield from _address_history(backend, output, cursor, executor, policy_asset, max_workers)
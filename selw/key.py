@@ -1,7 +1,14 @@
+import os
+
 from selw.exceptions import InvalidPrivateKey, InvalidPublicKey
+from selw.utils import LruCache, process_pool
 
 import wallycore as wally
 
+DERIVATION_CACHE_SIZE = 4096
+# Below this many signatures, spawning worker processes costs more than it saves
+MIN_PARALLEL_VERIFY = 256
+
 
 class ECKey(object):
     """Elliptic Curve key"""
@@ -69,6 +76,13 @@ class ECKey(object):
             return False
         return self.verify_compact(h, sig_compact)
 
+    def verify_many(self, items, workers=None):
+        """Verify (hash, DER signature) pairs, return a bitmap as verify_many"""
+        if self.pub is None:
+            raise ValueError('Missing public key')
+
+        return verify_many(((self.pub, h, sig) for h, sig in items), workers)
+
 
 class PubKey(bytes):
     """Public key"""
@@ -89,12 +103,186 @@ class PubKey(bytes):
         """Verify a DER signature"""
         return self.eckey.verify(h, sig)
 
+    def verify_many(self, items, workers=None):
+        """Verify (hash, DER signature) pairs, return a bitmap as verify_many"""
+        return self.eckey.verify_many(items, workers)
+
+
+def _verify(args):
+    pub, h, sig = args
+    try:
+        wally.ec_sig_verify(pub, h, wally.EC_FLAG_ECDSA, wally.ec_sig_from_der(sig))
+    except ValueError:
+        return False
+    return True
+
+
+def verify_many(items, workers=None):
+    """Verify many (public key, hash, DER signature) triples
+
+    Return a bitmap with a bit for each triple, in order: bit i, read with
+    is_set, is set if the i-th signature is valid.
+
+    Each distinct public key is checked once, the signatures of invalid ones
+    are not verified. Many signatures are verified by a pool of worker
+    processes, workers defaults to the number of CPUs, libwally holds the
+    GIL so threads would not help.
+    """
+    items = list(items)
+    valid_pubs = {}
+    jobs, indexes = [], []
+    for i, (pub, h, sig) in enumerate(items):
+        pub = bytes(pub)
+        if pub not in valid_pubs:
+            try:
+                wally.ec_public_key_verify(pub)
+                valid_pubs[pub] = True
+            except ValueError:
+                valid_pubs[pub] = False
+        if valid_pubs[pub]:
+            indexes.append(i)
+            jobs.append((pub, h, sig))
+
+    workers = min(workers or os.cpu_count() or 1, len(jobs))
+    if workers <= 1 or len(jobs) < MIN_PARALLEL_VERIFY:
+        results = map(_verify, jobs)
+    else:
+        results = list(process_pool(workers).map(_verify, jobs, chunksize=max(1, len(jobs) // (workers * 4))))
+    bitmap = bytearray((len(items) + 7) // 8)
+    for i, valid in zip(indexes, results):
+        if valid:
+            bitmap[i >> 3] |= 1 << (i & 7)
+    return bitmap
+
+
+def is_set(bitmap, i):
+    """Whether the i-th bit of a verify_many bitmap is set"""
+    return bool(bitmap[i >> 3] >> (i & 7) & 1)
+
+
+def key_fingerprint(pub):
+    """BIP32 fingerprint of a public key, the first 4 bytes of its hash160"""
+    return bytes(wally.hash160(pub)[:4])
+
+
+def parse_origin(origin):
+    """(fingerprint, path) of a key origin as in descriptors, fingerprint hex and path, as d34db33f/84h/1h/0h"""
+    fingerprint, *steps = origin.strip('[]').split('/')
+    path = []
+    for step in steps:
+        hardened = step[-1:] in ('h', "'")
+        path.append(int(step[:-1] if hardened else step) | (wally.BIP32_INITIAL_HARDENED_CHILD if hardened else 0))
+    fingerprint = bytes.fromhex(fingerprint)
+    if len(fingerprint) != 4:
+        raise ValueError('Invalid fingerprint: {}'.format(origin))
+    return fingerprint, tuple(path)
+
+
+def _parse_keypath(keypath):
+    """(fingerprint, path) of a serialized keypath"""
+    keypath = bytes(keypath)
+    return keypath[:4], tuple(int.from_bytes(keypath[i:i + 4], 'little') for i in range(4, len(keypath), 4))
+
+
+class KeyStore(object):
+    """Keys indexed by public key and by BIP32 origin, (fingerprint, path)
+
+    Keys are ECKeys, verified once when created, so signing does not verify
+    nor derive them again. Their origin is written in the PSET keypaths
+    with set_keypaths and signers looks them up from there. Keys without a
+    HD origin have their own fingerprint and an empty path.
+
+    Keys added with no_origin are only known by their public key, signers
+    then looks for each of them in the keypaths.
+    """
+
+    def __init__(self):
+        self.keys = {}  # public key -> ECKey
+        self.origins = {}  # public key -> (fingerprint, path)
+        self.by_origin = {}  # (fingerprint, path) -> public key
+        self.no_origin = []  # public keys of the keys without origin
+
+    def __len__(self):
+        return len(self.keys)
+
+    @classmethod
+    def from_private_keys(cls, private_keys):
+        """KeyStore of raw private keys, without origin"""
+        keystore = cls()
+        for prv in private_keys:
+            key = ECKey()
+            key.prv = prv
+            keystore.add(key, no_origin=True)
+        return keystore
+
+    def add(self, key, fingerprint=None, path=(), no_origin=False):
+        """Add key, an ECKey, derived at path from the key with fingerprint, which defaults to its own"""
+        pub = bytes(key.pub)
+        known = self.keys.get(pub)
+        if known is None or known.prv is None:
+            self.keys[pub] = key
+        if no_origin:
+            if known is None:
+                self.no_origin.append(pub)
+            return
+        origin = (bytes(key_fingerprint(pub) if fingerprint is None else fingerprint), tuple(path))
+        self.origins[pub] = origin
+        self.by_origin[origin] = pub
+
+    def get(self, pub):
+        """The ECKey of pub, None if unknown"""
+        return self.keys.get(bytes(pub))
+
+    def origin(self, pub):
+        return self.origins.get(bytes(pub))
+
+    def set_keypaths(self, psbt, idx, pubs):
+        """Set the keypaths of the idx-th input of psbt to the origins of pubs"""
+        keypaths = wally.map_keypath_public_key_init(len(pubs))
+        for pub in pubs:
+            fingerprint, path = self.origins[bytes(pub)]
+            if path:
+                wally.map_keypath_add(keypaths, pub, fingerprint, list(path))
+            else:
+                # map_keypath_add rejects an empty path
+                wally.map_add(keypaths, pub, fingerprint)
+        wally.psbt_set_input_keypaths(psbt, idx, keypaths)
+
+    def signers(self, psbt, idx):
+        """Return the (public key, private key) of the keys in the keypaths of the idx-th input"""
+        found = []
+        for i in range(wally.psbt_get_input_keypaths_size(psbt, idx)):
+            pub = self.by_origin.get(_parse_keypath(wally.psbt_get_input_keypath(psbt, idx, i)))
+            # The fingerprint is short, check the public key too
+            if pub is not None and wally.psbt_find_input_keypath(psbt, idx, pub) == i + 1:
+                found.append(pub)
+        found += [pub for pub in self.no_origin if pub not in found and wally.psbt_find_input_keypath(psbt, idx, pub)]
+        return [(pub, self.keys[pub].prv) for pub in found if self.keys[pub].prv is not None]
+
+
+class DerivationCache(LruCache):
+    """LRU cache of derived BIP32 keys
+
+    Keys are (parent id, parent has private key, path, flags), the parent id
+    being its public key and chain code, which unlike the 4 bytes fingerprint
+    cannot collide. It is the same for a private key and its public one, so
+    whether the parent is private is part of the key too.
+    """
+
+    def __init__(self, maxsize=DERIVATION_CACHE_SIZE):
+        super().__init__(maxsize)
+
+
+derivation_cache = DerivationCache()
+
 
 class Bip32Key(object):
     """BIP32 key"""
 
     def __init__(self, extkey=None):
         self.extkey = extkey
+        self._id = None
+        self._prvkey = None
         # TODO: handle missing private key
 
     @classmethod
@@ -119,37 +307,95 @@ class Bip32Key(object):
     def xpub(self):
         return wally.bip32_key_to_base58(self.extkey, wally.BIP32_FLAG_KEY_PUBLIC)
 
+    @property
+    def fingerprint(self):
+        return wally.bip32_key_get_fingerprint(self.extkey)
+
     @property
     def prv(self):
         return wally.bip32_key_get_priv_key(self.extkey)
 
+    @property
+    def has_prv(self):
+        """False for public (neutered) keys, whose private key is zeroed"""
+        return any(self.prv)
+
     @property
     def pub(self):
         return wally.bip32_key_get_pub_key(self.extkey)
 
     @property
     def prvkey(self):
-        k = ECKey()
-        k.prv = self.prv
-        return k
+        """ECKey of the private key, verified once"""
+        if self._prvkey is None:
+            k = ECKey()
+            k.prv = self.prv
+            self._prvkey = k
+        return self._prvkey
 
     @property
     def pubkey(self):
         return PubKey(self.pub)
 
+    @property
+    def id(self):
+        """Unique identifier of the key, used for caching derivations"""
+        if self._id is None:
+            self._id = bytes(self.pub) + bytes(wally.bip32_key_get_chain_code(self.extkey))
+        return self._id
+
     def _derive(self, path, flags):
-        derived = wally.bip32_key_from_parent_path(
-            self.extkey, path, flags | wally.BIP32_FLAG_SKIP_HASH)
-        return Bip32Key(derived)
+        """Derive path one step at a time, caching all the intermediate keys
+
+        So deriving siblings only costs the last step.
+        """
+        if not path:
+            return self
+        key = (self.id, self.has_prv, tuple(path), flags)
+        derived = derivation_cache.get(key)
+        if derived is None:
+            # Hardened steps need the private parent, even for public children
+            parent = self._derive(path[:-1], wally.BIP32_FLAG_KEY_PRIVATE if self.has_prv else flags)
+            derived = Bip32Key(wally.bip32_key_from_parent(parent.extkey, path[-1], flags | wally.BIP32_FLAG_SKIP_HASH))
+            derivation_cache.put(key, derived)
+        return derived
 
     def derive_prv(self, path):
-        """Derive private child key"""
+        """Derive private child key, raise InvalidPrivateKey if this key is public"""
+        if not self.has_prv:
+            raise InvalidPrivateKey('Cannot derive a private key from a public key')
         return self._derive(path, wally.BIP32_FLAG_KEY_PRIVATE)
 
     def derive_pub(self, path):
         """Derive public child key"""
         return self._derive(path, wally.BIP32_FLAG_KEY_PUBLIC)
 
+    def derive_range(self, path_prefix, start, count, output='key'):
+        """Derive count children of path_prefix starting at index start
+
+        The parent is derived once (and cached), then the children in a loop.
+        output selects what is returned for each child:
+        'key' for Bip32Keys (private if this key is), 'pub' for public keys,
+        'scriptpubkey' for P2WPKH scriptpubkeys.
+        """
+        private = self.has_prv
+        flags = wally.BIP32_FLAG_KEY_PRIVATE if private else wally.BIP32_FLAG_KEY_PUBLIC
+        # Deriving from a private parent is faster, even for public children
+        extkey = self._derive(path_prefix, flags).extkey
+        if output != 'key':
+            flags = wally.BIP32_FLAG_KEY_PUBLIC
+        from_parent = wally.bip32_key_from_parent
+        children = (from_parent(extkey, i, flags | wally.BIP32_FLAG_SKIP_HASH) for i in range(start, start + count))
+        if output == 'key':
+            return [Bip32Key(child) for child in children]
+        get_pub = wally.bip32_key_get_pub_key
+        if output == 'pub':
+            return [get_pub(child) for child in children]
+        if output == 'scriptpubkey':
+            hash160 = wally.hash160
+            return [b'\x00\x14' + hash160(get_pub(child)) for child in children]
+        raise ValueError('Unknown output: {}'.format(output))
+
     def sign_compact(self, h):
         """Produce a compact signature for (hashed) message h"""
         return self.prvkey.sign_compact(h)
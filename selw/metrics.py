@@ -0,0 +1,281 @@
+import bisect
+import contextlib
+import cProfile
+import functools
+import pstats
+import sys
+import threading
+import time
+import wallycore
+
+# Upper bounds (seconds) of the latency histogram buckets
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+PROMETHEUS_PREFIX = 'selw'
+PROMETHEUS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# The installed sink, None when instrumentation is off
+_sink = None
+_profiled = frozenset()
+_wally_modules = []  # selw modules whose wally global is a _WallyCalls, while calls are counted
+_NULL_SPAN = contextlib.nullcontext()
+
+
+class Metrics(object):
+    """In-memory sink: counters, span timings, histograms and profiles, thread safe
+
+    Series are keyed by name and labels, a tuple of (label, value) pairs.
+    Spans keep their number of calls, total and maximum time, histograms
+    the number of observations per bucket (upper bounds in buckets) and
+    their sum, profiles the pstats.Stats of the profiled spans.
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.lock = threading.Lock()
+        self.counters = {}  # (name, labels) -> value
+        self.spans = {}  # (name, labels) -> [calls, total seconds, max seconds]
+        self.histograms = {}  # (name, labels) -> [count per bucket, the last one unbounded, sum]
+        self.profiles = {}  # span name -> pstats.Stats
+
+    def count(self, name, value=1, labels=()):
+        key = (name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def timing(self, name, seconds, labels=()):
+        key = (name, labels)
+        with self.lock:
+            span = self.spans.get(key)
+            if span is None:
+                self.spans[key] = [1, seconds, seconds]
+            else:
+                span[0] += 1
+                span[1] += seconds
+                span[2] = max(span[2], seconds)
+
+    def observe(self, name, value, labels=()):
+        key = (name, labels)
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = [[0] * (len(self.buckets) + 1), 0]
+            histogram[0][bisect.bisect_left(self.buckets, value)] += 1
+            histogram[1] += value
+
+    def profiled(self, name, profiler):
+        with self.lock:
+            if name in self.profiles:
+                self.profiles[name].add(profiler)
+            else:
+                self.profiles[name] = pstats.Stats(profiler)
+
+    def reset(self):
+        with self.lock:
+            self.counters.clear()
+            self.spans.clear()
+            self.histograms.clear()
+            self.profiles.clear()
+
+    def stats(self):
+        """Plain dict snapshot, series named as in Prometheus, e.g. 'http_request_seconds{route="tx"}'"""
+        with self.lock:
+            return {
+                'counters': {_series(name, labels): value for (name, labels), value in self.counters.items()},
+                'spans': {_series(name, labels): {'calls': calls, 'total': total, 'mean': total / calls, 'max': max_}
+                          for (name, labels), (calls, total, max_) in self.spans.items()},
+                'histograms': {_series(name, labels): {'count': sum(counts), 'sum': total}
+                               for (name, labels), (counts, total) in self.histograms.items()},
+            }
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _series(name, labels):
+    if not labels:
+        return name
+    return '{}{{{}}}'.format(name, ','.join('{}="{}"'.format(k, _escape(v)) for k, v in labels))
+
+
+def _labels(labels):
+    return tuple(sorted(labels.items()))
+
+
+def prometheus(metrics, prefix=PROMETHEUS_PREFIX):
+    """Metrics in the Prometheus text exposition format
+
+    Counters are exported as <prefix>_<name>_total, spans as the
+    <prefix>_span_seconds summary, labelled by span, histograms as
+    <prefix>_<name>.
+    """
+    lines = []
+    with metrics.lock:
+        counters = sorted(metrics.counters.items())
+        spans = sorted(metrics.spans.items())
+        histograms = sorted((key, (list(counts), total)) for key, (counts, total) in metrics.histograms.items())
+    typed = set()
+
+    def family(name, kind):
+        if name not in typed:
+            typed.add(name)
+            lines.append('# TYPE {} {}'.format(name, kind))
+
+    for (name, labels), value in counters:
+        name = '{}_{}_total'.format(prefix, name)
+        family(name, 'counter')
+        lines.append('{} {}'.format(_series(name, labels), value))
+    name = '{}_span_seconds'.format(prefix)
+    for (span, labels), (calls, total, _) in spans:
+        family(name, 'summary')
+        labels = (('span', span),) + labels
+        lines.append('{} {}'.format(_series(name + '_count', labels), calls))
+        lines.append('{} {!r}'.format(_series(name + '_sum', labels), total))
+    for (name, labels), (counts, total) in histograms:
+        name = '{}_{}'.format(prefix, name)
+        family(name, 'histogram')
+        cumulative = 0
+        for bound, count in zip(list(metrics.buckets) + ['+Inf'], counts):
+            cumulative += count
+            lines.append('{} {}'.format(_series(name + '_bucket', labels + (('le', bound),)), cumulative))
+        lines.append('{} {}'.format(_series(name + '_count', labels), cumulative))
+        lines.append('{} {!r}'.format(_series(name + '_sum', labels), total))
+    return '\n'.join(lines) + '\n'
+
+
+def enabled():
+    return _sink is not None
+
+
+def sink():
+    """The installed sink, None if instrumentation is off"""
+    return _sink
+
+
+def enable(sink=None, wally_calls=False, profile=()):
+    """Install sink, a new Metrics by default, and return it
+
+    A sink has the methods of Metrics: count, timing, observe and
+    profiled. With wally_calls, every libwally function call made by selw is
+    counted as wally_calls, labelled by function. Spans named in profile run under
+    cProfile, their stats are passed to sink.profiled.
+    """
+    global _sink, _profiled
+    _count_wally_calls(wally_calls)
+    _profiled = frozenset(profile)
+    _sink = Metrics() if sink is None else sink
+    return _sink
+
+
+def disable():
+    """Remove the sink, instrumentation costs a global lookup again"""
+    global _sink, _profiled
+    _sink = None
+    _profiled = frozenset()
+    _count_wally_calls(False)
+
+
+def count(name, value=1, **labels):
+    if _sink is not None:
+        _sink.count(name, value, _labels(labels))
+
+
+def observe(name, value, **labels):
+    if _sink is not None:
+        _sink.observe(name, value, _labels(labels))
+
+
+class _Span(object):
+
+    __slots__ = ('sink', 'name', 'labels', 'profiler', 'start')
+
+    def __init__(self, sink, name, labels):
+        self.sink = sink
+        self.name = name
+        self.labels = labels
+        # Profilers do not nest, a span inside a profiled one is not profiled on its own
+        self.profiler = cProfile.Profile() if name in _profiled and sys.getprofile() is None else None
+
+    def __enter__(self):
+        if self.profiler is not None:
+            self.profiler.enable()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        elapsed = time.perf_counter() - self.start
+        if self.profiler is not None:
+            self.profiler.disable()
+            self.sink.profiled(self.name, self.profiler)
+        self.sink.timing(self.name, elapsed, self.labels)
+
+
+def span(name, **labels):
+    """Context manager timing the stage name, a no-op when instrumentation is off"""
+    if _sink is None:
+        return _NULL_SPAN
+    return _Span(_sink, name, _labels(labels))
+
+
+def timed(name):
+    """Decorator, time each call of the function as span name"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _sink is None:
+                return func(*args, **kwargs)
+            with _Span(_sink, name, ()):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def profile(func, *args, **kwargs):
+    """Run func under cProfile, regardless of the sink, return its result and the pstats.Stats of the call"""
+    profiler = cProfile.Profile()
+    result = profiler.runcall(func, *args, **kwargs)
+    return result, pstats.Stats(profiler)
+
+
+def _counted(name, func):
+    labels = (('function', name),)
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        sink = _sink
+        if sink is not None:
+            sink.count('wally_calls', 1, labels)
+        return func(*args, **kwargs)
+    return wrapper
+
+
+class _WallyCalls(object):
+    """Stand-in for the libwally module counting the calls of its functions, wrapped on first use"""
+
+    def __getattr__(self, name):
+        value = getattr(wallycore, name)
+        if callable(value) and not isinstance(value, type) and not name.startswith('_'):
+            value = _counted(name, value)
+        setattr(self, name, value)
+        return value
+
+
+def _count_wally_calls(on):
+    """Point the wally global of the selw modules to a _WallyCalls, or back to libwally
+
+    libwally itself is left alone, calls from other packages are not
+    counted. Modules call libwally as wally.<function>, looked up at each
+    call, so they see the change without being reloaded, aliases included.
+    FakeChain, which stands for the server, is not counted.
+    """
+    if on and not _wally_modules:
+        calls = _WallyCalls()
+        for name, module in list(sys.modules.items()):
+            if (name.startswith('selw.') and not name.startswith('selw.tests') and name != 'selw.fakechain'
+                    and getattr(module, 'wally', None) is wallycore):
+                module.wally = calls
+                _wally_modules.append(module)
+    elif not on and _wally_modules:
+        for module in _wally_modules:
+            module.wally = wallycore
+        _wally_modules.clear()
@@ -0,0 +1,47 @@
+import wallycore as wally
+
+from selw.address import AddressCodec
+from selw.constants import *
+from selw.utils import h2b_rev
+
+
+class Network(object):
+    """Parameters of an Elements network: address encodings and policy asset"""
+
+    def __init__(self, name, bech32_hrp, blech32_hrp, p2pkh_version, p2sh_version, confidential_prefix, policy_asset_hex):
+        self.name = name
+        self.bech32_hrp = bech32_hrp
+        self.blech32_hrp = blech32_hrp
+        self.p2pkh_version = p2pkh_version
+        self.p2sh_version = p2sh_version
+        self.confidential_prefix = confidential_prefix
+        self.policy_asset_hex = policy_asset_hex
+        # In internal byte order, as in transactions
+        self.policy_asset = bytes(h2b_rev(policy_asset_hex))
+        self.codec = AddressCodec(self)
+
+    def __repr__(self):
+        return 'Network({!r})'.format(self.name)
+
+    def parse_address(self, address):
+        """Return the scriptpubkey and the blinding public key, None if unconfidential, of address"""
+        return self.codec.decode(address)
+
+    def address(self, scriptpubkey, blinding_pubkey=None):
+        """Return the address of scriptpubkey, confidential if blinding_pubkey is given"""
+        return self.codec.encode(scriptpubkey, blinding_pubkey)
+
+
+LIQUID = Network(
+    'liquid', BECH32_FAMILY_LIQUID, BLECH32_FAMILY_LIQUID, wally.WALLY_ADDRESS_VERSION_P2PKH_LIQUID,
+    wally.WALLY_ADDRESS_VERSION_P2SH_LIQUID, wally.WALLY_CA_PREFIX_LIQUID, LBTC_HEX_LIQUID)
+LIQUID_TESTNET = Network(
+    'liquidtestnet', BECH32_FAMILY_TESTNET_LIQUID, BLECH32_FAMILY_TESTNET_LIQUID,
+    wally.WALLY_ADDRESS_VERSION_P2PKH_LIQUID_TESTNET, wally.WALLY_ADDRESS_VERSION_P2SH_LIQUID_TESTNET,
+    wally.WALLY_CA_PREFIX_LIQUID_TESTNET, LBTC_HEX)
+ELEMENTS_REGTEST = Network(
+    'elementsregtest', BECH32_FAMILY_ELEMENTS_REGTEST, BLECH32_FAMILY_ELEMENTS_REGTEST,
+    wally.WALLY_ADDRESS_VERSION_P2PKH_LIQUID_REGTEST, wally.WALLY_ADDRESS_VERSION_P2SH_LIQUID_REGTEST,
+    wally.WALLY_CA_PREFIX_LIQUID_REGTEST, POLICY_ASSET_HEX_ELEMENTS_REGTEST)
+
+NETWORKS = {network.name: network for network in (LIQUID, LIQUID_TESTNET, ELEMENTS_REGTEST)}
@@ -3,35 +3,79 @@ from typing import List
 
 from selw.key import *
 from selw.constants import *
+from selw.network import LIQUID_TESTNET
+
+
+def memoized(func):
+    """Read-only property computed on first access and stored in the slot '_<name>'"""
+    slot = '_' + func.__name__
+
+    def getter(self):
+        try:
+            return getattr(self, slot)
+        except AttributeError:
+            value = func(self)
+            object.__setattr__(self, slot, value)
+            return value
+    return property(getter, doc=func.__doc__)
 
 
 class ElementsOutput(object):
-    """Base class for Elements outputs"""
+    """Base class for Elements outputs
+
+    Outputs are immutable, scripts and addresses are computed once, on first
+    access. Outputs are equal if they have the same type, scriptpubkey and
+    blinding key, and can be used as dict keys. Addresses are for network.
+    """
 
-    def __init__(self, key, blinding_key):
+    __slots__ = ('key', 'blinding_key', 'network', '_witness_script', '_scriptpubkey', '_unconf_address', '_conf_address')
+
+    def __init__(self, key, blinding_key, network=LIQUID_TESTNET):
         _key = ECKey()
         _key.prv = key
         _blinding_key = ECKey()
         _blinding_key.prv = blinding_key
-        self.key = _key
-        self.blinding_key = _blinding_key
+        object.__setattr__(self, 'key', _key)
+        object.__setattr__(self, 'blinding_key', _blinding_key)
+        object.__setattr__(self, 'network', network)
+
+    def __setattr__(self, name, value):
+        raise AttributeError('{} is immutable'.format(type(self).__name__))
+
+    def __eq__(self, other):
+        return type(self) is type(other) and \
+            self.scriptpubkey == other.scriptpubkey and \
+            self.blinding_key.pub == other.blinding_key.pub
+
+    def __hash__(self):
+        return hash(bytes(self.scriptpubkey))
+
+    @memoized
+    def unconf_address(self) -> str:
+        return self.network.address(self.scriptpubkey)
+
+    @memoized
+    def conf_address(self) -> str:
+        return self.network.address(self.scriptpubkey, self.blinding_key.pub)
 
 
 class P2wpkhElementsOutput(ElementsOutput):
     """P2WPKH output"""
 
-    def __init__(self, key, blinding_key):
-        super().__init__(key, blinding_key)
+    __slots__ = ('_witness_program', '_scriptcode')
+
+    def __init__(self, key, blinding_key, network=LIQUID_TESTNET):
+        super().__init__(key, blinding_key, network)
 
     @property
     def witness_script(self) -> bytes:
         return self.key.pub
 
-    @property
+    @memoized
     def witness_program(self) -> bytes:
         return wally.sha256(self.witness_script)
 
-    @property
+    @memoized
     def scriptcode(self) -> bytes:
         return wally.scriptpubkey_p2pkh_from_bytes(self.witness_script, wally.WALLY_SCRIPT_HASH160)
 
@@ -39,19 +83,10 @@ class P2wpkhElementsOutput(ElementsOutput):
     def redeem_script(self) -> bytes:
         raise NotImplementedError
 
-    @property
+    @memoized
     def scriptpubkey(self) -> bytes:
         return wally.witness_program_from_bytes(self.witness_script, wally.WALLY_SCRIPT_HASH160)
 
-    @property
-    def unconf_address(self) -> str:
-        return wally.addr_segwit_from_bytes(self.scriptpubkey, BECH32_FAMILY_TESTNET_LIQUID, 0)
-
-    @property
-    def conf_address(self) -> str:
-        return wally.confidential_addr_from_addr_segwit(
-            self.unconf_address(), BECH32_FAMILY_TESTNET_LIQUID, BLECH32_FAMILY_TESTNET_LIQUID, self.blinding_key.pub)
-
     def sign(self, h):
         """Produce a DER encoded signature using the user key"""
         return self.key.sign(h)
@@ -75,11 +110,12 @@ class Multisig(ElementsOutput):
     Note that changing the order of keys, changes the scriptpubkey and address
     """
 
-    def __init__(self, threshold: int, keys: List[bytes], blinding_key: bytes):
+    __slots__ = ('threshold', 'keys')
+
+    def __init__(self, threshold: int, keys: List[bytes], blinding_key: bytes, network=LIQUID_TESTNET):
         if threshold < 1 or threshold > len(keys):
             raise InvalidMultisig
-        self.threshold = threshold
-        self.keys = []
+        _keys = []
         for key in keys:
             _key = ECKey()
             if len(key) == 32:
@@ -88,15 +124,20 @@ class Multisig(ElementsOutput):
                 _key.pub = key
             else:
                 assert False, "Unexpected key length"
-            self.keys.append(_key)
+            _keys.append(_key)
         _blinding_key = ECKey()
         _blinding_key.prv = blinding_key
-        self.blinding_key = _blinding_key
+        object.__setattr__(self, 'threshold', threshold)
+        object.__setattr__(self, 'keys', tuple(_keys))
+        object.__setattr__(self, 'blinding_key', _blinding_key)
+        object.__setattr__(self, 'network', network)
 
 
 class P2wshMultisig(Multisig):
 
-    @property
+    __slots__ = ()
+
+    @memoized
     def witness_script(self) -> bytes:
         pubkeys_concat = b''.join(key.pub for key in self.keys)
         return wally.scriptpubkey_multisig_from_bytes(pubkeys_concat, self.threshold, 0)
@@ -105,28 +146,21 @@ class P2wshMultisig(Multisig):
     def script_sig(self) -> bytes:
         return b''
 
-    @property
+    @memoized
     def scriptpubkey(self) -> bytes:
         return wally.witness_program_from_bytes(self.witness_script, wally.WALLY_SCRIPT_SHA256)
 
-    @property
-    def unconf_address(self) -> str:
-        return wally.addr_segwit_from_bytes(self.scriptpubkey, BECH32_FAMILY_TESTNET_LIQUID, 0)
-
-    @property
-    def conf_address(self) -> str:
-        return wally.confidential_addr_from_addr_segwit(
-            self.unconf_address(), BECH32_FAMILY_TESTNET_LIQUID, BLECH32_FAMILY_TESTNET_LIQUID, self.blinding_key.pub)
-
 
 class P2wsh2of3ElementsOutput(P2wshMultisig):
     """P2WSH-2OF3 Elements output"""
 
-    def __init__(self, keys: List[bytes], blinding_key: bytes):
+    __slots__ = ('_witness_program',)
+
+    def __init__(self, keys: List[bytes], blinding_key: bytes, network=LIQUID_TESTNET):
         assert len(keys) == 3, "Need 3 keys"
-        super().__init__(2, keys, blinding_key)
+        super().__init__(2, keys, blinding_key, network)
 
-    @property
+    @memoized
     def witness_program(self) -> bytes:
         return wally.sha256(self.witness_script)
 
@@ -0,0 +1,247 @@
+import heapq
+import threading
+import time
+
+from selw.coinselect import BNB, UtxoIndex, select_coins
+
+# Seconds a selected utxo stays reserved, unless released or renewed
+DEFAULT_LEASE = 600
+
+
+def _update(totals, asset, delta):
+    value = totals.get(asset, 0) + delta
+    if value:
+        totals[asset] = value
+    else:
+        totals.pop(asset, None)
+
+
+class BalanceIndex(object):
+    """Per-asset totals of a set of utxos, keyed by the 32 bytes asset
+
+    Utxos without a height (or at height 0) count as unconfirmed. Updates
+    are O(1), reading a total is O(number of assets).
+    """
+
+    def __init__(self):
+        self.confirmed = {}
+        self.unconfirmed = {}
+        self.reserved = {}
+
+    def add(self, utxo, sign=1):
+        _update(self.confirmed if utxo.height else self.unconfirmed, bytes(utxo.asset), sign * utxo.value)
+
+    def remove(self, utxo):
+        self.add(utxo, -1)
+
+    def reserve(self, utxo, sign=1):
+        _update(self.reserved, bytes(utxo.asset), sign * utxo.value)
+
+    def unreserve(self, utxo):
+        self.reserve(utxo, -1)
+
+    def total(self):
+        totals = dict(self.confirmed)
+        for asset, value in self.unconfirmed.items():
+            _update(totals, asset, value)
+        return totals
+
+    def available(self):
+        """Totals not reserved"""
+        totals = self.total()
+        for asset, value in self.reserved.items():
+            _update(totals, asset, -value)
+        return totals
+
+
+class UtxoPool(object):
+    """The utxos of a wallet, with reservations and a BalanceIndex
+
+    Utxos selected for a transaction being built are reserved for a lease,
+    so that concurrent builders do not pick them. A lease of None never
+    expires. Expired leases are released lazily, before selecting.
+
+    Transactions sent but not confirmed are tracked as pending: the utxos
+    they spend leave the pool, their outputs paying the wallet join it, so
+    that change can be spent at once. Dropping a pending transaction undoes
+    both.
+
+    All methods take lock, which is only held for in-memory work and never
+    across I/O, so the pool can be used from threads and from coroutines.
+    Hold lock to run several calls atomically.
+    """
+
+    def __init__(self, clock=time.monotonic):
+        self.lock = threading.RLock()
+        self.clock = clock
+        self._utxos = {}  # outpoint -> utxo
+        self.index = UtxoIndex()  # utxos not reserved
+        self.leases = {}  # outpoint -> expiry, None if it never expires
+        self._expiries = []  # heap of (expiry, outpoint), may contain stale entries
+        self.balances = BalanceIndex()
+        self.pending = {}  # txid -> ([spent outpoint], [removed utxo], [created outpoint])
+        self.spent = set()  # outpoints spent by pending transactions
+        self.unseen = set()  # outpoints created by pending transactions, not listed by the server yet
+
+    def __len__(self):
+        return len(self._utxos)
+
+    def __contains__(self, outpoint):
+        return outpoint in self._utxos
+
+    def utxos(self):
+        """Snapshot of the utxos"""
+        with self.lock:
+            return list(self._utxos.values())
+
+    def get(self, outpoint):
+        return self._utxos.get(outpoint)
+
+    def _discard(self, utxo):
+        self.balances.remove(utxo)
+        if utxo.outpoint in self.leases:
+            self.balances.unreserve(utxo)
+        self.index.remove(utxo)
+
+    def add(self, utxo):
+        """Add utxo, replacing the one at the same outpoint if any, its reservation is kept"""
+        with self.lock:
+            outpoint = utxo.outpoint
+            old = self._utxos.get(outpoint)
+            if old is utxo:
+                return
+            if old is not None:
+                self._discard(old)
+            self._utxos[outpoint] = utxo
+            self.balances.add(utxo)
+            if outpoint in self.leases:
+                self.balances.reserve(utxo)
+            else:
+                self.index.add(utxo)
+
+    def remove(self, outpoint):
+        """Remove the utxo at outpoint and its reservation, return it or None if missing"""
+        with self.lock:
+            utxo = self._utxos.pop(outpoint, None)
+            if utxo is None:
+                return None
+            self._discard(utxo)
+            self.leases.pop(outpoint, None)
+            return utxo
+
+    def clear(self):
+        with self.lock:
+            self._utxos.clear()
+            self.index = UtxoIndex()
+            self.leases.clear()
+            self._expiries.clear()
+            self.balances = BalanceIndex()
+            self.pending.clear()
+            self.spent.clear()
+            self.unseen.clear()
+
+    def reserve(self, utxos, lease=DEFAULT_LEASE):
+        """Keep utxos out of selection for lease seconds, reserving them again renews the lease"""
+        with self.lock:
+            expiry = None if lease is None else self.clock() + lease
+            for utxo in utxos:
+                outpoint = utxo.outpoint
+                if outpoint not in self.leases and outpoint in self._utxos:
+                    self.balances.reserve(self._utxos[outpoint])
+                self.leases[outpoint] = expiry
+                self.index.remove(utxo)
+                if expiry is not None:
+                    heapq.heappush(self._expiries, (expiry, utxo.outpoint))
+
+    def _release(self, outpoint):
+        if outpoint not in self.leases:
+            return
+        del self.leases[outpoint]
+        utxo = self._utxos.get(outpoint)
+        if utxo is not None:
+            self.balances.unreserve(utxo)
+            self.index.add(utxo)
+
+    def release(self, utxos):
+        with self.lock:
+            for utxo in utxos:
+                self._release(utxo.outpoint)
+
+    def expire(self):
+        """Release the utxos whose lease expired"""
+        with self.lock:
+            now = self.clock()
+            while self._expiries and self._expiries[0][0] <= now:
+                expiry, outpoint = heapq.heappop(self._expiries)
+                if self.leases.get(outpoint, expiry) == expiry:
+                    self._release(outpoint)
+
+    def select(self, targets, strategy=BNB, lease=DEFAULT_LEASE):
+        """Select utxos paying targets, as select_coins, and reserve them"""
+        with self.lock:
+            self.expire()
+            utxos = select_coins(self.index, targets, strategy)
+            self.reserve(utxos, lease)
+            return utxos
+
+    def add_pending(self, txid, spent, created):
+        """Track transaction txid, spending the outpoints spent and creating the utxos created"""
+        with self.lock:
+            if txid in self.pending:
+                return
+            removed = [utxo for utxo in map(self.remove, spent) if utxo is not None]
+            self.spent.update(spent)
+            for utxo in created:
+                self.add(utxo)
+                self.unseen.add(utxo.outpoint)
+            self.pending[txid] = (list(spent), removed, [utxo.outpoint for utxo in created])
+
+    def drop_pending(self, txid):
+        """Forget the outputs of pending transaction txid and restore the utxos it spent"""
+        with self.lock:
+            if txid not in self.pending:
+                return
+            spent, removed, created = self.pending.pop(txid)
+            for outpoint in created:
+                self.remove(outpoint)
+                self.unseen.discard(outpoint)
+            self.spent.difference_update(spent)
+            for utxo in removed:
+                self.add(utxo)
+
+    def confirm_pending(self, txid, height=None):
+        """Pending transaction txid confirmed at height, its spent utxos are gone for good"""
+        with self.lock:
+            if txid not in self.pending:
+                return
+            spent, _, created = self.pending.pop(txid)
+            for outpoint in created:
+                self.unseen.discard(outpoint)
+                self.set_height(outpoint, height)
+            self.spent.difference_update(spent)
+
+    def set_height(self, outpoint, height):
+        """Set the height of the utxo at outpoint, moving it between confirmed and unconfirmed"""
+        with self.lock:
+            utxo = self._utxos.get(outpoint)
+            if utxo is None or utxo.height == height:
+                return
+            self.balances.remove(utxo)
+            utxo.height = height
+            self.balances.add(utxo)
+
+    def seen(self, outpoint):
+        """The server listed outpoint, sync can drop it once it stops doing so"""
+        with self.lock:
+            self.unseen.discard(outpoint)
+
+    def balance(self, kind='total'):
+        """Dict asset (32 bytes) -> value, of kind total, confirmed, unconfirmed, reserved or available"""
+        with self.lock:
+            if kind == 'total':
+                return self.balances.total()
+            if kind == 'available':
+                return self.balances.available()
+            if kind in ('confirmed', 'unconfirmed', 'reserved'):
+                return dict(getattr(self.balances, kind))
+            raise ValueError('Unknown balance: {}'.format(kind))
@@ -0,0 +1,302 @@
+import os
+import wallycore as wally
+
+from selw import metrics
+from selw.key import KeyStore, verify_many
+from selw.utils import process_pool
+
+TX_FLAGS = wally.WALLY_TX_FLAG_USE_WITNESS | wally.WALLY_TX_FLAG_USE_ELEMENTS
+SEQUENCE = 0xfffffffe
+SIG_FLAGS = wally.EC_FLAG_ECDSA | wally.EC_FLAG_GRIND_R
+
+# Below this many signatures, spawning worker processes costs more than it saves
+MIN_PARALLEL_SIGN = 256
+
+
+def _sign_hashes(jobs):
+    """Return the DER signatures (with SIGHASH_ALL) of (signature hash, private key) pairs"""
+    sighash = bytes([wally.WALLY_SIGHASH_ALL])
+    return [wally.ec_sig_to_der(wally.ec_sig_from_bytes(prv, txhash, SIG_FLAGS)) + sighash for txhash, prv in jobs]
+
+
+def _script_pubkeys(script):
+    """Return the 33 bytes pushes of script, the public keys of a multisig script"""
+    pubkeys, i = [], 0
+    while i < len(script):
+        opcode, i = script[i], i + 1
+        if opcode <= 75:
+            size = opcode
+        elif opcode in (wally.OP_PUSHDATA1, wally.OP_PUSHDATA2, wally.OP_PUSHDATA4):
+            width = {wally.OP_PUSHDATA1: 1, wally.OP_PUSHDATA2: 2, wally.OP_PUSHDATA4: 4}[opcode]
+            size, i = int.from_bytes(script[i:i + width], 'little'), i + width
+        else:
+            continue
+        if size == wally.EC_PUBLIC_KEY_LEN:
+            pubkeys.append(bytes(script[i:i + size]))
+        i += size
+    return pubkeys
+
+
+def _input_map(values):
+    """libwally map of input index -> value"""
+    m = wally.map_init(len(values), None)
+    for i, value in enumerate(values):
+        wally.map_add_integer(m, i, value)
+    return m
+
+
+def _partition(items, n):
+    """Split items in n contiguous chunks of similar size"""
+    size, extra = divmod(len(items), n)
+    chunks, start = [], 0
+    for i in range(n):
+        end = start + size + (i < extra)
+        chunks.append(items[start:end])
+        start = end
+    return chunks
+
+
+class PsetBuilder(object):
+    """In-memory PSET builder
+
+    The native psbt is kept through adding inputs and outputs, blinding,
+    signing, finalization and extraction. It is serialized only when asked
+    with to_base64 or to_bytes.
+    """
+
+    def __init__(self, psbt=None, utxos=None):
+        if psbt is None:
+            psbt = wally.psbt_init(2, 0, 0, 0, wally.WALLY_PSBT_INIT_PSET)
+        self.psbt = psbt
+        # Spent utxos, in input order, needed for blinding
+        self.utxos = list(utxos or [])
+        # Output index -> (value, asset, abf, vbf, ephemeral key), set by blind
+        self.blinders = {}
+
+    @classmethod
+    def from_base64(cls, b64, utxos=None):
+        return cls(wally.psbt_from_base64(b64, 0), utxos)
+
+    @classmethod
+    def from_bytes(cls, buf, utxos=None):
+        return cls(wally.psbt_from_bytes(buf, 0), utxos)
+
+    def to_base64(self):
+        return wally.psbt_to_base64(self.psbt, 0)
+
+    def to_bytes(self):
+        return wally.psbt_to_bytes(self.psbt, 0)
+
+    @property
+    def num_inputs(self):
+        return wally.psbt_get_num_inputs(self.psbt)
+
+    @property
+    def num_outputs(self):
+        return wally.psbt_get_num_outputs(self.psbt)
+
+    def add_input(self, utxo):
+        """Add an input spending utxo, return its index"""
+        idx = self.num_inputs
+        inp = wally.tx_input_init(utxo.txid, utxo.vout, SEQUENCE, None, None)
+        wally.psbt_add_tx_input_at(self.psbt, idx, 0, inp)
+        # Witness UTXO
+        wally.psbt_set_input_witness_utxo(self.psbt, idx, utxo.txout())
+        wally.psbt_set_input_utxo_rangeproof(self.psbt, idx, utxo.rangeproof)
+        self.utxos.append(utxo)
+        return idx
+
+    def add_output(self, scriptpubkey, asset, value, blinding_pubkey=None):
+        """Add an output sending value of asset (32 bytes) to scriptpubkey, return its index
+
+        Outputs with a blinding_pubkey are blinded by blind, using the first
+        input as blinder.
+        """
+        _value = wally.tx_confidential_value_from_satoshi(value)
+        txout = wally.tx_elements_output_init(scriptpubkey, b'\x01' + asset, _value)
+        idx = self.num_outputs
+        wally.psbt_add_tx_output_at(self.psbt, idx, 0, txout)
+        if blinding_pubkey is not None:
+            wally.psbt_set_output_blinding_public_key(self.psbt, idx, blinding_pubkey)
+            wally.psbt_set_output_blinder_index(self.psbt, idx, 0)
+        return idx
+
+    def add_fee(self, asset, value):
+        return self.add_output(None, asset, value)
+
+    def blinded_outputs(self):
+        """Indexes of the outputs with a blinding public key"""
+        return [i for i in range(self.num_outputs) if wally.psbt_get_output_blinding_public_key_len(self.psbt, i)]
+
+    def unsigned_id(self):
+        """Hash of the unsigned transaction, computed as the id of the psbt"""
+        return wally.psbt_get_id(self.psbt, 0)
+
+    @metrics.timed('psbt_blind')
+    def blind(self, utxos=None, entropy=None):
+        """Blind the outputs, utxos defaults to the ones added as inputs
+
+        The explicit value and asset proofs of the inputs are added first.
+        entropy(n) returns n random bytes for both, it defaults to
+        os.urandom, pass a seeded HmacDrbg for reproducible blinding. Return
+        and keep in blinders the (value, asset, abf, vbf, ephemeral key) of
+        each blinded output, by output index.
+        """
+        utxos = self.utxos if utxos is None else utxos
+        entropy = os.urandom if entropy is None else entropy
+        for idx, utxo in enumerate(utxos):
+            if not wally.psbt_get_input_amount_rangeproof_len(self.psbt, idx):
+                wally.psbt_generate_input_explicit_proofs(
+                    self.psbt, idx, utxo.value, utxo.asset, utxo.abf, utxo.vbf, entropy(32))
+        blinded = self.blinded_outputs()
+        explicit = [(wally.psbt_get_output_amount(self.psbt, i), bytes(wally.psbt_get_output_asset(self.psbt, i)))
+                    for i in blinded]
+        # libwally takes abf, vbf, ephemeral key and two proof seeds per blinded output, in this order
+        random = entropy(32 * 5 * len(blinded))
+        metrics.count('outputs_blinded', len(blinded))
+        eph_keys = wally.psbt_blind(
+            self.psbt,
+            _input_map([wally.tx_confidential_value_from_satoshi(u.value) for u in utxos]),
+            _input_map([u.vbf for u in utxos]),
+            _input_map([u.asset for u in utxos]),
+            _input_map([u.abf for u in utxos]),
+            random,
+            wally.WALLY_PSET_BLIND_ALL,
+            0,
+        )
+        abfs = [random[160 * j:160 * j + 32] for j in range(len(blinded))]
+        vbfs = [random[160 * j + 32:160 * j + 64] for j in range(len(blinded) - 1)]
+        if blinded:
+            # The last value blinder balances the others
+            values = [u.value for u in utxos] + [value for value, _ in explicit]
+            vbfs.append(wally.asset_final_vbf(
+                values, len(utxos), b''.join([bytes(u.abf) for u in utxos] + abfs), b''.join([bytes(u.vbf) for u in utxos] + vbfs)))
+        eph_keys = wally.map_to_dict(eph_keys)
+        self.blinders = {i: (value, asset, abf, vbf, eph_keys[i]) for i, (value, asset), abf, vbf in zip(blinded, explicit, abfs, vbfs)}
+        return self.blinders
+
+    def _sighash_context(self):
+        """Return what signature_hash needs: unsigned tx, spent values, scriptcodes and the sighash cache"""
+        tx = wally.psbt_extract(self.psbt, wally.WALLY_PSBT_EXTRACT_NON_FINAL)
+        values = wally.map_init(self.num_inputs, None)
+        scripts = []
+        for idx in range(self.num_inputs):
+            utxo = wally.psbt_get_input_witness_utxo(self.psbt, idx)
+            wally.map_add_integer(values, idx, wally.tx_output_get_value(utxo))
+            scripts.append(wally.psbt_get_input_scriptcode(self.psbt, idx, wally.tx_output_get_script(utxo)))
+        return tx, values, scripts, wally.map_init(0, None)
+
+    @staticmethod
+    def _signature_hash(context, idx, sighash=wally.WALLY_SIGHASH_ALL):
+        tx, values, scripts, cache = context
+        return wally.tx_get_input_signature_hash(
+            tx, idx, None, None, values, scripts[idx], 0, 0xffffffff, None, None,
+            sighash, wally.WALLY_SIGTYPE_SW_V0, cache)
+
+    def signature_hashes(self):
+        """Return the SIGHASH_ALL signature hashes of the inputs and their scriptcodes
+
+        Hashes of prevouts, sequences, issuances and outputs are computed
+        once and shared by all inputs.
+        """
+        context = self._sighash_context()
+        return [self._signature_hash(context, idx) for idx in range(self.num_inputs)], context[2]
+
+    def _candidate_pubkeys(self, idx, script):
+        """Public keys that may have signed the idx-th input"""
+        pubkeys = set(_script_pubkeys(script))
+        if idx < len(self.utxos):
+            output = self.utxos[idx].output
+            for key in getattr(output, 'keys', None) or [output.key]:
+                pubkeys.add(bytes(key.pub))
+        return pubkeys
+
+    def verify_signatures(self, workers=None):
+        """Verify all the partial signatures with verify_many
+
+        Return the (input index, public key) of the signatures, in order,
+        and the verify_many bitmap of their validity. Signatures by keys
+        that are neither in the scriptcode nor in the utxos outputs cannot
+        be checked, they are returned with a None key and as invalid.
+        """
+        context = self._sighash_context()
+        signatures, items = [], []
+        for idx in range(self.num_inputs):
+            found = 0
+            for pub in sorted(self._candidate_pubkeys(idx, context[2][idx])):
+                position = wally.psbt_find_input_signature(self.psbt, idx, pub)
+                if position:
+                    sig = wally.psbt_get_input_signature(self.psbt, idx, position - 1)
+                    signatures.append((idx, pub))
+                    items.append((pub, self._signature_hash(context, idx, sig[-1]), sig[:-1]))
+                    found += 1
+            for _ in range(wally.psbt_get_input_signatures_size(self.psbt, idx) - found):
+                signatures.append((idx, None))
+                items.append((b'', None, None))
+        return signatures, verify_many(items, workers)
+
+    @metrics.timed('psbt_sign')
+    def sign(self, keys, workers=None):
+        """Sign the inputs whose keypaths have keys, a KeyStore or raw private keys
+
+        Keypaths are looked up once in the KeyStore, inputs with the same
+        scriptpubkey share the lookup. Inputs without keys of ours, or
+        already signed by them, are not hashed. The others are hashed once
+        and signed once by each of their keys. If workers is not None or there are
+        many signatures, they are computed by a pool of worker processes, on
+        contiguous partitions of the inputs.
+        """
+        if not isinstance(keys, KeyStore):
+            keys = KeyStore.from_private_keys(keys)
+        keys_by_script = {}
+        signers, jobs = [], []
+        context = None
+        for idx in range(self.num_inputs):
+            utxo = wally.psbt_get_input_witness_utxo(self.psbt, idx)
+            script = bytes(wally.tx_output_get_script(utxo))
+            if script not in keys_by_script:
+                keys_by_script[script] = keys.signers(self.psbt, idx)
+            if not keys_by_script[script]:
+                continue
+            if context is None:
+                context = self._sighash_context()
+            txhash = None
+            for pub, prv in keys_by_script[script]:
+                if not wally.psbt_find_input_signature(self.psbt, idx, pub):
+                    if txhash is None:
+                        txhash = self._signature_hash(context, idx)
+                    signers.append((idx, pub))
+                    jobs.append((txhash, prv))
+
+        metrics.count('signatures', len(jobs))
+        if workers is None and len(jobs) >= MIN_PARALLEL_SIGN:
+            workers = os.cpu_count() or 1
+        if workers is None or workers <= 1:
+            signatures = _sign_hashes(jobs)
+        else:
+            chunks = process_pool(workers).map(_sign_hashes, _partition(jobs, workers))
+            signatures = [sig for sigs in chunks for sig in sigs]
+        for (idx, pub), signature in zip(signers, signatures):
+            wally.psbt_add_input_signature(self.psbt, idx, pub, signature)
+
+    def finalize(self):
+        wally.psbt_finalize(self.psbt, 0)
+
+    def extract(self):
+        """Return the finalized transaction"""
+        return wally.psbt_extract(self.psbt, 0)
+
+    def tx_hex(self):
+        return wally.tx_to_hex(self.extract(), TX_FLAGS)
+
+
+def as_builder(psbt, utxos=None):
+    """Wrap a base64 PSET in a builder, builders are returned as they are"""
+    if isinstance(psbt, PsetBuilder):
+        return psbt
+    return PsetBuilder.from_base64(psbt, utxos)
+
+
+def like(builder, psbt):
+    """Return builder, or its base64 serialization if psbt was given as base64"""
+    return builder if isinstance(psbt, PsetBuilder) else builder.to_base64()
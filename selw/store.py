@@ -0,0 +1,105 @@
+import sqlite3
+import threading
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS txs (
+    txid TEXT PRIMARY KEY,
+    tx BLOB NOT NULL
+);
+CREATE TABLE IF NOT EXISTS utxos (
+    txid TEXT NOT NULL,
+    vout INTEGER NOT NULL,
+    value INTEGER NOT NULL,
+    asset BLOB NOT NULL,
+    abf BLOB NOT NULL,
+    vbf BLOB NOT NULL,
+    PRIMARY KEY (txid, vout)
+);
+CREATE TABLE IF NOT EXISTS blinders (
+    txid TEXT NOT NULL,
+    vout INTEGER NOT NULL,
+    value INTEGER NOT NULL,
+    asset BLOB NOT NULL,
+    abf BLOB NOT NULL,
+    vbf BLOB NOT NULL,
+    ephemeral_key BLOB NOT NULL,
+    PRIMARY KEY (txid, vout)
+);
+"""
+
+
+class UtxoStore(object):
+    """Persistent cache of parent transactions and unblinded UTXO data
+
+    Transactions are stored as raw bytes keyed by txid (hex), unblinded
+    data as (value, asset, abf, vbf) keyed by outpoint (txid hex, vout).
+    The blinders of the outputs of our own transactions paid to others are
+    kept for auditing, the ones of our outputs are dropped once spent.
+    A store belongs to a single wallet, which drops the outputs it does not
+    have on its first sync. Use ':memory:' as path for a non persistent
+    store.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        with self.lock, self.db:
+            self.db.executescript(SCHEMA)
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+    def get_txs(self, txids):
+        """Return a dict txid -> raw tx for the txids that are stored"""
+        txids = list(txids)
+        ret = {}
+        with self.lock:
+            # Keep well below SQLITE_MAX_VARIABLE_NUMBER
+            for i in range(0, len(txids), 500):
+                chunk = txids[i:i + 500]
+                query = 'SELECT txid, tx FROM txs WHERE txid IN ({})'.format(','.join('?' * len(chunk)))
+                ret.update(self.db.execute(query, chunk).fetchall())
+        return ret
+
+    def add_txs(self, txs):
+        """Store txs, a dict txid -> raw tx"""
+        with self.lock, self.db:
+            self.db.executemany('INSERT OR REPLACE INTO txs VALUES (?, ?)', txs.items())
+
+    def get_unblinded(self, txid, vout):
+        """Return (value, asset, abf, vbf) for the outpoint, None if unknown"""
+        with self.lock:
+            return self.db.execute(
+                'SELECT value, asset, abf, vbf FROM utxos WHERE txid = ? AND vout = ?', (txid, vout)).fetchone()
+
+    def add_unblinded(self, rows):
+        """Store rows of (txid, vout, value, asset, abf, vbf)"""
+        with self.lock, self.db:
+            self.db.executemany('INSERT OR REPLACE INTO utxos VALUES (?, ?, ?, ?, ?, ?)', rows)
+
+    def add_blinders(self, rows):
+        """Store rows of (txid, vout, value, asset, abf, vbf, ephemeral key)"""
+        with self.lock, self.db:
+            self.db.executemany('INSERT OR REPLACE INTO blinders VALUES (?, ?, ?, ?, ?, ?, ?)', rows)
+
+    def get_blinders(self, txid):
+        """Return a dict vout -> (value, asset, abf, vbf, ephemeral key) of the outputs of txid we blinded"""
+        with self.lock:
+            rows = self.db.execute(
+                'SELECT vout, value, asset, abf, vbf, ephemeral_key FROM blinders WHERE txid = ?', (txid,)).fetchall()
+        return {row[0]: row[1:] for row in rows}
+
+    def outpoints(self):
+        """The outpoints with unblinded data, as (txid hex, vout)"""
+        with self.lock:
+            return [tuple(row) for row in self.db.execute('SELECT txid, vout FROM utxos').fetchall()]
+
+    def remove(self, outpoints):
+        """Forget spent outpoints, their blinders, and their parent txs if no other output is left"""
+        outpoints = list(outpoints)
+        with self.lock, self.db:
+            self.db.executemany('DELETE FROM utxos WHERE txid = ? AND vout = ?', outpoints)
+            self.db.executemany('DELETE FROM blinders WHERE txid = ? AND vout = ?', outpoints)
+            self.db.execute('DELETE FROM txs WHERE txid NOT IN (SELECT txid FROM utxos)')
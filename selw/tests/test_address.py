@@ -0,0 +1,76 @@
+import unittest
+import wallycore as wally
+
+from selw.exceptions import InvalidAddress
+from selw.network import ELEMENTS_REGTEST, LIQUID, LIQUID_TESTNET, NETWORKS
+from selw.wallet import WalletP2wpkh
+from selw.tests.test_pset import fund
+
+WALLY_NETWORKS = {
+    'liquid': wally.WALLY_NETWORK_LIQUID,
+    'liquidtestnet': wally.WALLY_NETWORK_LIQUID_TESTNET,
+    'elementsregtest': wally.WALLY_NETWORK_LIQUID_REGTEST,
+}
+
+
+class TestAddressCodec(unittest.TestCase):
+
+    def setUp(self):
+        pub = wally.ec_public_key_from_private_key(b'\x01' * 32)
+        self.blinding_pubkey = bytes(wally.ec_public_key_from_private_key(b'\x02' * 32))
+        self.scriptpubkeys = [
+            wally.witness_program_from_bytes(pub, wally.WALLY_SCRIPT_HASH160),
+            wally.witness_program_from_bytes(pub, wally.WALLY_SCRIPT_SHA256),
+            wally.scriptpubkey_p2pkh_from_bytes(pub, wally.WALLY_SCRIPT_HASH160),
+            wally.scriptpubkey_p2sh_from_bytes(pub, wally.WALLY_SCRIPT_HASH160),
+        ]
+
+    def test_round_trip(self):
+        for network in NETWORKS.values():
+            for spk in self.scriptpubkeys:
+                for pub in (None, self.blinding_pubkey):
+                    address = network.address(spk, pub)
+                    self.assertEqual(network.parse_address(address), (bytes(spk), pub))
+
+    def test_legacy_matches_libwally(self):
+        for network in NETWORKS.values():
+            for spk in self.scriptpubkeys[2:]:
+                address = wally.scriptpubkey_to_address(spk, WALLY_NETWORKS[network.name])
+                self.assertEqual(network.address(spk), address)
+                conf_address = wally.confidential_addr_from_addr(address, network.confidential_prefix, self.blinding_pubkey)
+                self.assertEqual(network.address(spk, self.blinding_pubkey), conf_address)
+                # Parsed without going through the encoding cache
+                network.codec.decoded.clear()
+                self.assertEqual(network.parse_address(conf_address), (bytes(spk), self.blinding_pubkey))
+
+    def test_cached(self):
+        address = LIQUID_TESTNET.address(self.scriptpubkeys[0], self.blinding_pubkey)
+        LIQUID_TESTNET.codec.decoded.clear()
+        decoded = LIQUID_TESTNET.parse_address(address)
+        self.assertIs(LIQUID_TESTNET.parse_address(address), decoded)
+        self.assertIs(LIQUID_TESTNET.address(*decoded), address)
+
+    def test_invalid(self):
+        address = LIQUID.address(self.scriptpubkeys[0], self.blinding_pubkey)
+        for invalid in (address[:-1], 'not an address', LIQUID.address(self.scriptpubkeys[2])):
+            with self.assertRaises(InvalidAddress):
+                LIQUID_TESTNET.parse_address(invalid)
+
+    def test_wallet_network(self):
+        w = WalletP2wpkh(b'\x02' * 32, b'\x01' * 32, network=ELEMENTS_REGTEST)
+        self.assertTrue(w.address().startswith('el1'))
+        self.assertTrue(w.unconf_address().startswith('ert1'))
+        self.assertEqual(w.output.conf_address, w.address())
+        self.assertEqual(w.change_address(), w.address())
+
+        # Fees are paid with the network's policy asset
+        fund(w, [5000], ELEMENTS_REGTEST.policy_asset_hex)
+        builder = w.build_psbt(None, w.address(), ELEMENTS_REGTEST.policy_asset_hex, 1000)
+        tx = wally.psbt_extract(builder.psbt, wally.WALLY_PSBT_EXTRACT_NON_FINAL)
+        fee_index = builder.num_outputs - 1
+        self.assertFalse(wally.tx_get_output_script(tx, fee_index))
+        self.assertEqual(wally.tx_get_output_asset(tx, fee_index)[1:], ELEMENTS_REGTEST.policy_asset)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,132 @@
+import unittest
+
+from selw.backend import ElementsRpc
+from selw.broadcast import CONFIRMED, BroadcastQueue
+from selw.constants import LBTC_HEX
+from selw.exceptions import BroadcastError
+from selw.fakechain import FakeChain
+from selw.hdwallet import CHANGE, RECEIVE, HDWalletP2wpkh
+from selw.wallet import DEFAULT_FEE, WalletP2wpkh
+from selw.tests.test_hdwallet import account
+from selw.tests.util import FakeElementsRpc
+
+
+class TestFakeChain(unittest.TestCase):
+
+    def setUp(self):
+        self.chain = FakeChain()
+        self.wallet = WalletP2wpkh(b'\x02' * 32, b'\x01' * 32)
+
+    def signed(self, value=1000, utxos=None):
+        w = self.wallet
+        builder = w.build_psbt(utxos, w.address(), LBTC_HEX, value)
+        w.blind_psbt(builder, builder.utxos)
+        w.sign_psbt(builder, builder.utxos)
+        builder.finalize()
+        return builder
+
+    def test_sync(self):
+        w = self.wallet
+        self.chain.fund(w.scriptpubkey, [1000] * 300, blinding_pubkey=w.public_blinding_key(), reuse_proofs=True)
+        self.chain.fund(w.scriptpubkey, [5000])
+        w.sync(self.chain)
+        self.assertEqual(w.balance(), {LBTC_HEX: 305000})
+        # 301 utxos from 4 transactions
+        self.assertEqual(self.chain.calls, {'get_address_utxos': 1, 'get_tx_hex': 4})
+
+        # Outputs not blinded to us are skipped
+        self.chain.fund(w.scriptpubkey, [7000], blinding_pubkey=WalletP2wpkh(b'\x03' * 32, b'\x04' * 32).public_blinding_key())
+        w.sync(self.chain)
+        self.assertEqual(w.balance(), {LBTC_HEX: 305000})
+
+    def test_send_and_confirm(self):
+        w = self.wallet
+        self.chain.fund(w.scriptpubkey, [3000, 4000], blinding_pubkey=w.public_blinding_key())
+        w.sync(self.chain)
+        builder = self.signed()
+        txid = w.send_psbt(builder, self.chain)
+        self.assertEqual(self.chain.get_tx_status(txid), {'confirmed': False, 'block_height': None})
+        # Already known
+        self.assertEqual(self.chain.broadcast(builder.tx_hex()), txid)
+        self.chain.mine()
+        self.assertEqual(self.chain.get_tx_status(txid), {'confirmed': True, 'block_height': 2})
+
+        w.sync(self.chain)
+        self.assertEqual(len(w.utxos), 3)
+        # Only the fee was spent
+        self.assertEqual(w.balance(), {LBTC_HEX: 7000 - DEFAULT_FEE})
+
+    def test_double_spend(self):
+        w = self.wallet
+        self.chain.fund(w.scriptpubkey, [3000], blinding_pubkey=w.public_blinding_key())
+        w.sync(self.chain)
+        builder = self.signed(1000)
+        w.send_psbt(builder, self.chain)
+        with self.assertRaises(BroadcastError):
+            w.send_psbt(self.signed(2000, builder.utxos), self.chain)
+        with self.assertRaises(BroadcastError):
+            self.chain.broadcast('00')
+
+    def test_broadcast_queue(self):
+        w = self.wallet
+        self.chain.fund(w.scriptpubkey, [3000, 4000], blinding_pubkey=w.public_blinding_key())
+        w.sync(self.chain)
+        with BroadcastQueue(self.chain, w) as broadcasts:
+            builder = self.signed()
+            broadcast = broadcasts.submit(builder.tx_hex())
+            self.assertTrue(broadcast.done.wait(5))
+            self.assertEqual(broadcasts.poll(), [])
+            self.chain.mine()
+            self.assertEqual(broadcasts.poll(), [broadcast])
+        self.assertEqual(broadcast.state, CONFIRMED)
+        self.assertEqual(len(w.utxos), 3)
+
+    def test_hd_scan(self):
+        wallet = HDWalletP2wpkh(account(b'\x01' * 32), b'\x01' * 32, gap_limit=5)
+        for chain, index in [(RECEIVE, 0), (RECEIVE, 4), (RECEIVE, 11), (CHANGE, 2)]:
+            output = wallet.output_at(chain, index)
+            self.chain.fund(output.scriptpubkey, [1000], blinding_pubkey=wallet.public_blinding_key())
+        wallet.sync(self.chain)
+        self.assertEqual(wallet.last_used, {RECEIVE: 4, CHANGE: 2})
+        self.assertEqual(wallet.balance(), {LBTC_HEX: 3000})
+
+
+class TestElementsRpc(unittest.TestCase):
+
+    def setUp(self):
+        self.chain = FakeChain()
+        self.wallet = WalletP2wpkh(b'\x02' * 32, b'\x01' * 32)
+
+    def test_sync_and_broadcast(self):
+        w = self.wallet
+        self.chain.fund(w.scriptpubkey, [3000, 4000], blinding_pubkey=w.public_blinding_key(), outputs_per_tx=1)
+        self.chain.fund(w.scriptpubkey, [5000])
+        self.chain.fee_estimates = {'2': 0.5, '6': 0.2}
+        with FakeElementsRpc(self.chain) as fake:
+            rpc = ElementsRpc(fake.url)
+            w.sync(rpc)
+            self.assertEqual(w.balance(), {LBTC_HEX: 12000})
+            # scantxoutset, then the 3 transactions in one batch
+            self.assertEqual(fake.requests, 2)
+            self.assertEqual(rpc.get_address_tx_count(w.unconf_address()), 3)
+            self.assertEqual(rpc.get_fee_estimates(), {2: 0.5, 3: 0.5, 6: 0.2, 12: 0.2, 24: 0.2, 144: 0.2, 504: 0.2, 1008: 0.2})
+
+            builder = w.build_psbt(None, w.address(), LBTC_HEX, 1000)
+            w.blind_psbt(builder, builder.utxos)
+            w.sign_psbt(builder, builder.utxos)
+            txid = w.send_psbt(builder, rpc)
+            self.assertEqual(rpc.get_txs_status([txid, 'ff' * 32]), {txid: {'confirmed': False}, 'ff' * 32: None})
+            self.chain.mine()
+            self.assertEqual(rpc.get_tx_status(txid), {'confirmed': True, 'block_height': 2})
+            # Already in chain
+            self.assertEqual(rpc.broadcast(builder.tx_hex()), txid)
+            with self.assertRaises(BroadcastError):
+                rpc.broadcast('00')
+
+    def test_no_history(self):
+        with self.assertRaises(NotImplementedError):
+            list(self.wallet.history(ElementsRpc('http://127.0.0.1:1')))
+
+
+if __name__ == "__main__":
+    unittest.main()
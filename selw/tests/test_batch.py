@@ -0,0 +1,86 @@
+import unittest
+import wallycore as wally
+from unittest import mock
+
+from selw.constants import LBTC_HEX
+from selw.wallet import WalletP2wpkh, parse_address
+from selw.tests.test_pset import fund
+
+ASSET_HEX = '11' * 32
+
+
+def recipients(n, asset_hex=LBTC_HEX, value=100):
+    return [(WalletP2wpkh(bytes([i + 10]) * 32, b'\x04' * 32).address(), asset_hex, value + i) for i in range(n)]
+
+
+def finalized(wallet, builder):
+    wallet.blind_psbt(builder, builder.utxos)
+    wallet.sign_psbt(builder, builder.utxos)
+    builder.finalize()
+    return builder.extract()
+
+
+class TestBatchPayments(unittest.TestCase):
+
+    def setUp(self):
+        self.wallet = WalletP2wpkh(b'\x02' * 32, b'\x01' * 32)
+
+    def paid(self, tx):
+        """(scriptpubkey, value) of the outputs, unblinded with the recipients blinding key"""
+        paid = []
+        for i in range(wally.tx_get_num_outputs(tx) - 1):
+            try:
+                value, _, _, _ = wally.asset_unblind(
+                    wally.tx_get_output_nonce(tx, i), b'\x04' * 32, wally.tx_get_output_rangeproof(tx, i),
+                    wally.tx_get_output_value(tx, i), wally.tx_get_output_script(tx, i), wally.tx_get_output_asset(tx, i))
+            except ValueError:
+                continue
+            paid.append((bytes(wally.tx_get_output_script(tx, i)), value))
+        return paid
+
+    def test_single_transaction(self):
+        fund(self.wallet, [5000, 5000])
+        fund(self.wallet, [1000], ASSET_HEX)
+        batch = recipients(2) + recipients(2, ASSET_HEX)
+        builder = self.wallet.build_batch_psbt(None, batch, feerate=0.1)
+        # 4 payments, a change for each asset and the fee
+        self.assertEqual(builder.num_outputs, 7)
+        tx = finalized(self.wallet, builder)
+        self.assertEqual(self.paid(tx), [(parse_address(a)[0], v) for a, _, v in batch])
+
+    def test_split_by_outputs(self):
+        fund(self.wallet, [2000] * 6)
+        batch = recipients(5)
+        builders = self.wallet.build_batch_psbts(batch, max_outputs=4)
+        self.assertEqual([b.num_outputs for b in builders], [4, 4, 3])
+        spent = [u.outpoint for b in builders for u in b.utxos]
+        self.assertEqual(len(spent), len(set(spent)))
+        paid = [p for b in builders for p in self.paid(finalized(self.wallet, b))]
+        self.assertEqual(paid, [(parse_address(a)[0], v) for a, _, v in batch])
+
+    def test_split_by_vsize(self):
+        fund(self.wallet, [2000] * 6)
+        builders = self.wallet.build_batch_psbts(recipients(4), feerate=0.1, max_vsize=4000)
+        self.assertGreater(len(builders), 1)
+        for builder in builders:
+            self.assertLessEqual(wally.tx_get_vsize(finalized(self.wallet, builder)), 4000)
+
+    def test_failures_release_utxos(self):
+        fund(self.wallet, [2000] * 6)
+        address = recipients(1)[0][0]
+        for value in (0, -100, 1.5, True):
+            with self.assertRaises(ValueError):
+                self.wallet.build_batch_psbt(None, [(address, LBTC_HEX, value)])
+        with mock.patch('selw.wallet.PsetBuilder.add_input', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                self.wallet.build_batch_psbt(None, recipients(1))
+            with self.assertRaises(RuntimeError):
+                self.wallet.build_batch_psbts(recipients(5), max_outputs=4)
+            with self.assertRaises(RuntimeError):
+                self.wallet.build_sweep_psbt(self.wallet.utxos[:2])
+        self.assertEqual(self.wallet.pool.leases, {})
+        self.assertEqual(len(self.wallet.utxo_index), 6)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,128 @@
+import queue
+import time
+import unittest
+from unittest import mock
+
+from selw.broadcast import CONFIRMED, DROPPED, FAILED, SENT, BroadcastQueue
+from selw.constants import LBTC_HEX
+from selw.esplora import Esplora
+from selw.exceptions import BroadcastError
+from selw.wallet import WalletP2wpkh
+from selw.tests.test_pset import fund
+from selw.tests.util import FakeEsplora
+
+
+class TestBroadcastQueue(unittest.TestCase):
+
+    def setUp(self):
+        self.wallet = WalletP2wpkh(b'\x02' * 32, b'\x01' * 32)
+        fund(self.wallet, [3000, 4000])
+
+    def signed(self, value=1000):
+        w = self.wallet
+        builder = w.build_psbt(None, w.address(), LBTC_HEX, value)
+        w.blind_psbt(builder, builder.utxos)
+        w.sign_psbt(builder, builder.utxos)
+        return builder
+
+    def test_send_psbt(self):
+        with FakeEsplora() as fake:
+            builder = self.signed()
+            client = self.wallet.esplora(fake.url)
+            # Through the wallet's client
+            with mock.patch.object(client, 'broadcast', wraps=client.broadcast) as broadcast:
+                txid = self.wallet.send_psbt(builder, fake.url)
+            broadcast.assert_called_once()
+            self.assertIn(txid, fake.mempool)
+            # Already known
+            self.assertEqual(Esplora(fake.url).broadcast(builder.tx_hex()), txid)
+            with self.assertRaises(BroadcastError) as cm:
+                Esplora(fake.url).broadcast('00')
+            self.assertFalse(cm.exception.retry)
+
+    def test_retry_and_confirm(self):
+        with FakeEsplora() as fake, BroadcastQueue(Esplora(fake.url), self.wallet, backoff=0.01) as broadcasts:
+            fake.broadcast_errors = 2
+            builder = self.signed()
+            broadcast = broadcasts.submit_psbt(builder)
+            # The spent utxo is gone, the outputs paying us can be spent before confirmation
+            self.assertFalse(any(u.outpoint in self.wallet.pool for u in builder.utxos))
+            created = [u for u in self.wallet.utxos if u.outpoint[0] == broadcast.txid]
+            self.assertEqual(sum(u.value for u in created), sum(u.value for u in builder.utxos) - 500)
+            self.assertEqual({u.height for u in created}, {None})
+            self.assertEqual(self.wallet.balance(), {LBTC_HEX: 7000 - 500})
+            self.assertTrue(broadcast.done.wait(5))
+            self.assertEqual((broadcast.state, broadcast.attempts), (SENT, 3))
+
+            self.assertEqual(broadcasts.poll(), [])
+            fake.confirmed[broadcast.txid] = 10
+            self.assertEqual(broadcasts.poll(), [broadcast])
+            self.assertEqual((broadcast.state, broadcast.block_height), (CONFIRMED, 10))
+            self.assertEqual(len(self.wallet.utxos), 3)
+            self.assertEqual({u.height for u in created}, {10})
+            self.assertEqual(self.wallet.pool.pending, {})
+
+    def test_failed_releases_utxos(self):
+        with FakeEsplora() as fake, BroadcastQueue(Esplora(fake.url), self.wallet, retries=1, backoff=0.01) as broadcasts:
+            fake.broadcast_errors = 5
+            builder = self.signed()
+            broadcast = broadcasts.submit_psbt(builder)
+            self.assertTrue(broadcast.done.wait(5))
+            self.assertEqual((broadcast.state, broadcast.attempts), (FAILED, 2))
+            self.assertTrue(broadcast.error.retry)
+            self.assertEqual(broadcasts.poll(), [broadcast])
+            self.assertEqual(len(self.wallet.utxo_index), 2)
+
+    def test_unexpected_error(self):
+        class Backend(object):
+            def broadcast(self, tx_hex):
+                raise ValueError('unexpected')
+
+        with BroadcastQueue(Backend(), self.wallet) as broadcasts:
+            first = broadcasts.submit_psbt(self.signed())
+            self.assertTrue(first.done.wait(5))
+            self.assertEqual(first.state, FAILED)
+            self.assertIsInstance(first.error, ValueError)
+            # The worker is still running
+            second = broadcasts.submit_psbt(self.signed(500))
+            self.assertTrue(second.done.wait(5))
+            self.assertEqual(second.state, FAILED)
+
+    def test_stop_during_backoff(self):
+        with FakeEsplora() as fake:
+            fake.broadcast_errors = 5
+            broadcasts = BroadcastQueue(Esplora(fake.url), self.wallet, backoff=60).start()
+            broadcast = broadcasts.submit_psbt(self.signed())
+            while not fake.posts:
+                time.sleep(0.01)
+            broadcasts.stop()
+        self.assertTrue(broadcast.done.is_set())
+        self.assertEqual((broadcast.state, broadcast.attempts), (FAILED, 1))
+        self.assertTrue(broadcast.error.retry)
+
+    def test_dropped_releases_utxos(self):
+        with FakeEsplora() as fake, BroadcastQueue(Esplora(fake.url), self.wallet, drop_after=2) as broadcasts:
+            builder = self.signed()
+            broadcast = broadcasts.submit_psbt(builder)
+            self.assertTrue(broadcast.done.wait(5))
+            fake.mempool.clear()
+            self.assertEqual(broadcasts.poll(), [])
+            self.assertEqual(broadcasts.poll(), [broadcast])
+            self.assertEqual(broadcast.state, DROPPED)
+            self.assertEqual(len(self.wallet.utxo_index), 2)
+
+    def test_bounded(self):
+        broadcasts = BroadcastQueue(None, maxsize=1)
+        first, second = self.signed(), self.signed(2000)
+        for builder in (first, second):
+            builder.finalize()
+        broadcasts.submit(first.tx_hex())
+        # The same transaction is not queued twice
+        self.assertIs(broadcasts.submit(first.tx_hex()), broadcasts.pending()[0])
+        with self.assertRaises(queue.Full):
+            broadcasts.submit(second.tx_hex(), block=False)
+        self.assertEqual(len(broadcasts.pending()), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+import os
+import random
+import unittest
+
+from selw.coinselect import (BNB, KNAPSACK, LARGEST_FIRST, UtxoIndex, branch_and_bound, knapsack, select,
+                             select_coins)
+from selw.exceptions import InsufficientFunds
+
+ASSET_A = b'\xaa' * 32
+ASSET_B = b'\xbb' * 32
+
+
+class Utxo(object):
+
+    def __init__(self, value, asset=ASSET_A):
+        self.txid = os.urandom(32)
+        self.vout = 0
+        self.value = value
+        self.asset = asset
+
+
+class TestCoinSelection(unittest.TestCase):
+
+    def test_index(self):
+        utxos = [Utxo(v) for v in (5, 1, 3)] + [Utxo(7, ASSET_B)]
+        index = UtxoIndex(utxos)
+        self.assertEqual([u.value for u in index.sorted(ASSET_A)], [1, 3, 5])
+        index.remove(utxos[2])
+        index.remove(utxos[2])
+        index.add(utxos[0])
+        self.assertEqual([u.value for u in index.sorted(ASSET_A)], [1, 5])
+        self.assertEqual(index.values(ASSET_A), [1, 5])
+        self.assertIs(index.utxo_at(ASSET_A, 1), utxos[0])
+        self.assertEqual(len(index), 3)
+
+    def test_branch_and_bound(self):
+        values = [1, 2, 4, 8, 16, 32]
+        self.assertEqual(sorted(values[i] for i in branch_and_bound(values, 21)), [1, 4, 16])
+        self.assertIsNone(branch_and_bound([10, 20], 15))
+        self.assertEqual(branch_and_bound([10, 20], 15, cost_of_change=5), [1])
+        self.assertIsNone(branch_and_bound([1, 2], 4))
+
+    def test_knapsack(self):
+        self.assertEqual(knapsack([1, 5, 10], 5), [1])
+        self.assertEqual(knapsack([1, 2, 100], 3), [0, 1])
+        self.assertEqual(knapsack([1, 2, 100], 4), [2])
+        selected = knapsack([3, 3, 4, 6, 1000], 9, rng=random.Random(1))
+        self.assertEqual(sum([3, 3, 4, 6, 1000][i] for i in selected), 9)
+        self.assertIsNone(knapsack([1, 2], 4))
+
+    def test_many_small_values(self):
+        values = [2] * 5000
+        for strategy in (BNB, KNAPSACK):
+            selected = select(values, 2001, strategy)
+            self.assertGreaterEqual(sum(values[i] for i in selected), 2001)
+
+    def test_strategies(self):
+        values = [1, 2, 5, 10, 20, 50]
+        self.assertEqual(select(values, 12, LARGEST_FIRST), [5])
+        self.assertEqual(select(values, 12, BNB), [1, 3])
+        self.assertEqual(sum(values[i] for i in select(values, 12, KNAPSACK)), 12)
+        with self.assertRaises(InsufficientFunds):
+            select(values, 100)
+
+    def test_select_coins(self):
+        index = UtxoIndex([Utxo(v) for v in (10, 20, 30)] + [Utxo(v, ASSET_B) for v in (100, 500)])
+        selected = select_coins(index, {ASSET_A: 25, ASSET_B: 100})
+        self.assertEqual(sorted((u.asset, u.value) for u in selected), [(ASSET_A, 30), (ASSET_B, 100)])
@@ -0,0 +1,73 @@
+import time
+import unittest
+from unittest import mock
+
+from selw.broadcast import BroadcastQueue
+from selw.constants import LBTC_HEX
+from selw.consolidate import Consolidator
+from selw.fakechain import FakeChain
+from selw.wallet import WalletP2wpkh
+
+ASSET_HEX = '11' * 32
+
+
+class TestConsolidator(unittest.TestCase):
+
+    def setUp(self):
+        self.chain = FakeChain()
+        self.wallet = w = WalletP2wpkh(b'\x02' * 32, b'\x01' * 32)
+        bpub = w.public_blinding_key()
+        self.chain.fund(w.scriptpubkey, [1000 + i % 3 for i in range(60)] + [10**6], blinding_pubkey=bpub, reuse_proofs=True)
+        self.chain.fund(w.scriptpubkey, [50] * 40, asset_hex=ASSET_HEX, blinding_pubkey=bpub, reuse_proofs=True)
+        w.sync(self.chain)
+
+    def consolidator(self, **kwargs):
+        return Consolidator(self.wallet, self.chain, min_utxos=20, target_utxos=5, max_inputs=25, **kwargs)
+
+    def test_run_once(self):
+        w = self.wallet
+        before = w.balance()
+        report = self.consolidator().run_once()
+        self.assertEqual(report['utxos_before'], {LBTC_HEX: 61, ASSET_HEX: 40})
+        # 56 policy asset utxos in 3 sweeps, 35 of the asset in 2, the largest ones are kept
+        self.assertEqual([len(s.utxos) for s in report['sweeps']], [25, 25, 6, 25, 10])
+        self.assertTrue(all(s.txid and s.error is None for s in report['sweeps']))
+        self.assertNotIn(10**6, [u.value for s in report['sweeps'] for u in s.utxos])
+        self.assertLess(report['utxos_after'][LBTC_HEX], 10)
+        self.assertEqual(report['utxos_after'][ASSET_HEX], 7)
+        self.assertEqual(w.balance(), {LBTC_HEX: before[LBTC_HEX] - report['fee'], ASSET_HEX: before[ASSET_HEX]})
+
+        # Outputs are spendable before confirmation, the server agrees once mined
+        self.chain.mine()
+        w.sync(self.chain)
+        self.assertEqual(len(w.utxos), sum(report['utxos_after'].values()))
+        self.assertEqual(self.consolidator().run_once()['sweeps'], [])
+
+    def test_feerate_threshold(self):
+        self.chain.fee_estimates = {'2': 1.0}
+        report = self.consolidator().run_once()
+        self.assertEqual((report['feerate'], report['sweeps']), (1.0, []))
+        self.assertEqual(report['utxos_after'], report['utxos_before'])
+
+    def test_max_value(self):
+        report = self.consolidator(max_value={LBTC_HEX: 1001}).run_once()
+        # Only the utxos of 1000
+        self.assertEqual([len(s.utxos) for s in report['sweeps'] if s.asset_hex == LBTC_HEX], [20])
+
+    def test_signing_failure_releases_utxos(self):
+        with mock.patch.object(self.wallet, 'sign_psbt', side_effect=RuntimeError('no key')):
+            report = self.consolidator().run_once()
+        self.assertEqual(len(report['sweeps']), 5)
+        self.assertTrue(all(isinstance(s.error, RuntimeError) and s.txid is None for s in report['sweeps']))
+        self.assertEqual(report['utxos_after'], report['utxos_before'])
+        self.assertEqual(self.wallet.pool.leases, {})
+
+    def test_background(self):
+        with BroadcastQueue(self.chain, self.wallet) as queue:
+            with self.consolidator(queue=queue, interval=0.01) as consolidator:
+                while consolidator.report is None:
+                    time.sleep(0.01)
+            for sweep in consolidator.report['sweeps']:
+                sweep.broadcast.done.wait(5)
+            self.assertEqual(len(queue.pending()), 5)
+        self.assertIsNone(consolidator.error)
@@ -0,0 +1,136 @@
+import base64
+import os
+import requests
+import tempfile
+import time
+import unittest
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+from selw.backend import ElementsRpc
+from selw.constants import LBTC_HEX
+from selw.daemon import RPC_INVALID_PARAMS, RPC_METHOD_NOT_FOUND, RPC_WALLET_INSUFFICIENT_FUNDS, RPC_WALLET_NOT_FOUND, Daemon
+from selw.exceptions import RpcError
+from selw.fakechain import FakeChain
+from selw.pset import PsetBuilder
+from selw.wallet import WalletP2wpkh, WalletP2wsh2of3
+
+
+class TestDaemon(unittest.TestCase):
+
+    def setUp(self):
+        self.chain = FakeChain()
+        self.hot = WalletP2wpkh(b'\x02' * 32, b'\x01' * 32)
+        self.multi = WalletP2wsh2of3([b'\x02' * 32, b'\x03' * 32, b'\x04' * 32], b'\x01' * 32)
+        self.recipient = WalletP2wpkh(b'\x03' * 32, b'\x04' * 32)
+        for w in (self.hot, self.multi):
+            self.chain.fund(w.scriptpubkey, [5000] * 20, blinding_pubkey=w.public_blinding_key(), reuse_proofs=True)
+        self.daemon = Daemon({'hot': self.hot, 'multi': self.multi}, self.chain, port=0, refresh=0.05).start()
+        self.rpc = ElementsRpc(self.daemon.url + '/wallet/hot', *self.daemon.auth)
+
+    def tearDown(self):
+        self.daemon.stop()
+
+    def recipients(self, value=1000):
+        return [{'address': self.recipient.address(), 'value': value}]
+
+    def test_balance_and_unspent(self):
+        self.assertEqual(self.rpc.call('getbalance'), {LBTC_HEX: 100000})
+        self.assertEqual(self.rpc.call('getbalance', 'confirmed'), {LBTC_HEX: 100000})
+        unspent = self.rpc.call('listunspent')
+        self.assertEqual(len(unspent), 20)
+        self.assertEqual({(u['asset'], u['value'], u['reserved']) for u in unspent}, {(LBTC_HEX, 5000, False)})
+
+    def test_pset_stages(self):
+        rpc = ElementsRpc(self.daemon.url + '/wallet/multi', *self.daemon.auth)
+        pset = rpc.call('createpset', self.recipients(), 0.1)
+        self.assertEqual(sum(u['reserved'] for u in rpc.call('listunspent')), 1)
+        pset = rpc.call('blindpset', pset)
+        pset = rpc.call('signpset', pset)
+        builder = PsetBuilder.from_base64(pset)
+        builder.finalize()
+        txid = self.chain.broadcast(builder.tx_hex())
+        self.assertFalse(self.chain.get_tx_status(txid)['confirmed'])
+
+    def test_send(self):
+        with ThreadPoolExecutor(4) as executor:
+            txids = list(executor.map(lambda _: self.rpc.call('send', self.recipients()), range(8)))
+        self.assertEqual(len(set(txids)), 8)
+        for txid in txids:
+            self.assertEqual(self.chain.get_tx_status(txid), {'confirmed': False, 'block_height': None})
+        self.assertLessEqual(self.rpc.call('getbalance')[LBTC_HEX], 100000 - 8 * 1000)
+        # Change is spent at once, before confirmation
+        pending = self.hot.pool.pending
+        self.assertTrue(any(txid in txids for t in txids for txid, _ in pending[t][0]))
+
+        # The background refresh confirms them
+        self.chain.mine()
+        deadline = time.monotonic() + 5
+        while self.daemon.wallets['hot'].queue.pending() and time.monotonic() < deadline:
+            time.sleep(0.05)
+        self.assertEqual(self.daemon.wallets['hot'].queue.pending(), [])
+
+    def test_refresh(self):
+        self.chain.fund(self.hot.scriptpubkey, [7000], blinding_pubkey=self.hot.public_blinding_key())
+        deadline = time.monotonic() + 5
+        while self.rpc.call('getbalance')[LBTC_HEX] != 107000 and time.monotonic() < deadline:
+            time.sleep(0.05)
+        self.assertEqual(self.rpc.call('getbalance'), {LBTC_HEX: 107000})
+
+    def post(self, headers):
+        request = urllib.request.Request(self.daemon.url + '/wallet/hot', b'{"method": "getbalance", "params": []}',
+                                         headers)
+        try:
+            with urllib.request.urlopen(request) as r:
+                return r.status
+        except urllib.error.HTTPError as e:
+            return e.code
+
+    def test_auth(self):
+        credentials = 'Basic ' + base64.b64encode('{}:{}'.format(*self.daemon.auth).encode()).decode()
+        headers = {'Authorization': credentials, 'Content-Type': 'application/json'}
+        self.assertEqual(self.post(headers), 200)
+        self.assertEqual(self.post(dict(headers, Authorization='Basic ' + base64.b64encode(b'__cookie__:x').decode())), 401)
+        self.assertEqual(self.post({'Content-Type': 'application/json'}), 401)
+        self.assertEqual(self.post(dict(headers, Host='attacker.example:18890')), 403)
+        self.assertEqual(self.post(dict(headers, **{'Content-Type': 'text/plain'})), 415)
+        with self.assertRaises(requests.HTTPError):
+            ElementsRpc(self.daemon.url + '/wallet/hot').call('getbalance')
+
+        # Given credentials, or a cookie file removed on stop
+        with Daemon({'hot': self.hot}, self.chain, port=0, refresh=3600, rpcuser='u', rpcpassword='p') as daemon:
+            self.assertEqual(ElementsRpc(daemon.url + '/wallet/hot', 'u', 'p').call('getbalance'), {LBTC_HEX: 100000})
+        with tempfile.TemporaryDirectory() as tmp:
+            cookie_file = os.path.join(tmp, '.cookie')
+            with Daemon({'hot': self.hot}, self.chain, port=0, refresh=3600, cookie_file=cookie_file) as daemon:
+                with open(cookie_file) as f:
+                    user, password = f.read().split(':')
+                self.assertEqual(os.stat(cookie_file).st_mode & 0o777, 0o600)
+                self.assertEqual(ElementsRpc(daemon.url + '/wallet/hot', user, password).call('getbalance'), {LBTC_HEX: 100000})
+            self.assertFalse(os.path.exists(cookie_file))
+
+        # Not on a public interface without credentials
+        with self.assertRaises(ValueError):
+            Daemon({'hot': self.hot}, self.chain, host='0.0.0.0', port=0)
+
+    def test_errors(self):
+        with self.assertRaises(RpcError) as cm:
+            self.rpc.call('send', self.recipients(10**9))
+        self.assertEqual(cm.exception.code, RPC_WALLET_INSUFFICIENT_FUNDS)
+        for recipient in ({'address': self.recipient.address()}, dict(self.recipients(0)[0]), dict(self.recipients(-1000)[0]),
+                          dict(self.recipients('1000')[0]), dict(self.recipients(1000)[0], asset='11' * 31)):
+            with self.assertRaises(RpcError) as cm:
+                self.rpc.call('send', [recipient])
+            self.assertEqual(cm.exception.code, RPC_INVALID_PARAMS)
+        self.assertEqual(self.hot.pool.leases, {})
+        with self.assertRaises(RpcError) as cm:
+            self.rpc.call('dumpprivkey')
+        self.assertEqual(cm.exception.code, RPC_METHOD_NOT_FOUND)
+        with self.assertRaises(RpcError) as cm:
+            ElementsRpc(self.daemon.url, *self.daemon.auth).call('getbalance')
+        self.assertEqual(cm.exception.code, RPC_WALLET_NOT_FOUND)
+        # Batches
+        results = self.rpc.batch([('getbalance', []), ('getbalance', ['spendable'])])
+        self.assertEqual(results[0], {LBTC_HEX: 100000})
+        self.assertIsInstance(results[1], RpcError)
@@ -0,0 +1,62 @@
+import unittest
+
+from selw.constants import LBTC_HEX
+from selw.esplora import Esplora
+from selw.fakechain import blinded_tx
+from selw.utils import h2b_rev
+from selw.wallet import WalletP2wpkh
+from selw.tests.util import FakeEsplora
+
+
+class TestEsplora(unittest.TestCase):
+
+    def setUp(self):
+        self.wallet = WalletP2wpkh(b'\x02' * 32, b'\x01' * 32)
+        self.asset = h2b_rev(LBTC_HEX)
+
+    def fund(self, fake, n_txs, outputs_per_tx=1):
+        output = (self.wallet.scriptpubkey, self.wallet.public_blinding_key(), self.asset, 1000)
+        for _ in range(n_txs):
+            tx = blinded_tx([output] * outputs_per_tx)
+            fake.add_tx(tx, self.wallet.unconf_address(), range(outputs_per_tx))
+
+    def test_sync_dedupes_parent_txs(self):
+        with FakeEsplora() as fake:
+            self.fund(fake, 2, outputs_per_tx=3)
+            self.wallet.sync(fake.url)
+        self.assertEqual(len(self.wallet.utxos), 6)
+        self.assertEqual(self.wallet.balance(), {LBTC_HEX: 6000})
+        tx_hits = [n for path, n in fake.hits.items() if path.endswith('/hex')]
+        self.assertEqual(tx_hits, [1, 1])
+
+    def test_history_pages(self):
+        with FakeEsplora() as fake:
+            self.fund(fake, 30)
+            records = list(self.wallet.history(fake.url))
+        self.assertEqual(len(records), 30)
+        self.assertEqual({tuple(r.net().items()) for r in records}, {((LBTC_HEX, 1000),)})
+        self.assertEqual(len([path for path in fake.hits if '/txs/chain' in path]), 2)
+
+    def test_sync_concurrent(self):
+        # The latency keeps requests in flight long enough to overlap
+        with FakeEsplora(latency=0.05) as fake:
+            self.fund(fake, 16)
+            self.wallet.sync(fake.url, max_workers=1)
+            self.assertEqual(fake.max_in_flight, 1)
+
+            self.wallet.pool.clear()
+            fake.max_in_flight = 0
+            self.wallet.sync(fake.url, max_workers=8)
+        self.assertEqual(len(self.wallet.utxos), 16)
+        self.assertGreater(fake.max_in_flight, 1)
+        self.assertLessEqual(fake.max_in_flight, 8)
+
+    def test_max_workers_not_capped(self):
+        with FakeEsplora(latency=0.05) as fake:
+            self.fund(fake, 16)
+            client = Esplora(fake.url, max_workers=2)
+            self.wallet.sync(client, max_workers=12)
+        self.assertEqual(len(self.wallet.utxos), 16)
+        # More workers than the client default, with connections for all of them
+        self.assertGreater(fake.max_in_flight, 2)
+        self.assertEqual(client.pool_size, 12)
@@ -0,0 +1,114 @@
+import unittest
+import wallycore as wally
+
+from selw.constants import LBTC_HEX
+from selw.fee import FeeEstimator, estimate_vsize
+from selw.wallet import WalletP2wpkh, WalletP2wsh2of3
+from selw.tests.test_pset import fund
+from selw.tests.util import FakeEsplora
+
+
+def fee_output_value(builder):
+    tx = builder.extract()
+    for i in range(wally.tx_get_num_outputs(tx)):
+        if not wally.tx_get_output_script(tx, i):
+            return wally.tx_confidential_value_to_satoshi(wally.tx_get_output_value(tx, i))
+
+
+def signed_tx(wallet, utxos, address, value, feerate=None):
+    builder = wallet.build_psbt(utxos, address, LBTC_HEX, value, feerate)
+    wallet.blind_psbt(builder, builder.utxos)
+    wallet.sign_psbt(builder, builder.utxos)
+    builder.finalize()
+    return builder
+
+
+class FakeClient(object):
+    def __init__(self, estimates):
+        self.estimates = estimates
+        self.calls = 0
+
+    def get_fee_estimates(self):
+        self.calls += 1
+        return self.estimates
+
+
+class TestEstimateVsize(unittest.TestCase):
+
+    def setUp(self):
+        self.recipient = WalletP2wpkh(b'\x03' * 32, b'\x04' * 32)
+
+    def check(self, wallet, n_inputs):
+        fund(wallet, [10000] * n_inputs)
+        builder = signed_tx(wallet, wallet.utxos, self.recipient.address(), 1000)
+        tx = builder.extract()
+        outputs = [(wally.tx_get_output_script(tx, i), bool(wally.tx_get_output_script(tx, i)))
+                   for i in range(wally.tx_get_num_outputs(tx))]
+        estimate = estimate_vsize([u.output for u in wallet.utxos], outputs)
+        # Signatures may be a byte shorter than estimated
+        self.assertLessEqual(estimate - wally.tx_get_vsize(tx), n_inputs)
+        self.assertGreaterEqual(estimate, wally.tx_get_vsize(tx))
+
+    def test_p2wpkh(self):
+        for n_inputs in (1, 3, 5):
+            self.check(WalletP2wpkh(b'\x02' * 32, b'\x01' * 32), n_inputs)
+
+    def test_p2wsh_2of3(self):
+        keys = [b'\x05' * 32, b'\x06' * 32, wally.ec_public_key_from_private_key(b'\x07' * 32)]
+        for n_inputs in (2, 12):
+            self.check(WalletP2wsh2of3(keys, b'\x01' * 32), n_inputs)
+
+
+class TestFeerate(unittest.TestCase):
+
+    def setUp(self):
+        self.wallet = WalletP2wpkh(b'\x02' * 32, b'\x01' * 32)
+        self.recipient = WalletP2wpkh(b'\x03' * 32, b'\x04' * 32)
+
+    def test_fee_pays_vsize(self):
+        fund(self.wallet, [20000])
+        builder = signed_tx(self.wallet, None, self.recipient.address(), 1000, feerate=1)
+        vsize = wally.tx_get_vsize(builder.extract())
+        self.assertGreaterEqual(fee_output_value(builder), vsize)
+        self.assertLessEqual(fee_output_value(builder), vsize + 2)
+
+    def test_selection_covers_fee(self):
+        fund(self.wallet, [1000, 1000, 5000])
+        builder = signed_tx(self.wallet, None, self.recipient.address(), 2000, feerate=1)
+        # The exact match 1000 + 1000 cannot pay the fee
+        self.assertEqual([u.value for u in builder.utxos], [5000])
+        self.assertGreaterEqual(fee_output_value(builder), wally.tx_get_vsize(builder.extract()))
+
+    def test_changeless_selection(self):
+        fund(self.wallet, [5000, 30000])
+        builder = signed_tx(self.wallet, None, self.recipient.address(), 3000, feerate=1)
+        # Paying less than a change output costs, the excess goes to the fee
+        self.assertEqual([u.value for u in builder.utxos], [5000])
+        self.assertEqual(wally.tx_get_num_outputs(builder.extract()), 2)
+        self.assertEqual(fee_output_value(builder), 2000)
+
+    def test_estimator_ttl(self):
+        now = [0]
+        client = FakeClient({'1': 3.0, '2': 2.0, '6': 1.0, '144': 0.01})
+        estimator = FeeEstimator(client, ttl=60, clock=lambda: now[0])
+        self.assertEqual(estimator.feerate(1), 3.0)
+        self.assertEqual(estimator.feerate(5), 2.0)
+        self.assertEqual(estimator.feerate(1008), 0.1)
+        self.assertEqual(client.calls, 1)
+        now[0] = 60
+        estimator.feerate()
+        self.assertEqual(client.calls, 2)
+
+    def test_no_estimates(self):
+        self.assertEqual(FeeEstimator(FakeClient({})).feerate(), 0.1)
+
+    def test_wallet_feerate(self):
+        with FakeEsplora() as server:
+            server.fee_estimates = {'2': 0.5}
+            self.assertEqual(self.wallet.feerate(server.url), 0.5)
+            self.assertEqual(self.wallet.feerate(server.url), 0.5)
+            self.assertEqual(server.hits['/api/fee-estimates'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,72 @@
+import unittest
+import wallycore as wally
+
+from selw.constants import LBTC_HEX
+from selw.fakechain import blinded_tx
+from selw.hdwallet import CHANGE, RECEIVE, HDWallet, HDWalletP2wpkh, HDWalletP2wsh2of3
+from selw.key import Bip32Key, parse_origin
+from selw.utils import h2b_rev
+from selw.tests.util import FakeEsplora
+
+HARDENED = 0x80000000
+
+
+def account(seed, n=0):
+    master = Bip32Key.from_seed(seed, is_testnet=True)
+    return master.derive_prv([84 | HARDENED, 1 | HARDENED, n | HARDENED])
+
+
+class TestHDWallet(unittest.TestCase):
+
+    def fund(self, fake, wallet, chain, index, value=1000):
+        output = wallet.output_at(chain, index)
+        tx = blinded_tx([(output.scriptpubkey, wallet.public_blinding_key(), h2b_rev(LBTC_HEX), value)])
+        fake.add_tx(tx, output.unconf_address, [0])
+
+    def test_gap_limit_scan(self):
+        wallet = HDWalletP2wpkh(account(b'\x01' * 32), b'\x01' * 32, gap_limit=5)
+        with FakeEsplora() as fake:
+            self.fund(fake, wallet, RECEIVE, 0)
+            self.fund(fake, wallet, RECEIVE, 4)
+            self.fund(fake, wallet, RECEIVE, 11)  # beyond the gap
+            self.fund(fake, wallet, CHANGE, 2)
+            wallet.sync(fake.url)
+        self.assertEqual(wallet.last_used, {RECEIVE: 4, CHANGE: 2})
+        self.assertEqual(wallet.balance(), {LBTC_HEX: 3000})
+        self.assertEqual(wallet.unconf_address(), wallet.output_at(RECEIVE, 5).unconf_address)
+        self.assertEqual(wallet.address(), wallet.output_at(RECEIVE, 5).conf_address)
+        self.assertEqual(wallet.network.parse_address(wallet.address()),
+                         (wallet.output_at(RECEIVE, 5).scriptpubkey, wallet.public_blinding_key()))
+        for utxo in wallet.utxos:
+            self.assertIs(wallet.outputs[bytes(utxo.scriptpubkey)], utxo.output)
+
+    def test_abstract(self):
+        with self.assertRaises(NotImplementedError):
+            HDWallet([account(b'\x01' * 32)], b'\x01' * 32)
+
+    def test_p2wpkh_sign(self):
+        master = Bip32Key.from_seed(b'\x01' * 32, is_testnet=True)
+        origin = parse_origin('{}/84h/1h/0h'.format(bytes(master.fingerprint).hex()))
+        self.assertEqual(origin, (bytes(master.fingerprint), (84 | HARDENED, 1 | HARDENED, HARDENED)))
+        wallet = HDWalletP2wpkh(account(b'\x01' * 32), b'\x01' * 32, origin=origin)
+        with FakeEsplora() as fake:
+            self.fund(fake, wallet, RECEIVE, 0, 5000)
+            self.fund(fake, wallet, RECEIVE, 1, 5000)
+            wallet.sync(fake.url)
+        psbt = wallet.create_psbt(wallet.utxos, wallet.address(), LBTC_HEX, 1000)
+        psbt = wallet.blind_psbt(psbt, wallet.utxos)
+        psbt = wally.psbt_from_base64(wallet.sign_psbt(psbt, wallet.utxos), 0)
+        keypaths = {bytes(wally.psbt_get_input_keypath(psbt, i, 0)) for i in range(2)}
+        # The master fingerprint and the full path from the master
+        self.assertEqual(keypaths, {bytes(master.fingerprint) + b''.join(
+            step.to_bytes(4, 'little') for step in (84 | HARDENED, 1 | HARDENED, HARDENED, RECEIVE, i)) for i in range(2)})
+        wally.psbt_finalize(psbt, 0)
+        self.assertTrue(wally.psbt_is_finalized(psbt))
+
+    def test_p2wsh2of3_watch_only_cosigner(self):
+        accounts = [account(b'\x01' * 32), account(b'\x02' * 32), account(b'\x03' * 32)]
+        public = Bip32Key(wally.bip32_key_from_base58(accounts[2].xpub))
+        wallet = HDWalletP2wsh2of3(accounts[:2] + [public], b'\x01' * 32)
+        full = HDWalletP2wsh2of3(accounts, b'\x01' * 32)
+        self.assertEqual(wallet.output_at(CHANGE, 3).scriptpubkey, full.output_at(CHANGE, 3).scriptpubkey)
+        self.assertIsNone(wallet.output_at(CHANGE, 3).keys[2].prv)
@@ -0,0 +1,93 @@
+import json
+import unittest
+
+from selw.backend import TXS_PAGE_SIZE
+from selw.constants import LBTC_HEX
+from selw.fakechain import FakeChain
+from selw.hdwallet import CHANGE, RECEIVE, HDWalletP2wpkh
+from selw.history import HistoryCursor
+from selw.wallet import WalletP2wpkh
+from selw.tests.test_hdwallet import account
+
+ASSET_HEX = '11' * 32
+
+
+class TestHistory(unittest.TestCase):
+
+    def setUp(self):
+        self.chain = FakeChain()
+        self.wallet = w = WalletP2wpkh(b'\x02' * 32, b'\x01' * 32)
+        bpub = w.public_blinding_key()
+        # One output per transaction, to span several pages
+        self.chain.fund(w.scriptpubkey, [1000] * 40, blinding_pubkey=bpub, outputs_per_tx=1, reuse_proofs=True)
+        self.chain.fund(w.scriptpubkey, [50] * 2, asset_hex=ASSET_HEX, blinding_pubkey=bpub, outputs_per_tx=1,
+                        reuse_proofs=True)
+        # Paying others is not in the history
+        self.chain.fund(WalletP2wpkh(b'\x03' * 32, b'\x04' * 32).scriptpubkey, [1000], blinding_pubkey=bpub)
+        self.address = WalletP2wpkh(b'\x03' * 32, b'\x04' * 32).address()
+
+    def pay(self, value):
+        w = self.wallet
+        w.sync(self.chain)
+        builder = w.build_psbt(None, self.address, LBTC_HEX, value, feerate=0.1)
+        w.blind_psbt(builder, builder.utxos)
+        w.sign_psbt(builder)
+        txid = w.send_psbt(builder, self.chain)
+        self.chain.mine()
+        return txid, builder
+
+    def test_history(self):
+        txid, builder = self.pay(2500)
+        records = list(self.wallet.history(self.chain))
+        self.assertEqual(len(records), 43)
+        self.assertEqual(self.chain.calls['get_address_txs_chain'], 2)
+        # Newest first
+        self.assertEqual(records[0].txid, txid)
+        self.assertEqual([r.height for r in records], sorted((r.height for r in records), reverse=True))
+        payment = records[0]
+        self.assertEqual(len(payment.inputs), len(builder.utxos))
+        self.assertEqual(payment.net(), {LBTC_HEX: -2500 - payment.fee})
+        self.assertEqual(records[-1].net(), {LBTC_HEX: 1000})
+        self.assertEqual(records[-1].inputs, [])
+
+        # The records add up to the balance
+        total = {}
+        for record in records:
+            for asset_hex, value in record.net().items():
+                total[asset_hex] = total.get(asset_hex, 0) + value
+        self.wallet.sync(self.chain)
+        self.assertEqual(total, self.wallet.balance())
+
+    def test_cursor(self):
+        cursor = HistoryCursor()
+        walk = self.wallet.history(self.chain, cursor)
+        first = [next(walk) for _ in range(30)]
+        walk.close()
+
+        # Resumed after the last record yielded, from a saved cursor
+        cursor = HistoryCursor(json.loads(json.dumps(cursor.state)))
+        rest = list(self.wallet.history(self.chain, cursor))
+        self.assertEqual(len(rest), 42 - 30)
+        self.assertEqual(len({r.txid for r in first + rest}), 42)
+
+        # Then only the transactions confirmed since
+        self.assertEqual(list(self.wallet.history(self.chain, cursor)), [])
+        txid, _ = self.pay(1000)
+        self.assertEqual([r.txid for r in self.wallet.history(self.chain, cursor)], [txid])
+
+    def test_unconfirmed(self):
+        self.chain.fund(self.wallet.scriptpubkey, [1000], blinding_pubkey=self.wallet.public_blinding_key(), confirmed=False)
+        self.assertEqual(len(list(self.wallet.history(self.chain))), 42)
+
+    def test_hd(self):
+        wallet = HDWalletP2wpkh(account(b'\x01' * 32), b'\x01' * 32, gap_limit=5)
+        bpub = wallet.public_blinding_key()
+        for chain, index in ((RECEIVE, 0), (RECEIVE, 3), (CHANGE, 1)):
+            self.chain.fund(wallet.output_at(chain, index).scriptpubkey, [1000] * 2, blinding_pubkey=bpub, outputs_per_tx=1)
+        records = list(wallet.history(self.chain))
+        self.assertEqual(len(records), 6)
+        self.assertEqual({r.address for r in records}, {wallet.output_at(c, i).unconf_address for c, i in
+                                                        ((RECEIVE, 0), (RECEIVE, 3), (CHANGE, 1))})
+
+    def test_page_size(self):
+        self.assertEqual(len(self.chain.get_address_txs_chain(self.wallet.unconf_address())), TXS_PAGE_SIZE)
@@ -0,0 +1,137 @@
+import unittest
+import wallycore as wally
+
+from selw.exceptions import InvalidPrivateKey
+from selw.key import (MIN_PARALLEL_VERIFY, Bip32Key, DerivationCache, ECKey, KeyStore, PubKey, derivation_cache, is_set,
+                      key_fingerprint, verify_many)
+
+HARDENED = 0x80000000
+
+
+class TestBip32Key(unittest.TestCase):
+
+    def setUp(self):
+        self.master = Bip32Key.from_seed(b'\x01' * 32, is_testnet=True)
+        self.prefix = [84 | HARDENED, 1 | HARDENED, 0 | HARDENED, 0]
+
+    def test_cached_derivation(self):
+        derivation_cache.clear()
+        key = self.master.derive_prv(self.prefix + [5])
+        self.assertIs(self.master.derive_prv(self.prefix[:2]), self.master.derive_prv(self.prefix[:2]))
+        self.assertEqual(key.xprv, Bip32Key(wally.bip32_key_from_parent_path(
+            self.master.extkey, self.prefix + [5], wally.BIP32_FLAG_KEY_PRIVATE | wally.BIP32_FLAG_SKIP_HASH)).xprv)
+
+    def test_derive_range(self):
+        expected = [self.master.derive_pub(self.prefix + [i]).pub for i in range(10, 15)]
+        keys = self.master.derive_range(self.prefix, 10, 5)
+        self.assertEqual([k.pub for k in keys], expected)
+        self.assertTrue(all(k.has_prv for k in keys))
+        self.assertEqual(self.master.derive_range(self.prefix, 10, 5, 'pub'), expected)
+        spks = self.master.derive_range(self.prefix, 10, 5, 'scriptpubkey')
+        self.assertEqual(spks, [wally.witness_program_from_bytes(pub, wally.WALLY_SCRIPT_HASH160) for pub in expected])
+
+    def test_derive_range_public(self):
+        account = self.master.derive_prv(self.prefix[:3])
+        public = Bip32Key(wally.bip32_key_from_base58(account.xpub))
+        self.assertFalse(public.has_prv)
+        self.assertEqual(public.derive_range([0], 0, 3, 'pub'), account.derive_range([0], 0, 3, 'pub'))
+
+    def test_public_derivation(self):
+        account = self.master.derive_prv(self.prefix[:3])
+        public = Bip32Key(wally.bip32_key_from_base58(account.xpub))
+        # The private derivations of account are not reused for its public key
+        self.assertTrue(account.derive_prv([0, 1]).has_prv)
+        child = public.derive_pub([0, 1])
+        self.assertFalse(child.has_prv)
+        self.assertEqual(child.pub, account.derive_prv([0, 1]).pub)
+        with self.assertRaises(InvalidPrivateKey):
+            public.derive_prv([0, 1])
+
+    def test_prvkey_cached(self):
+        key = self.master.derive_prv(self.prefix + [1])
+        self.assertIs(key.prvkey, key.prvkey)
+        h = wally.sha256(b'')
+        self.assertTrue(key.pubkey.verify(h, key.sign(h)))
+
+    def test_lru(self):
+        cache = DerivationCache(maxsize=2)
+        cache.put('a', 1)
+        cache.put('b', 2)
+        cache.get('a')
+        cache.put('c', 3)
+        self.assertEqual(list(cache.keys), ['a', 'c'])
+
+
+class TestVerifyMany(unittest.TestCase):
+
+    def setUp(self):
+        self.keys = [ECKey() for _ in range(3)]
+        for i, key in enumerate(self.keys):
+            key.prv = bytes([i + 1]) * 32
+
+    def items(self, n):
+        items = []
+        for i in range(n):
+            key, h = self.keys[i % 3], wally.sha256(i.to_bytes(4, 'little'))
+            items.append((key.pub, h, key.sign(h)))
+        return items
+
+    def test_bitmap(self):
+        items = self.items(10)
+        h = items[1][1]
+        items[1] = (items[1][0], h, self.keys[2].sign(h))  # wrong key
+        items[4] = (items[4][0], items[4][1], b'\x30\x00')  # invalid DER
+        items[8] = (b'\x02' + b'\xff' * 32, items[8][1], items[8][2])  # invalid pubkey
+        bitmap = verify_many(items)
+        self.assertEqual(len(bitmap), 2)
+        self.assertEqual([i for i in range(10) if not is_set(bitmap, i)], [1, 4, 8])
+
+    def test_parallel(self):
+        items = self.items(MIN_PARALLEL_VERIFY + 10)
+        items[-1] = (items[-1][0], items[0][1], items[-1][2])
+        bitmap = verify_many(items, workers=2)
+        self.assertEqual([i for i in range(len(items)) if not is_set(bitmap, i)], [len(items) - 1])
+
+    def test_key_verify_many(self):
+        key = self.keys[0]
+        hashes = [wally.sha256(bytes([i])) for i in range(3)]
+        pairs = [(h, key.sign(h)) for h in hashes] + [(hashes[0], key.sign(hashes[1]))]
+        bitmap = PubKey(key.pub).verify_many(pairs)
+        self.assertEqual([is_set(bitmap, i) for i in range(4)], [True, True, True, False])
+
+
+class TestKeyStore(unittest.TestCase):
+
+    def setUp(self):
+        self.keys = [ECKey() for _ in range(3)]
+        for i, key in enumerate(self.keys):
+            key.prv = bytes([i + 1]) * 32
+        self.psbt = wally.psbt_init(2, 0, 0, 0, wally.WALLY_PSBT_INIT_PSET)
+        for i in range(2):
+            wally.psbt_add_tx_input_at(self.psbt, i, 0, wally.tx_input_init(bytes([i]) * 32, 0, 0xffffffff, None, None))
+
+    def test_origins(self):
+        keystore = KeyStore()
+        keystore.add(self.keys[0])
+        keystore.add(self.keys[1], b'\x01\x02\x03\x04', (1, 7))
+        self.assertEqual(keystore.origin(self.keys[0].pub), (key_fingerprint(self.keys[0].pub), ()))
+        keystore.set_keypaths(self.psbt, 0, [self.keys[0].pub, self.keys[1].pub])
+        keypaths = {bytes(wally.psbt_get_input_keypath(self.psbt, 0, i)) for i in range(2)}
+        self.assertEqual(keypaths, {key_fingerprint(self.keys[0].pub), b'\x01\x02\x03\x04' + b'\x01\0\0\0\x07\0\0\0'})
+
+    def test_signers(self):
+        keystore = KeyStore()
+        for key in self.keys[:2]:
+            keystore.add(key)
+        keystore.set_keypaths(self.psbt, 0, [self.keys[0].pub, self.keys[1].pub])
+        keystore.set_keypaths(self.psbt, 1, [self.keys[1].pub])
+        self.assertEqual(sorted(keystore.signers(self.psbt, 0)), sorted((k.pub, k.prv) for k in self.keys[:2]))
+
+        # Same origin, another key
+        other = KeyStore()
+        other.add(self.keys[2], key_fingerprint(self.keys[1].pub))
+        self.assertEqual(other.signers(self.psbt, 1), [])
+
+        # Keys without origin are matched by public key
+        loose = KeyStore.from_private_keys([self.keys[1].prv, self.keys[2].prv])
+        self.assertEqual(loose.signers(self.psbt, 1), [(bytes(self.keys[1].pub), self.keys[1].prv)])
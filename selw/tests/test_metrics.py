@@ -0,0 +1,123 @@
+import base64
+import unittest
+import urllib.request
+import wallycore as wally
+
+from selw import metrics, utxo
+from selw.backend import ElementsRpc
+from selw.constants import LBTC_HEX
+from selw.daemon import Daemon
+from selw.fakechain import FakeChain, blinded_tx
+from selw.utils import h2b_rev
+from selw.wallet import WalletP2wpkh
+from selw.tests.util import FakeEsplora
+
+
+class TestMetrics(unittest.TestCase):
+
+    def setUp(self):
+        self.chain = FakeChain()
+        self.wallet = w = WalletP2wpkh(b'\x02' * 32, b'\x01' * 32)
+        self.chain.fund(w.scriptpubkey, [1000] * 5, blinding_pubkey=w.public_blinding_key(), reuse_proofs=True)
+        self.address = WalletP2wpkh(b'\x03' * 32, b'\x04' * 32).address()
+
+    def tearDown(self):
+        metrics.disable()
+
+    def pay(self):
+        w = self.wallet
+        builder = w.build_psbt(None, self.address, LBTC_HEX, 1500, feerate=0.1)
+        w.blind_psbt(builder, builder.utxos)
+        w.sign_psbt(builder)
+        return w.send_psbt(builder, self.chain)
+
+    def test_disabled(self):
+        asset_unblind = wally.asset_unblind
+        self.assertIs(metrics.span('sync'), metrics.span('unblind'))
+        self.wallet.sync(self.chain)
+        self.pay()
+        self.assertIsNone(metrics.sink())
+        # Only the selw modules see counted calls, libwally is left alone
+        metrics.enable(wally_calls=True)
+        self.assertIsNot(utxo.wally, wally)
+        self.assertIs(wally.asset_unblind, asset_unblind)
+        metrics.disable()
+        self.assertIs(utxo.wally, wally)
+
+    def test_payout(self):
+        m = metrics.enable(wally_calls=True)
+        self.wallet.sync(self.chain)
+        self.pay()
+        stats = m.stats()
+        for span in ('sync', 'sync_list', 'sync_fetch', 'unblind_many', 'build_psbt', 'blind_psbt', 'psbt_blind',
+                     'sign_psbt', 'psbt_sign', 'send_psbt'):
+            self.assertEqual(stats['spans'][span]['calls'], 1, span)
+        # Once per fee estimate
+        self.assertGreater(stats['spans']['select_utxos']['calls'], 0)
+        counters = stats['counters']
+        self.assertEqual(counters['sync_utxos_listed'], 5)
+        self.assertEqual(counters['sync_utxos_new'], 5)
+        self.assertEqual(counters['utxos_unblinded'], 5)
+        self.assertEqual(counters['signatures'], 2)
+        self.assertEqual(counters['outputs_blinded'], 2)
+        self.assertEqual(counters['wally_calls{function="asset_unblind"}'], 5)
+        self.assertEqual(counters['wally_calls{function="psbt_blind"}'], 1)
+
+    def test_profile(self):
+        m = metrics.enable(profile=('sign_psbt',))
+        self.wallet.sync(self.chain)
+        self.pay()
+        self.assertEqual(list(m.profiles), ['sign_psbt'])
+        self.assertTrue(any(func[2] == 'sign' for func in m.profiles['sign_psbt'].stats))
+
+        result, stats = metrics.profile(sum, [1, 2])
+        self.assertEqual(result, 3)
+        self.assertGreater(stats.total_calls, 0)
+
+    def test_http(self):
+        m = metrics.enable()
+        w = self.wallet
+        with FakeEsplora() as fake:
+            fake.add_tx(blinded_tx([(w.scriptpubkey, w.public_blinding_key(), h2b_rev(LBTC_HEX), 1000)]),
+                        w.unconf_address(), [0])
+            w.sync(fake.url)
+        stats = m.stats()
+        self.assertEqual(stats['histograms']['http_request_seconds{backend="esplora",route="address/:address/utxo"}']['count'], 1)
+        self.assertEqual(stats['histograms']['http_request_seconds{backend="esplora",route="tx/:txid/hex"}']['count'], 1)
+        self.assertGreater(stats['counters']['http_response_bytes{backend="esplora"}'], 0)
+
+    def test_prometheus(self):
+        m = metrics.Metrics(buckets=(0.1, 1))
+        m.count('utxos_parsed', 3)
+        m.count('wally_calls', 2, (('function', 'psbt_blind'),))
+        m.timing('sync', 0.5)
+        m.timing('sync', 1.5)
+        m.observe('http_request_seconds', 0.05, (('route', 'tx'),))
+        m.observe('http_request_seconds', 2.0, (('route', 'tx'),))
+        self.assertEqual(metrics.prometheus(m), '\n'.join([
+            '# TYPE selw_utxos_parsed_total counter',
+            'selw_utxos_parsed_total 3',
+            '# TYPE selw_wally_calls_total counter',
+            'selw_wally_calls_total{function="psbt_blind"} 2',
+            '# TYPE selw_span_seconds summary',
+            'selw_span_seconds_count{span="sync"} 2',
+            'selw_span_seconds_sum{span="sync"} 2.0',
+            '# TYPE selw_http_request_seconds histogram',
+            'selw_http_request_seconds_bucket{route="tx",le="0.1"} 1',
+            'selw_http_request_seconds_bucket{route="tx",le="1"} 1',
+            'selw_http_request_seconds_bucket{route="tx",le="+Inf"} 2',
+            'selw_http_request_seconds_count{route="tx"} 2',
+            'selw_http_request_seconds_sum{route="tx"} 2.05',
+        ]) + '\n')
+
+    def test_daemon_endpoint(self):
+        metrics.enable()
+        with Daemon({'hot': self.wallet}, self.chain, port=0, refresh=3600) as daemon:
+            ElementsRpc(daemon.url, *daemon.auth).call('getbalance')
+            request = urllib.request.Request(daemon.url + '/metrics')
+            credentials = base64.b64encode('{}:{}'.format(*daemon.auth).encode()).decode()
+            request.add_header('Authorization', 'Basic ' + credentials)
+            with urllib.request.urlopen(request) as r:
+                text = r.read().decode()
+        self.assertIn('selw_rpc_request_seconds_count{method="getbalance"} 1', text)
+        self.assertIn('selw_span_seconds_count{span="sync"} 1', text)
@@ -0,0 +1,39 @@
+import unittest
+from unittest import mock
+
+from selw.output import P2wpkhElementsOutput, P2wsh2of3ElementsOutput
+
+
+class TestOutput(unittest.TestCase):
+
+    def setUp(self):
+        self.keys = [b'\x02' * 32, b'\x03' * 32, b'\x04' * 32]
+
+    def test_value_object(self):
+        a = P2wpkhElementsOutput(self.keys[0], b'\x01' * 32)
+        b = P2wpkhElementsOutput(self.keys[0], b'\x01' * 32)
+        self.assertEqual(a, b)
+        self.assertNotEqual(a, P2wpkhElementsOutput(self.keys[0], b'\x05' * 32))
+        self.assertNotEqual(a, P2wsh2of3ElementsOutput(self.keys, b'\x01' * 32))
+        self.assertEqual({a: 1}[b], 1)
+        self.assertFalse(hasattr(a, '__dict__'))
+        with self.assertRaises(AttributeError):
+            a.key = None
+
+    def test_memoized_scripts(self):
+        output = P2wsh2of3ElementsOutput(self.keys, b'\x01' * 32)
+        scriptpubkey = output.scriptpubkey
+        with mock.patch('selw.output.wally') as wally:
+            for _ in range(3):
+                self.assertEqual(output.scriptpubkey, scriptpubkey)
+                output.witness_script
+                output.witness_program
+        wally.scriptpubkey_multisig_from_bytes.assert_not_called()
+        wally.witness_program_from_bytes.assert_not_called()
+        self.assertEqual(wally.sha256.call_count, 1)
+
+    def test_addresses(self):
+        output = P2wpkhElementsOutput(self.keys[0], b'\x01' * 32)
+        self.assertTrue(output.unconf_address.startswith('tex1'))
+        self.assertTrue(output.conf_address.startswith('tlq1'))
+        self.assertIs(output.conf_address, output.conf_address)
@@ -0,0 +1,153 @@
+import asyncio
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+from selw.constants import LBTC_HEX
+from selw.fakechain import FakeChain
+from selw.utils import h2b_rev
+from selw.wallet import WalletP2wpkh, _balance
+from selw.tests.test_pset import fund
+
+
+class Clock(object):
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+class TestUtxoPool(unittest.TestCase):
+
+    def setUp(self):
+        self.wallet = WalletP2wpkh(b'\x02' * 32, b'\x01' * 32)
+        self.recipient = WalletP2wpkh(b'\x03' * 32, b'\x04' * 32).address()
+        fund(self.wallet, [1000 + i for i in range(20)])
+
+    def test_concurrent_builders_do_not_share_utxos(self):
+        w = self.wallet
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            builders = list(executor.map(lambda _: w.build_psbt(None, self.recipient, LBTC_HEX, 400), range(20)))
+        spent = [u.outpoint for builder in builders for u in builder.utxos]
+        self.assertEqual(len(spent), 20)
+        self.assertEqual(len(set(spent)), 20)
+        self.assertEqual(len(w.utxo_index), 0)
+
+    def test_asyncio_builders(self):
+        w = self.wallet
+
+        async def build():
+            await asyncio.sleep(0)
+            return w.build_psbt(None, self.recipient, LBTC_HEX, 400)
+
+        async def main():
+            return await asyncio.gather(*(build() for _ in range(20)))
+
+        builders = asyncio.run(main())
+        self.assertEqual(len({u.outpoint for builder in builders for u in builder.utxos}), 20)
+
+    def test_lease_expiry(self):
+        w = self.wallet
+        clock = w.pool.clock = Clock()
+        builder = w.build_psbt(None, self.recipient, LBTC_HEX, 400, lease=10)
+        forever = w.build_psbt(None, self.recipient, LBTC_HEX, 400, lease=None)
+        self.assertEqual(len(w.utxo_index), 18)
+        clock.now = 9
+        w.pool.expire()
+        self.assertEqual(len(w.utxo_index), 18)
+        # Renewed
+        w.reserve_utxos(builder.utxos, lease=10)
+        clock.now = 15
+        w.pool.expire()
+        self.assertEqual(len(w.utxo_index), 18)
+        clock.now = 19
+        # Selection releases expired leases first
+        w.select_utxos(LBTC_HEX, 100)
+        self.assertEqual(len(w.utxo_index), 19)
+        self.assertNotIn(forever.utxos[0], w.utxo_index.utxos.values())
+        w.release_utxos(forever.utxos)
+        self.assertEqual(len(w.utxo_index), 20)
+
+    def test_incremental_balance(self):
+        w = self.wallet
+        fund(w, [500], asset_hex='11' * 32)
+        self.assertEqual(w.pool.balance(), _balance(w.utxos))
+        spent = w.utxos[:5]
+        w.spend_utxos(spent)
+        w.spend_utxos(spent)
+        self.assertEqual(w.pool.balance(), _balance(w.utxos))
+        w.spend_utxos([u for u in w.utxos if bytes(u.asset) == h2b_rev('11' * 32)])
+        self.assertEqual(w.balance(), {LBTC_HEX: sum(range(1005, 1020))})
+
+    def test_balance_kinds(self):
+        w = self.wallet
+        total = sum(range(1000, 1020))
+        unconfirmed = w.utxos[0]
+        w.pool.set_height(unconfirmed.outpoint, None)
+        builder = w.build_psbt(None, self.recipient, LBTC_HEX, 2500)
+        reserved = sum(u.value for u in builder.utxos)
+        self.assertEqual(w.balance(), {LBTC_HEX: total})
+        self.assertEqual(w.balance('confirmed'), {LBTC_HEX: total - 1000})
+        self.assertEqual(w.balance('unconfirmed'), {LBTC_HEX: 1000})
+        self.assertEqual(w.balance('reserved'), {LBTC_HEX: reserved})
+        self.assertEqual(w.balance('available'), {LBTC_HEX: total - reserved})
+        # Reserving twice counts once
+        w.reserve_utxos(builder.utxos)
+        self.assertEqual(w.balance('reserved'), {LBTC_HEX: reserved})
+        w.spend_utxos(builder.utxos)
+        self.assertEqual(w.balance('reserved'), {})
+        self.assertEqual(w.balance(), {LBTC_HEX: total - reserved})
+        w.pool.set_height(unconfirmed.outpoint, 5)
+        self.assertEqual(w.balance('unconfirmed'), {})
+        with self.assertRaises(ValueError):
+            w.balance('spendable')
+
+
+class TestPending(unittest.TestCase):
+
+    def setUp(self):
+        self.chain = FakeChain()
+        self.wallet = WalletP2wpkh(b'\x02' * 32, b'\x01' * 32)
+        self.chain.fund(self.wallet.scriptpubkey, [5000], blinding_pubkey=self.wallet.public_blinding_key())
+        self.wallet.sync(self.chain)
+
+    def send(self, value):
+        w = self.wallet
+        builder = w.build_psbt(None, WalletP2wpkh(b'\x03' * 32, b'\x04' * 32).address(), LBTC_HEX, value)
+        w.blind_psbt(builder, builder.utxos)
+        w.sign_psbt(builder, builder.utxos)
+        builder.finalize()
+        return w.add_pending_tx(builder.tx_hex()), builder
+
+    def test_spend_unconfirmed_change(self):
+        w = self.wallet
+        (change,), first = self.send(1000)
+        self.assertEqual((change.value, change.height), (3500, None))
+        self.assertEqual(w.balance(), {LBTC_HEX: 3500})
+        # Not broadcast yet: sync keeps the change and does not bring the spent utxo back
+        w.sync(self.chain)
+        self.assertEqual(w.utxos, [change])
+
+        (change2,), second = self.send(1000)
+        self.assertEqual(second.utxos, [change])
+        self.chain.broadcast(first.tx_hex())
+        self.chain.broadcast(second.tx_hex())
+        self.chain.mine()
+        w.confirm_pending_tx(change.outpoint[0], 2)
+        w.sync(self.chain)
+        self.assertEqual([u.outpoint for u in w.utxos], [change2.outpoint])
+        self.assertEqual(w.balance(), {LBTC_HEX: 2000})
+
+    def test_drop(self):
+        w = self.wallet
+        (change,), builder = self.send(1000)
+        w.drop_pending_tx(change.outpoint[0])
+        self.assertEqual(w.utxos, builder.utxos)
+        self.assertEqual(w.balance(), {LBTC_HEX: 5000})
+        self.assertEqual(len(w.utxo_index), 1)
+        w.sync(self.chain)
+        self.assertEqual(w.utxos, builder.utxos)
+
+
+if __name__ == '__main__':
+    unittest.main()
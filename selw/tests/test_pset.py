@@ -0,0 +1,188 @@
+import unittest
+import wallycore as wally
+
+from selw.constants import LBTC_HEX
+from selw.fakechain import blinded_tx, unspent
+from selw.key import is_set
+from selw.pset import PsetBuilder, TX_FLAGS
+from selw.utils import HmacDrbg, h2b_rev
+from selw.utxo import SpendableElementsUTXO
+from selw.wallet import WalletP2wpkh, WalletP2wsh2of3
+
+
+def fund(wallet, values, asset_hex=LBTC_HEX):
+    outputs = [(wallet.scriptpubkey, wallet.public_blinding_key(), h2b_rev(asset_hex), v) for v in values]
+    tx = blinded_tx(outputs)
+    for i in range(len(values)):
+        utxo = SpendableElementsUTXO(unspent(tx, i), wallet.output, wallet.private_blinding_key)
+        wallet.pool.add(utxo)
+
+
+class TestBlind(unittest.TestCase):
+
+    def setUp(self):
+        self.wallet = WalletP2wpkh(b'\x02' * 32, b'\x01' * 32)
+        self.recipient = WalletP2wpkh(b'\x03' * 32, b'\x04' * 32)
+        fund(self.wallet, [3000, 4000])
+        fund(self.wallet, [500], asset_hex='11' * 32)
+
+    def blinded(self, entropy=None):
+        w = self.wallet
+        recipients = [(self.recipient.address(), LBTC_HEX, 1000), (self.recipient.unconf_address(), LBTC_HEX, 700),
+                      (self.recipient.address(), '11' * 32, 200)]
+        builder = w.build_batch_psbt(w.utxos, recipients)
+        w.blind_psbt(builder, builder.utxos, entropy)
+        return builder
+
+    def test_hmac_drbg(self):
+        # NIST CAVP HMAC_DRBG SHA-256, no reseed, first test case
+        seed = bytes.fromhex('ca851911349384bffe89de1cbdc46e6831e44d34a4fb935ee285dd14b71a7488659ba96c601dc69fc902940805ec0ca8')
+        drbg = HmacDrbg(seed)
+        drbg(128)
+        self.assertEqual(drbg(128).hex()[:64], 'e528e9abf2dece54d47c7e75e5fe302149f817ea9fb4bee6f4199697d04d5b89')
+
+    def test_deterministic(self):
+        tx_hex = [wally.tx_to_hex(wally.psbt_extract(self.blinded().psbt, wally.WALLY_PSBT_EXTRACT_NON_FINAL), TX_FLAGS)
+                  for _ in range(2)]
+        self.assertEqual(tx_hex[0], tx_hex[1])
+        # Explicit proofs included
+        first, second = self.blinded(), self.blinded()
+        self.assertTrue(all(wally.psbt_get_input_amount_rangeproof_len(first.psbt, i) for i in range(first.num_inputs)))
+        self.assertEqual(first.to_base64(), second.to_base64())
+        other = self.blinded(HmacDrbg(b'\x07' * 32))
+        self.assertNotEqual(wally.tx_to_hex(wally.psbt_extract(other.psbt, wally.WALLY_PSBT_EXTRACT_NON_FINAL), TX_FLAGS), tx_hex[0])
+
+    def test_blinders(self):
+        builder = self.blinded()
+        tx = wally.psbt_extract(builder.psbt, wally.WALLY_PSBT_EXTRACT_NON_FINAL)
+        # The unconfidential recipient and the fee are explicit
+        self.assertEqual(sorted(builder.blinders), [0, 2, 3, 4])
+        for i, (value, asset, abf, vbf, ephemeral_key) in builder.blinders.items():
+            generator = wally.asset_generator_from_bytes(asset, abf)
+            self.assertEqual(generator, wally.tx_get_output_asset(tx, i))
+            self.assertEqual(wally.asset_value_commitment(value, vbf, generator), wally.tx_get_output_value(tx, i))
+            self.assertEqual(wally.ec_public_key_from_private_key(ephemeral_key), wally.tx_get_output_nonce(tx, i))
+        self.assertEqual(builder.blinders[0][:2], (1000, h2b_rev(LBTC_HEX)))
+
+
+class TestPsetBuilder(unittest.TestCase):
+
+    def setUp(self):
+        self.wallet = WalletP2wpkh(b'\x02' * 32, b'\x01' * 32)
+        self.recipient = WalletP2wpkh(b'\x03' * 32, b'\x04' * 32)
+        fund(self.wallet, [3000, 4000])
+
+    def test_build_blind_sign_extract(self):
+        w = self.wallet
+        builder = w.build_psbt(w.utxos, self.recipient.address(), LBTC_HEX, 1000)
+        self.assertIs(w.blind_psbt(builder, w.utxos), builder)
+        self.assertIs(w.sign_psbt(builder, w.utxos), builder)
+        builder.finalize()
+        tx = builder.extract()
+        self.assertEqual(wally.tx_get_num_inputs(tx), 2)
+        self.assertEqual(wally.tx_get_num_outputs(tx), 3)
+        self.assertGreater(len(wally.tx_get_output_rangeproof(tx, 0)), 0)
+
+        # The recipient can unblind its output
+        tx = wally.tx_from_hex(builder.tx_hex(), TX_FLAGS)
+        value, asset, _, _ = wally.asset_unblind(
+            wally.tx_get_output_nonce(tx, 0), self.recipient.private_blinding_key,
+            wally.tx_get_output_rangeproof(tx, 0), wally.tx_get_output_value(tx, 0),
+            wally.tx_get_output_script(tx, 0), wally.tx_get_output_asset(tx, 0))
+        self.assertEqual((value, asset), (1000, h2b_rev(LBTC_HEX)))
+
+    def test_coin_selection(self):
+        w = self.wallet
+        builder = w.build_psbt(None, self.recipient.address(), LBTC_HEX, 2000)
+        self.assertEqual([u.value for u in builder.utxos], [3000])
+        w.blind_psbt(builder, builder.utxos)
+        w.sign_psbt(builder, builder.utxos)
+        builder.finalize()
+        self.assertEqual(wally.tx_get_num_inputs(builder.extract()), 1)
+
+    def test_base64_stages(self):
+        w = self.wallet
+        psbt = w.create_psbt(w.utxos, self.recipient.address(), LBTC_HEX, 1000)
+        psbt = w.blind_psbt(psbt, w.utxos)
+        psbt = w.sign_psbt(psbt, w.utxos)
+        self.assertIsInstance(psbt, str)
+        builder = PsetBuilder.from_bytes(PsetBuilder.from_base64(psbt).to_bytes())
+        self.assertEqual(builder.to_base64(), psbt)
+        builder.finalize()
+        self.assertTrue(wally.psbt_is_finalized(builder.psbt))
+
+    def test_multisig_asset(self):
+        w = WalletP2wsh2of3([b'\x02' * 32, b'\x03' * 32, wally.ec_public_key_from_private_key(b'\x05' * 32)], b'\x01' * 32)
+        asset_hex = '11' * 32
+        fund(w, [2000])
+        fund(w, [50], asset_hex)
+        builder = w.build_psbt(w.utxos, self.recipient.address(), asset_hex, 20)
+        w.blind_psbt(builder, w.utxos)
+        w.sign_psbt(builder, w.utxos)
+        builder.finalize()
+        self.assertEqual(wally.tx_get_num_outputs(builder.extract()), 4)
+
+    def test_sign_once_per_input_key(self):
+        keys = [b'\x02' * 32, b'\x03' * 32]
+        w = WalletP2wsh2of3(keys + [wally.ec_public_key_from_private_key(b'\x05' * 32)], b'\x01' * 32)
+        fund(w, [1000] * 6)
+        builder = w.build_psbt(w.utxos, self.recipient.address(), LBTC_HEX, 1000)
+        w.blind_psbt(builder, w.utxos)
+        expected = PsetBuilder.from_base64(builder.to_base64())
+        for key in keys:
+            wally.psbt_sign(expected.psbt, key, 0)
+
+        # Inputs already signed by a key are not signed again
+        wally.psbt_sign(builder.psbt, keys[0], 0)
+        w.sign_psbt(builder, w.utxos, workers=2)
+        hashes, _ = builder.signature_hashes()
+        for idx in range(builder.num_inputs):
+            self.assertEqual(wally.psbt_get_input_signatures_size(builder.psbt, idx), 2)
+            for key in keys:
+                pub = wally.ec_public_key_from_private_key(key)
+                sig = wally.psbt_get_input_signature(builder.psbt, idx, wally.psbt_find_input_signature(builder.psbt, idx, pub) - 1)
+                wally.ec_sig_verify(pub, hashes[idx], wally.EC_FLAG_ECDSA, wally.ec_sig_from_der(sig[:-1]))
+        builder.finalize()
+        expected.finalize()
+        self.assertEqual(wally.tx_get_txid(builder.extract()), wally.tx_get_txid(expected.extract()))
+
+    def test_sign_own_inputs(self):
+        w, other = self.wallet, WalletP2wsh2of3([b'\x06' * 32, b'\x07' * 32, b'\x08' * 32], b'\x01' * 32)
+        fund(other, [2000])
+        builder = PsetBuilder()
+        for wallet in (w, other, w):
+            utxo = wallet.utxos[0] if wallet is other else wallet.utxos.pop()
+            idx = builder.add_input(utxo)
+            wallet.set_witness_script(builder.psbt, idx, utxo)
+            wallet.set_keypaths(builder.psbt, idx, utxo)
+        builder.add_fee(w.network.policy_asset, 3000 + 4000 + 2000)
+        w.sign_psbt(builder)
+        self.assertEqual([wally.psbt_get_input_signatures_size(builder.psbt, i) for i in range(3)], [1, 0, 1])
+        other.sign_psbt(builder)
+        self.assertEqual([wally.psbt_get_input_signatures_size(builder.psbt, i) for i in range(3)], [1, 3, 1])
+        builder.finalize()
+        self.assertTrue(wally.psbt_is_finalized(builder.psbt))
+
+    def test_verify_signatures(self):
+        keys = [b'\x02' * 32, b'\x03' * 32]
+        w = WalletP2wsh2of3(keys + [wally.ec_public_key_from_private_key(b'\x05' * 32)], b'\x01' * 32)
+        fund(w, [1000] * 3)
+        builder = w.build_psbt(w.utxos, self.recipient.address(), LBTC_HEX, 1000)
+        w.blind_psbt(builder, w.utxos)
+        w.sign_psbt(builder, w.utxos)
+
+        # Without the utxos, keys are found in the witness script
+        received = PsetBuilder.from_base64(builder.to_base64())
+        signatures, bitmap = received.verify_signatures()
+        self.assertEqual(len(signatures), 6)
+        self.assertTrue(all(is_set(bitmap, i) for i in range(6)))
+
+        # A signature of another input
+        pub = wally.ec_public_key_from_private_key(keys[1])
+        sig = wally.psbt_get_input_signature(received.psbt, 0, wally.psbt_find_input_signature(received.psbt, 0, pub) - 1)
+        sigs = wally.map_init(1, None)
+        wally.map_add(sigs, pub, sig)
+        wally.psbt_set_input_signatures(received.psbt, 2, sigs)
+        signatures, bitmap = received.verify_signatures()
+        self.assertEqual(len(signatures), 5)
+        self.assertEqual([signatures[i] for i in range(5) if not is_set(bitmap, i)], [(2, bytes(pub))])
@@ -0,0 +1,95 @@
+import os
+import tempfile
+import unittest
+import wallycore as wally
+from unittest import mock
+
+from selw.constants import LBTC_HEX
+from selw.fakechain import blinded_tx
+from selw.store import UtxoStore
+from selw.utils import b2h_rev, h2b_rev
+from selw.wallet import WalletP2wpkh
+from selw.tests.test_pset import fund
+from selw.tests.util import FakeEsplora
+
+
+class TestIncrementalSync(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, 'selw.sqlite')
+        self.wallet = self.new_wallet()
+        output = (self.wallet.scriptpubkey, self.wallet.public_blinding_key(), h2b_rev(LBTC_HEX), 1000)
+        self.fake = FakeEsplora().__enter__()
+        for _ in range(3):
+            self.fake.add_tx(blinded_tx([output] * 2), self.wallet.unconf_address(), range(2))
+
+    def tearDown(self):
+        self.fake.__exit__()
+        self.tmpdir.cleanup()
+
+    def new_wallet(self):
+        return WalletP2wpkh(b'\x02' * 32, b'\x01' * 32, store=UtxoStore(self.path))
+
+    def tx_hits(self):
+        return sum(n for path, n in self.fake.hits.items() if path.endswith('/hex'))
+
+    def test_resync_does_not_duplicate(self):
+        self.wallet.sync(self.fake.url)
+        first = list(self.wallet.utxos)
+        self.wallet.sync(self.fake.url)
+        self.assertEqual(self.wallet.utxos, first)
+        self.assertEqual(self.wallet.balance(), {LBTC_HEX: 6000})
+        self.assertEqual(self.tx_hits(), 3)
+
+    def test_spent_outputs_are_dropped(self):
+        self.wallet.sync(self.fake.url)
+        address = self.wallet.unconf_address()
+        spent = self.fake.utxos[address].pop(0)
+        self.wallet.sync(self.fake.url)
+        self.assertEqual(len(self.wallet.utxos), 5)
+        self.assertNotIn((spent['txid'], spent['vout']), [u.outpoint for u in self.wallet.utxos])
+        self.assertIsNone(self.wallet.store.get_unblinded(spent['txid'], spent['vout']))
+
+    def test_restart_uses_store(self):
+        self.wallet.sync(self.fake.url)
+        self.wallet.store.close()
+        wallet = self.new_wallet()
+        with mock.patch('selw.utxo.wally.asset_unblind', side_effect=AssertionError('unblinded again')):
+            wallet.sync(self.fake.url)
+        self.assertEqual(wallet.balance(), {LBTC_HEX: 6000})
+        self.assertEqual(self.tx_hits(), 3)
+
+    def test_spent_while_offline(self):
+        self.wallet.sync(self.fake.url)
+        self.wallet.store.close()
+        spent = self.fake.utxos[self.wallet.unconf_address()].pop(0)
+        outpoint = (spent['txid'], spent['vout'])
+        wallet = self.new_wallet()
+        wallet.store.add_blinders([(*outpoint, 1000, b'\x01' * 32, b'\x02' * 32, b'\x03' * 32, b'\x04' * 33)])
+        wallet.sync(self.fake.url)
+        self.assertEqual(len(wallet.store.outpoints()), 5)
+        self.assertNotIn(outpoint, wallet.store.outpoints())
+        self.assertEqual(wallet.store.get_blinders(spent['txid']), {})
+
+    def test_full_resync(self):
+        self.wallet.sync(self.fake.url)
+        self.wallet.sync(self.fake.url, incremental=False)
+        self.assertEqual(len(self.wallet.utxos), 6)
+        self.assertEqual(self.tx_hits(), 6)
+
+
+class TestBlinders(unittest.TestCase):
+
+    def test_pending_change_uses_blinders(self):
+        wallet = WalletP2wpkh(b'\x02' * 32, b'\x01' * 32, store=UtxoStore(':memory:'))
+        fund(wallet, [3000])
+        builder = wallet.build_psbt(None, WalletP2wpkh(b'\x03' * 32, b'\x04' * 32).address(), LBTC_HEX, 1000)
+        wallet.blind_psbt(builder, builder.utxos)
+        wallet.sign_psbt(builder, builder.utxos)
+        builder.finalize()
+        txid = b2h_rev(wally.tx_get_txid(builder.extract()))
+        self.assertEqual(wallet.store.get_blinders(txid), {vout: blinder for vout, blinder in builder.blinders.items()})
+        with mock.patch('selw.utxo.wally.asset_unblind', side_effect=AssertionError('unblinded again')):
+            (change,) = wallet.add_pending_tx(builder.tx_hex())
+        self.assertEqual((change.value, change.abf, change.vbf), builder.blinders[1][:1] + builder.blinders[1][2:4])
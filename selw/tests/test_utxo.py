@@ -0,0 +1,56 @@
+import unittest
+import wallycore as wally
+
+from selw.constants import LBTC_HEX
+from selw.fakechain import blinded_tx, unspent
+from selw.utils import h2b_rev, process_pool
+from selw.utxo import ElementsUTXO, MIN_PARALLEL_UNBLIND, unblind_many
+from selw.wallet import WalletP2wpkh
+from selw.tests.util import FakeEsplora
+
+
+class TestUnblindMany(unittest.TestCase):
+
+    def setUp(self):
+        self.key = b'\x01' * 32
+        self.other_key = b'\x03' * 32
+        self.asset = h2b_rev(LBTC_HEX)
+        self.spk = b'\x00\x14' + b'\x11' * 20
+
+    def utxos(self, values, key):
+        pub = wally.ec_public_key_from_private_key(key)
+        tx = blinded_tx([(self.spk, pub, self.asset, value) for value in values])
+        return [ElementsUTXO(unspent(tx, vout)) for vout in range(len(values))]
+
+    def check(self, workers):
+        n = MIN_PARALLEL_UNBLIND
+        ours = self.utxos(range(1, n + 1), self.key)
+        foreign = self.utxos([1000], self.other_key)
+        results = unblind_many(ours[:3] + foreign + ours[3:], self.key, workers=workers)
+        self.assertEqual(len(results), n + 1)
+        self.assertIsNone(results[3])
+        values = [r[0] for r in results[:3] + results[4:]]
+        self.assertEqual(values, list(range(1, n + 1)))
+        self.assertTrue(all(r[1] == self.asset for r in results if r))
+        self.assertTrue(all(u.value is None for u in ours))
+
+    def test_inline(self):
+        self.check(workers=1)
+
+    def test_process_pool(self):
+        self.check(workers=2)
+        # Kept for the next calls, and not forked from this process
+        self.assertIs(process_pool(2), process_pool(2))
+        self.assertNotEqual(process_pool(2)._mp_context.get_start_method(), 'fork')
+        self.check(workers=2)
+
+    def test_sync_skips_foreign_outputs(self):
+        wallet = WalletP2wpkh(b'\x02' * 32, self.key)
+        other_pub = wally.ec_public_key_from_private_key(self.other_key)
+        tx = blinded_tx([
+            (wallet.scriptpubkey, wallet.public_blinding_key(), self.asset, 1000),
+            (wallet.scriptpubkey, other_pub, self.asset, 2000)])
+        with FakeEsplora() as fake:
+            fake.add_tx(tx, wallet.unconf_address(), range(2))
+            wallet.sync(fake.url)
+        self.assertEqual(wallet.balance(), {LBTC_HEX: 1000})
@@ -0,0 +1,232 @@
+import json
+import threading
+import time
+import wallycore as wally
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from selw.backend import TXS_PAGE_SIZE
+from selw.fakechain import esplora_utxo
+from selw.pset import TX_FLAGS
+from selw.utils import b2h_rev
+
+
+class FakeEsplora(object):
+    """Local Esplora stand-in serving a fixed set of address UTXOs and transactions
+
+    Each request is delayed by latency seconds to mimic a remote server.
+    max_in_flight is the most GET requests served at the same time.
+    """
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.utxos = {}
+        self.history = {}
+        self.txs = {}
+        self.hits = {}
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.fee_estimates = {}
+        self.mempool = set()  # broadcast txids
+        self.confirmed = {}  # txid -> height
+        # Number of broadcasts to answer with an error before accepting them
+        self.broadcast_errors = 0
+        self.posts = []
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler())
+        self.server.daemon_threads = True
+        self.url = 'http://127.0.0.1:{}'.format(self.server.server_address[1])
+
+    def add_tx(self, tx, address=None, vouts=(), height=1):
+        txid = b2h_rev(wally.tx_get_txid(tx))
+        self.txs[txid] = wally.tx_to_hex(tx, TX_FLAGS)
+        if address is not None:
+            self.history.setdefault(address, []).append(txid)
+        for vout in vouts:
+            self.utxos.setdefault(address, []).append(esplora_utxo(tx, vout, height))
+        return txid
+
+    def _handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                with fake.lock:
+                    fake.hits[self.path] = fake.hits.get(self.path, 0) + 1
+                    fake.in_flight += 1
+                    fake.max_in_flight = max(fake.max_in_flight, fake.in_flight)
+                try:
+                    time.sleep(fake.latency)
+                    self._get()
+                finally:
+                    with fake.lock:
+                        fake.in_flight -= 1
+
+            def _get(self):
+                parts = self.path.strip('/').split('/')
+                if parts[:2] == ['api', 'address'] and len(parts) == 3:
+                    tx_count = len(fake.history.get(parts[2], []))
+                    self._reply(json.dumps({'chain_stats': {'tx_count': tx_count}, 'mempool_stats': {'tx_count': 0}}))
+                elif parts[:2] == ['api', 'address'] and parts[3:] == ['utxo']:
+                    self._reply(json.dumps(fake.utxos.get(parts[2], [])))
+                elif parts[:2] == ['api', 'address'] and parts[3:5] == ['txs', 'chain']:
+                    # Newest first, the transaction inputs are not ours
+                    txids = fake.history.get(parts[2], [])[::-1]
+                    start = txids.index(parts[5]) + 1 if len(parts) > 5 else 0
+                    page = [{'txid': txid, 'status': {'confirmed': True, 'block_height': 1}, 'vin': []}
+                            for txid in txids[start:start + TXS_PAGE_SIZE]]
+                    self._reply(json.dumps(page))
+                elif parts[:2] == ['api', 'tx'] and parts[3:] == ['hex'] and parts[2] in fake.txs:
+                    self._reply(fake.txs[parts[2]])
+                elif parts[:2] == ['api', 'tx'] and parts[3:] == ['status']:
+                    txid = parts[2]
+                    if txid in fake.confirmed:
+                        self._reply(json.dumps({'confirmed': True, 'block_height': fake.confirmed[txid]}))
+                    elif txid in fake.mempool:
+                        self._reply(json.dumps({'confirmed': False}))
+                    else:
+                        self.send_error(404)
+                elif parts == ['api', 'fee-estimates']:
+                    self._reply(json.dumps(fake.fee_estimates))
+                else:
+                    self.send_error(404)
+
+            def do_POST(self):
+                tx_hex = self.rfile.read(int(self.headers['Content-Length'])).decode()
+                with fake.lock:
+                    fake.posts.append(tx_hex)
+                    error = fake.broadcast_errors > 0
+                    fake.broadcast_errors -= error
+                if self.path != '/api/tx':
+                    return self.send_error(404)
+                if error:
+                    return self._reply('Service unavailable', 503)
+                try:
+                    tx = wally.tx_from_hex(tx_hex, TX_FLAGS)
+                except ValueError:
+                    return self._reply('sendrawtransaction RPC error: {"code":-22,"message":"TX decode failed"}', 400)
+                txid = b2h_rev(wally.tx_get_txid(tx))
+                if txid in fake.mempool:
+                    return self._reply('sendrawtransaction RPC error: {"code":-26,"message":"txn-already-in-mempool"}', 400)
+                fake.mempool.add(txid)
+                fake.txs[txid] = tx_hex
+                self._reply(txid)
+
+            def _reply(self, body, code=200):
+                body = body.encode()
+                self.send_response(code)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        return Handler
+
+    def __enter__(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *args):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class FakeElementsRpc(object):
+    """Local Elements JSON-RPC server answering from a FakeChain
+
+    Only the calls used by ElementsRpc are supported, requests counts the
+    HTTP requests, batches included.
+    """
+
+    def __init__(self, chain):
+        self.chain = chain
+        self.requests = 0
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler())
+        self.server.daemon_threads = True
+        self.url = 'http://127.0.0.1:{}'.format(self.server.server_address[1])
+
+    def scantxoutset(self, action, descriptors):
+        unspents = []
+        for descriptor in descriptors:
+            scriptpubkey = bytes.fromhex(descriptor[len('raw('):-1])
+            for utxo in self.chain.utxos.get(scriptpubkey, {}).values():
+                unspent = {'txid': utxo['txid'], 'vout': utxo['vout'], 'scriptPubKey': scriptpubkey.hex(),
+                           'height': self.chain.heights[utxo['txid']]}
+                if 'value' in utxo:
+                    unspent.update(amount=utxo['value'] / 10**8, asset=utxo['asset'])
+                unspents.append(unspent)
+        return {'success': True, 'unspents': unspents}
+
+    def gettransaction(self, txid, include_watchonly=True):
+        return {'txid': txid, 'hex': self.chain.get_tx_hex(txid)}
+
+    def getrawtransaction(self, txid, verbose=False):
+        tx_hex = self.chain.get_tx_hex(txid)
+        if not verbose:
+            return tx_hex
+        height = self.chain.heights[txid]
+        return {'hex': tx_hex, 'confirmations': 0 if height is None else self.chain.height - height + 1}
+
+    def sendrawtransaction(self, tx_hex):
+        txid = b2h_rev(wally.tx_get_txid(wally.tx_from_hex(tx_hex, TX_FLAGS)))
+        if self.chain.heights.get(txid) is not None:
+            raise FakeRpcError(-27, 'Transaction already in block chain')
+        return self.chain.broadcast(tx_hex)
+
+    def getblockcount(self):
+        return self.chain.height
+
+    def estimatesmartfee(self, target):
+        rates = {int(k): v for k, v in self.chain.fee_estimates.items() if int(k) <= target}
+        if not rates:
+            return {'errors': ['Insufficient data or no feerate found'], 'blocks': target}
+        return {'feerate': rates[max(rates)] / 10**5, 'blocks': target}
+
+    def listreceivedbyaddress(self, minconf=0, include_empty=True, include_watchonly=True):
+        return [{'address': self.chain.network.address(spk), 'txids': sorted(txids)} for spk, txids in self.chain.history.items()]
+
+    def _call(self, request):
+        try:
+            result = getattr(self, request['method'])(*request['params'])
+            return {'id': request['id'], 'result': result, 'error': None}
+        except FakeRpcError as e:
+            return {'id': request['id'], 'result': None, 'error': {'code': e.code, 'message': str(e)}}
+        except (ValueError, KeyError) as e:
+            return {'id': request['id'], 'result': None, 'error': {'code': -5, 'message': str(e)}}
+
+    def _handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                fake.requests += 1
+                payload = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+                if isinstance(payload, list):
+                    body = [fake._call(request) for request in payload]
+                else:
+                    body = fake._call(payload)
+                body = json.dumps(body).encode()
+                self.send_response(200)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        return Handler
+
+    def __enter__(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *args):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class FakeRpcError(Exception):
+    def __init__(self, code, message):
+        super().__init__(message)
+        self.code = code
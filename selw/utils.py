@@ -1,13 +1,99 @@
+import hashlib
+import hmac
+import multiprocessing
 import wallycore as wally
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from threading import Lock
 
 
 h2b = wally.hex_to_bytes
 b2h = wally.hex_from_bytes
 
 
+_pools = {}  # number of workers -> ProcessPoolExecutor
+_pools_lock = Lock()
+
+
 def h2b_rev(h):
     return wally.hex_to_bytes(h)[::-1]
 
 
 def b2h_rev(b):
     return wally.hex_from_bytes(b[::-1])
+
+
+def process_pool(workers):
+    """Shared pool of workers processes, started once and kept for later calls
+
+    Workers are started with forkserver, or spawn where it is not available,
+    never forked from the calling process, which may have threads running,
+    e.g. in the daemon, whose locks a forked child would inherit held.
+    """
+    with _pools_lock:
+        pool = _pools.get(workers)
+        if pool is None:
+            method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+            pool = _pools[workers] = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context(method))
+        return pool
+
+
+class LruCache(object):
+    """Thread safe LRU cache, holding at most maxsize keys"""
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.keys = OrderedDict()
+        self.lock = Lock()
+
+    def __len__(self):
+        return len(self.keys)
+
+    def get(self, key):
+        with self.lock:
+            value = self.keys.get(key)
+            if value is not None:
+                self.keys.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        with self.lock:
+            self.keys[key] = value
+            self.keys.move_to_end(key)
+            while len(self.keys) > self.maxsize:
+                self.keys.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.keys.clear()
+
+
+class HmacDrbg(object):
+    """HMAC-DRBG with SHA-256 (NIST SP 800-90A), without reseeding
+
+    The output only depends on seed, so it must contain enough secret
+    entropy. Calling an instance returns the next n bytes.
+    """
+
+    def __init__(self, seed):
+        self.key = b'\x00' * 32
+        self.value = b'\x01' * 32
+        self._update(seed)
+
+    def _hmac(self, data):
+        return hmac.new(self.key, data, hashlib.sha256).digest()
+
+    def _update(self, data=b''):
+        self.key = self._hmac(self.value + b'\x00' + data)
+        self.value = self._hmac(self.value)
+        if data:
+            self.key = self._hmac(self.value + b'\x01' + data)
+            self.value = self._hmac(self.value)
+
+    def __call__(self, n):
+        out = []
+        for _ in range(-(-n // 32)):
+            self.value = self._hmac(self.value)
+            out.append(self.value)
+        self._update()
+        return b''.join(out)[:n]
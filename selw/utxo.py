@@ -1,42 +1,79 @@
+import os
 import wallycore as wally
 
-from selw.utils import b2h, h2b, h2b_rev
+from selw import metrics
+from selw.utils import b2h, b2h_rev, h2b, h2b_rev, process_pool
 
 
 class ElementsUTXO(object):
-    """Elements UTXO"""
+    """Elements UTXO
 
-    def __init__(self, unspent):
+    Only the fields of the spent output are kept, the parent transaction is
+    parsed once and then dropped unless keep_tx is set.
+    """
+
+    __slots__ = (
+        'txid', 'vout', 'scriptpubkey', 'height', 'asset', 'value', 'abf', 'vbf',
+        'asset_commitment', 'value_commitment', 'nonce_commitment', 'rangeproof', '_tx')
+
+    def __init__(self, unspent, keep_tx=False):
         """Create ElementsUTXO from scanutxoset (processed) output"""
         self.txid = h2b_rev(unspent.get('txid'))
         self.vout = unspent.get('vout')
         self.scriptpubkey = h2b(unspent.get('scriptpubkey'))
         self.height = unspent.get('height')
 
+        flags = wally.WALLY_TX_FLAG_USE_WITNESS | wally.WALLY_TX_FLAG_USE_ELEMENTS
+        raw = unspent['tx']
+        tx = wally.tx_from_hex(raw, flags) if isinstance(raw, str) else wally.tx_from_bytes(raw, flags)
+        metrics.count('utxos_parsed')
+        metrics.count('tx_bytes_parsed', len(raw) // 2 if isinstance(raw, str) else len(raw))
+
         # blinded data
         is_unblinded = unspent.get('asset') and unspent.get('value')
         self.asset = h2b_rev(unspent['asset']) if is_unblinded else None
-        self.value = h2b_rev(unspent['value']) if is_unblinded else None
+        self.value = unspent['value'] if is_unblinded else None
         self.abf = b'\x00' * 32 if self.asset else None
         self.vbf = b'\x00' * 32 if self.value else None
 
+        # Commitments not given are read from the parent transaction
         self.asset_commitment = \
             b'\x01' + self.asset if is_unblinded else \
-            h2b(unspent.get('assetcommitment'))
+            h2b(unspent['assetcommitment']) if unspent.get('assetcommitment') else \
+            wally.tx_get_output_asset(tx, self.vout)
         self.value_commitment = \
             wally.tx_confidential_value_from_satoshi(self.value) if is_unblinded else \
-            h2b(unspent.get('valuecommitment'))
+            h2b(unspent['valuecommitment']) if unspent.get('valuecommitment') else \
+            wally.tx_get_output_value(tx, self.vout)
         self.nonce_commitment = \
             b'' if is_unblinded else \
-            h2b(unspent.get('noncecommitment'))
+            h2b(unspent['noncecommitment']) if unspent.get('noncecommitment') else \
+            wally.tx_get_output_nonce(tx, self.vout)
 
-        flags = wally.WALLY_TX_FLAG_USE_WITNESS | wally.WALLY_TX_FLAG_USE_ELEMENTS
-        self.tx = wally.tx_from_hex(unspent['tx'], flags)
-        self.rangeproof = wally.tx_get_output_rangeproof(self.tx, self.vout)
+        self.rangeproof = wally.tx_get_output_rangeproof(tx, self.vout)
+        self._tx = tx if keep_tx else None
+
+    @property
+    def tx(self):
+        """Parent transaction, only available if created with keep_tx"""
+        if self._tx is None:
+            raise ValueError('Parent transaction not kept, create the UTXO with keep_tx=True')
+        return self._tx
 
+    def txout(self):
+        """The spent output, without proofs, as expected for a PSET witness UTXO"""
+        return wally.tx_elements_output_init(
+            self.scriptpubkey, self.asset_commitment, self.value_commitment, self.nonce_commitment, None, None)
+
+    @property
+    def outpoint(self):
+        return b2h_rev(self.txid), self.vout
+
+    @metrics.timed('unblind')
     def unblind(self, private_blinding_key):
         if self.is_unblinded():
             return
+        metrics.count('utxos_unblinded')
         self.value, self.asset, self.abf, self.vbf = wally.asset_unblind(
             self.nonce_commitment, private_blinding_key, self.rangeproof, self.value_commitment,
             self.scriptpubkey, self.asset_commitment)
@@ -48,14 +85,25 @@ class ElementsUTXO(object):
 class SpendableElementsUTXO(ElementsUTXO):
     """Elements unblinded UTXO able to spend itself"""
 
-    def __init__(self, unspent, output, private_blinding_key):
-        super().__init__(unspent)
+    __slots__ = ('output',)
+
+    def __init__(self, unspent, output, private_blinding_key, unblinded=None, keep_tx=False, unblind=True):
+        """If unblinded (value, asset, abf, vbf) is known, it is used instead of unblinding again
+
+        With unblind=False the output is left blinded, e.g. to be unblinded
+        later in batch with unblind_many.
+        """
+        super().__init__(unspent, keep_tx)
         if output.scriptpubkey != self.scriptpubkey:
             raise ValueError('scriptpubkey must match: {}, {}'.format(
                 b2h(output.scriptpubkey),
                 b2h(self.scriptpubkey)))
         self.output = output
-        self.unblind(output.blinding_key.prv)
+        if unblinded is None:
+            if unblind:
+                self.unblind(output.blinding_key.prv)
+        else:
+            self.value, self.asset, self.abf, self.vbf = unblinded
 
     def _get_signature_hash(self, tx, index):
         return wally.tx_get_elements_signature_hash(
@@ -71,3 +119,61 @@ class SpendableElementsUTXO(ElementsUTXO):
         txhash = self._get_signature_hash(tx, index)
         wally.tx_set_input_witness(tx, index, self.output.get_signed_witness(txhash))
         wally.tx_set_input_script(tx, index, self.output.script_sig)
+
+
+def unblind_txout(tx, vout, private_blinding_key):
+    """(value, asset, abf, vbf) of output vout of tx, explicit or blinded to private_blinding_key, else None"""
+    asset, value = wally.tx_get_output_asset(tx, vout), wally.tx_get_output_value(tx, vout)
+    if asset[0] == 1 and value[0] == 1:
+        return wally.tx_confidential_value_to_satoshi(value), bytes(asset[1:]), b'\x00' * 32, b'\x00' * 32
+    metrics.count('utxos_unblinded')
+    try:
+        return wally.asset_unblind(wally.tx_get_output_nonce(tx, vout), private_blinding_key, wally.tx_get_output_rangeproof(tx, vout),
+                                   value, wally.tx_get_output_script(tx, vout), asset)
+    except ValueError:
+        return None
+
+
+# Below this many outputs, spawning worker processes costs more than it saves
+MIN_PARALLEL_UNBLIND = 16
+
+
+def _unblind(args):
+    try:
+        return wally.asset_unblind(*args)
+    except ValueError:
+        return None
+
+
+@metrics.timed('unblind_many')
+def unblind_many(utxos, private_blinding_key, workers=None):
+    """Unblind many utxos using a pool of worker processes
+
+    Return a list with (value, asset, abf, vbf) for each utxo, in order,
+    or None for the utxos that cannot be unblinded with
+    private_blinding_key, e.g. because they are not ours.
+    Explicit utxos are returned as they are.
+    The utxos themselves are not modified.
+
+    workers defaults to the number of CPUs, libwally holds the GIL so
+    threads would not help.
+    """
+    ret = [None] * len(utxos)
+    jobs, indexes = [], []
+    for i, utxo in enumerate(utxos):
+        if utxo.is_unblinded():
+            ret[i] = utxo.value, utxo.asset, utxo.abf, utxo.vbf
+        else:
+            indexes.append(i)
+            jobs.append((utxo.nonce_commitment, private_blinding_key, utxo.rangeproof, utxo.value_commitment,
+                         utxo.scriptpubkey, utxo.asset_commitment))
+
+    metrics.count('utxos_unblinded', len(jobs))
+    workers = min(workers or os.cpu_count() or 1, len(jobs))
+    if workers <= 1 or len(jobs) < MIN_PARALLEL_UNBLIND:
+        results = map(_unblind, jobs)
+    else:
+        results = list(process_pool(workers).map(_unblind, jobs, chunksize=max(1, len(jobs) // (workers * 4))))
+    for i, result in zip(indexes, results):
+        ret[i] = result
+    return ret
@@ -1,221 +1,576 @@
 import wallycore as wally
-import requests
-import os
 
+from selw import metrics
+from selw.coinselect import BNB, select_coins
+from selw.backend import ChainBackend
+from selw.esplora import Esplora, DEFAULT_MAX_WORKERS
+from selw.exceptions import InsufficientFunds
+from selw.network import LIQUID_TESTNET
+from selw.key import KeyStore
+from selw.history import iter_history
+from selw.fee import DEFAULT_FEERATE, DEFAULT_TARGET, MAX_STANDARD_VSIZE, FeeEstimator, change_cost, estimate_vsize, fee_for
+from selw.pool import DEFAULT_LEASE, UtxoPool
+from selw.pset import TX_FLAGS, PsetBuilder, as_builder, like
 from selw.utils import *
 from selw.output import *
 from selw.utxo import *
 from selw.constants import *
 
+# Fee used when no feerate is given
+DEFAULT_FEE = 500
+# Domain separation of the blinding entropy seed
+BLINDING_PERSONALIZATION = b'selw/blind'
+
 
 class Wallet(object):
-    """A Simple wallet consisting in a single address/scriptpubkey"""
-    def __init__(self, scriptpubkey, private_blinding_key):
+    """A Simple wallet consisting in a single address/scriptpubkey
+
+    If store (UtxoStore) is given, parent transactions and unblinded data are
+    persisted there, so that outputs already known are not fetched nor
+    unblinded again.
+
+    Addresses and the policy asset, used for fees, are the network's.
+
+    Utxos are kept in a UtxoPool, transactions built from the wallet
+    reserve the utxos they spend, so that builders running concurrently,
+    in threads or coroutines, never spend the same utxo.
+    """
+    def __init__(self, scriptpubkey, private_blinding_key, store=None, network=LIQUID_TESTNET):
         self.scriptpubkey = scriptpubkey
         self.private_blinding_key = private_blinding_key
-        self.utxos = list()
+        self.network = network
+        self._public_blinding_key = None
+        self.pool = UtxoPool()
+        self.keystore = KeyStore()
         self.output = None
+        self.store = store
+        self._store_checked = False  # whether the store was compared to the server since loading
+        self._esplora = None
+        self._fee_estimator = None
+
+    @property
+    def utxos(self):
+        """Snapshot of the utxos"""
+        return self.pool.utxos()
+
+    @property
+    def utxo_index(self):
+        """UtxoIndex of the utxos not reserved"""
+        return self.pool.index
 
     def public_blinding_key(self):
-        return wally.ec_public_key_from_private_key(self.private_blinding_key)
+        if self._public_blinding_key is None:
+            self._public_blinding_key = wally.ec_public_key_from_private_key(self.private_blinding_key)
+        return self._public_blinding_key
 
     def unconf_address(self):
-        return wally.addr_segwit_from_bytes(self.scriptpubkey, BECH32_FAMILY_TESTNET_LIQUID, 0)
+        return self.network.address(self.scriptpubkey)
 
     def address(self):
-        return wally.confidential_addr_from_addr_segwit(
-            self.unconf_address(), BECH32_FAMILY_TESTNET_LIQUID, BLECH32_FAMILY_TESTNET_LIQUID, self.public_blinding_key())
+        return self.network.address(self.scriptpubkey, self.public_blinding_key())
 
-    def sync(self, url):
-        utxos = requests.get(f"{url}/api/address/{self.unconf_address()}/utxo").json()
-        for utxo in utxos:
-            txid = utxo.get("txid")
-            vout = utxo.get("vout")
-            tx = requests.get(f"{url}/api/tx/{txid}/hex").text
+    def change_destination(self):
+        """Scriptpubkey and blinding public key of the change outputs"""
+        return self.scriptpubkey, self.public_blinding_key()
+
+    def change_address(self):
+        return self.network.address(*self.change_destination())
+
+    def output_for(self, scriptpubkey):
+        """The wallet's output with scriptpubkey, None if not ours"""
+        return self.output if bytes(scriptpubkey) == bytes(self.scriptpubkey) else None
+
+    def esplora(self, url):
+        """Esplora client for url, reused across syncs to keep connections alive"""
+        if self._esplora is None or self._esplora.url != url.rstrip('/'):
+            self._esplora = Esplora(url)
+        return self._esplora
+
+    def backend(self, url):
+        """The ChainBackend url is, or the Esplora client for url"""
+        return url if isinstance(url, ChainBackend) else self.esplora(url)
+
+    def _list_unspents(self, backend, max_workers):
+        """Return the server's utxos for this wallet, as (utxo dict, output) pairs"""
+        return [(utxo, self.output) for utxo in backend.get_addresses_utxos([self.unconf_address()], max_workers)[0]]
+
+    def history_outputs(self, backend):
+        """The wallet outputs whose address may have a history"""
+        return [self.output]
+
+    def history(self, url, cursor=None, max_workers=DEFAULT_MAX_WORKERS):
+        """Yield the confirmed transactions of the wallet, url is an Esplora url or a ChainBackend, see iter_history
+
+        The backend must have address histories, ElementsRpc does not.
+        """
+        return iter_history(self, url, cursor, max_workers)
+
+    @metrics.timed('sync')
+    def sync(self, url, max_workers=DEFAULT_MAX_WORKERS, incremental=True, unblind_workers=None):
+        """Update utxos to match the server's, url is an Esplora url or a ChainBackend
+
+        In incremental mode outputs already known, in memory or in the store,
+        are kept as they are, spent ones are dropped and only the new ones are
+        fetched and unblinded. Otherwise all outputs are fetched and unblinded
+        again. The first sync also drops from the store the outputs spent
+        while the wallet was not loaded.
+
+        New outputs are unblinded with unblind_many, outputs that cannot be
+        unblinded with our blinding key are skipped.
+        """
+        backend = self.backend(url)
+        with metrics.span('sync_list'):
+            current = {(utxo.get("txid"), utxo.get("vout")): (utxo, output)
+                       for utxo, output in self._list_unspents(backend, max_workers)}
+        metrics.count('sync_utxos_listed', len(current))
+        pool = self.pool
+        with pool.lock:
+            # Spent by our transactions the server does not know yet
+            for outpoint in pool.spent:
+                current.pop(outpoint, None)
+            utxos = pool.utxos()
+            spent = [utxo.outpoint for utxo in utxos if utxo.outpoint not in current and utxo.outpoint not in pool.unseen]
+        known = {utxo.outpoint: utxo for utxo in utxos} if incremental else {}
+        stale = []
+        if self.store and not self._store_checked:
+            pooled = {utxo.outpoint for utxo in utxos}
+            stale = [outpoint for outpoint in self.store.outpoints() if outpoint not in current and outpoint not in pooled]
+            self._store_checked = True
+        if self.store and (spent or stale):
+            self.store.remove(spent + stale)
+
+        txids = {txid for txid, vout in current if (txid, vout) not in known}
+        txs = self.store.get_txs(txids) if self.store and incremental else {}
+        with metrics.span('sync_fetch'):
+            fetched = backend.get_txs_hex([txid for txid in txids if txid not in txs], max_workers)
+        fetched = {txid: h2b(tx) for txid, tx in fetched.items()}
+        metrics.count('sync_tx_bytes_fetched', sum(len(tx) for tx in fetched.values()))
+        if self.store and fetched:
+            self.store.add_txs(fetched)
+        txs.update(fetched)
+
+        heights, new = {}, []
+        for outpoint, (utxo, output) in current.items():
+            height = utxo.get("status", {}).get("block_height")
+            if outpoint in known:
+                heights[outpoint] = height
+                continue
             unspent = {
-                "txid": txid,
-                "vout": vout,
-                "scriptpubkey": b2h(self.scriptpubkey),
-                "height": utxo.get("status", {}).get("block_height"),
+                "txid": outpoint[0],
+                "vout": outpoint[1],
+                "scriptpubkey": b2h(output.scriptpubkey),
+                "height": height,
                 "asset": utxo.get("asset"),
                 "value": utxo.get("value"),
                 "valuecommitment": utxo.get("valuecommitment"),
                 "assetcommitment": utxo.get("assetcommitment"),
                 "noncecommitment": utxo.get("noncecommitment"),
-                "tx": tx,
+                "tx": txs[outpoint[0]],
             }
-            self.utxos.append(SpendableElementsUTXO(unspent, self.output, self.private_blinding_key))
+            unblinded = self.store.get_unblinded(*outpoint) if self.store and incremental else None
+            u = SpendableElementsUTXO(unspent, output, self.private_blinding_key, unblinded, unblind=False)
+            new.append((u, unblinded is None))  # fresh if not in the store
+
+        blinded = [u for u, fresh in new if fresh and not u.is_unblinded()]
+        skipped = set()
+        for u, unblinded in zip(blinded, unblind_many(blinded, self.private_blinding_key, unblind_workers)):
+            if unblinded is None:
+                # Not unblindable with our key, we could not spend it anyway
+                skipped.add(u.outpoint)
+            else:
+                u.value, u.asset, u.abf, u.vbf = unblinded
+        new = [(u, fresh) for u, fresh in new if u.outpoint not in skipped]
+        metrics.count('sync_utxos_new', len(new))
+        metrics.count('sync_utxos_spent', len(spent))
+
+        with pool.lock:
+            for outpoint in spent:
+                if outpoint not in pool.unseen:
+                    pool.remove(outpoint)
+            for outpoint, height in heights.items():
+                pool.set_height(outpoint, height)
+                pool.seen(outpoint)
+            for u, _ in new:
+                # Spent by a transaction added while syncing
+                if u.outpoint not in pool.spent:
+                    pool.add(u)
+                    pool.seen(u.outpoint)
+        if self.store and new:
+            self.store.add_unblinded((*u.outpoint, u.value, u.asset, u.abf, u.vbf) for u, fresh in new if fresh)
+
+    def balance(self, kind='total'):
+        """Dict asset hex -> value, see UtxoPool.balance for kind"""
+        return {b2h_rev(asset): value for asset, value in self.pool.balance(kind).items()}
+
+    def reserve_utxos(self, utxos, lease=DEFAULT_LEASE):
+        """Do not select utxos for lease seconds, or until released if lease is None"""
+        self.pool.reserve(utxos, lease)
+
+    def release_utxos(self, utxos):
+        """Make reserved utxos selectable again, e.g. if their transaction was not sent"""
+        self.pool.release(utxos)
+
+    def spend_utxos(self, utxos):
+        """Forget utxos, spent by a confirmed transaction"""
+        with self.pool.lock:
+            for utxo in utxos:
+                self.pool.remove(utxo.outpoint)
+
+    def add_pending_tx(self, tx_hex):
+        """Track a transaction sent but not confirmed, return the utxos it creates for the wallet
+
+        The utxos it spends are removed, its outputs paying the wallet are
+        unblinded and can be spent at once, before confirmation. See
+        UtxoPool for how pending transactions are tracked.
+        """
+        tx = wally.tx_from_hex(tx_hex, TX_FLAGS)
+        txid = b2h_rev(wally.tx_get_txid(tx))
+        spent = [(b2h_rev(wally.tx_get_input_txhash(tx, i)), wally.tx_get_input_index(tx, i))
+                 for i in range(wally.tx_get_num_inputs(tx))]
+        tx_bytes = h2b(tx_hex)
+        blinders = self.store.get_blinders(txid) if self.store else {}
+        created = []
+        for vout in range(wally.tx_get_num_outputs(tx)):
+            scriptpubkey = wally.tx_get_output_script(tx, vout)
+            output = self.output_for(scriptpubkey) if scriptpubkey else None
+            if output is None:
+                continue
+            unspent = {"txid": txid, "vout": vout, "scriptpubkey": b2h(scriptpubkey), "height": None, "tx": tx_bytes}
+            asset, value = wally.tx_get_output_asset(tx, vout), wally.tx_get_output_value(tx, vout)
+            if asset[0] == 1 and value[0] == 1:
+                unspent.update(asset=b2h_rev(asset[1:]), value=wally.tx_confidential_value_to_satoshi(value))
+            try:
+                unblinded = blinders[vout][:4] if vout in blinders else None
+                created.append(SpendableElementsUTXO(unspent, output, self.private_blinding_key, unblinded))
+            except ValueError:
+                # Blinded to someone else
+                continue
+        self.pool.add_pending(txid, spent, created)
+        if self.store:
+            self.store.add_txs({txid: tx_bytes})
+            self.store.add_unblinded((*u.outpoint, u.value, u.asset, u.abf, u.vbf) for u in created)
+        return created
 
-    def balance(self):
-        return _balance(self.utxos)
+    def drop_pending_tx(self, txid):
+        """A pending transaction failed or left the mempool, restore the utxos it spent"""
+        with self.pool.lock:
+            created = self.pool.pending.get(txid, ((), (), ()))[2]
+            self.pool.drop_pending(txid)
+        if self.store and created:
+            self.store.remove(created)
+
+    def confirm_pending_tx(self, txid, height=None):
+        """A pending transaction confirmed at height"""
+        self.pool.confirm_pending(txid, height)
 
     @staticmethod
     def set_witness_script(psbt, idx, utxo):
         pass
 
-    def create_psbt(self, utxos, address, asset_hex, value):
-        psbt = wally.psbt_init(2, 0, 0, 0, wally.WALLY_PSBT_INIT_PSET)
-        for utxo in utxos:
-            # Input
-            idx = wally.psbt_get_num_inputs(psbt)
-            seq = 0xfffffffe
-            inp = wally.tx_input_init(utxo.txid, utxo.vout, seq, None, None)
-            wally.psbt_add_tx_input_at(psbt, idx, 0, inp)
-            # Witness UTXO
-            wally.psbt_set_input_witness_utxo_from_tx(psbt, idx, utxo.tx, utxo.vout)
-            wally.psbt_set_input_utxo_rangeproof(psbt, idx, utxo.rangeproof)
-            self.set_witness_script(psbt, idx, utxo)
-            # Add explicit proofs
-            wally.psbt_generate_input_explicit_proofs(psbt, idx, utxo.value, utxo.asset, utxo.abf, utxo.vbf, os.urandom(32))
-            # Add key path
-            self.set_keypaths(psbt, idx, utxo)
-
-        # Fee is fixed
-        fee = 500
-        asset_tag = bytes([1]) + h2b_rev(asset_hex)
-        lbtc_tag = bytes([1]) + h2b_rev(LBTC_HEX)
-
-        # Add sent output
-        spk_send, bpub_send = parse_address(address)
-        _value = wally.tx_confidential_value_from_satoshi(value)
-        txout_send = wally.tx_elements_output_init(spk_send, asset_tag, _value, bpub_send)
-        output_idx = wally.psbt_get_num_outputs(psbt)
-        wally.psbt_add_tx_output_at(psbt, output_idx, 0, txout_send)
-        wally.psbt_set_output_blinder_index(psbt, output_idx, 0)
-
-        # Add change for sent asset
-        value_change = _balance(utxos)[asset_hex] - value
-        if asset_hex == LBTC_HEX:
-            value_change -= fee
-        assert value_change >= 0
-        if value_change > 0:
-            spk_change, bpub_change = parse_address(self.address())
-            _value_change = wally.tx_confidential_value_from_satoshi(value_change)
-            txout_change = wally.tx_elements_output_init(spk_change, asset_tag, _value_change, bpub_change)
-            output_idx = wally.psbt_get_num_outputs(psbt)
-            wally.psbt_add_tx_output_at(psbt, output_idx, 0, txout_change)
-            wally.psbt_set_output_blinder_index(psbt, output_idx, 0)
-
-        if asset_hex != LBTC_HEX:
-            # Add change LBTC
-            value_change = _balance(utxos)[LBTC_HEX] - fee
-            assert value_change >= 0
+    @staticmethod
+    def _keys(output):
+        """ECKeys of output"""
+        return getattr(output, 'keys', None) or [output.key]
+
+    def set_keypaths(self, psbt, idx, utxo):
+        """Set the keypaths of the idx-th input, spending utxo, from the keystore"""
+        self.keystore.set_keypaths(psbt, idx, [key.pub for key in self._keys(utxo.output)])
+
+    @metrics.timed('sign_psbt')
+    def sign_psbt(self, psbt, used_utxos=None, workers=None):
+        """Sign the inputs with keys in the keystore, see PsetBuilder.sign for workers
+
+        Inputs are matched through their keypaths, used_utxos are not needed.
+        """
+        builder = as_builder(psbt, used_utxos)
+        builder.sign(self.keystore, workers)
+        return like(builder, psbt)
+
+    def select_utxos(self, asset_hex, value, fee=DEFAULT_FEE, strategy=BNB, index=None):
+        """Select the utxos to send value of asset_hex and pay fee"""
+        return self.select_utxos_many({asset_hex: value}, fee, strategy, index)
+
+    @metrics.timed('select_utxos')
+    def select_utxos_many(self, amounts, fee=DEFAULT_FEE, strategy=BNB, index=None, cost_of_change=0):
+        """Select the utxos to send amounts (asset hex -> value) and pay fee
+
+        index defaults to the wallet's utxos not reserved, selected utxos are
+        not reserved. cost_of_change is the policy asset excess tolerated to
+        avoid a change output, see change_cost.
+        """
+        targets = {bytes(h2b_rev(asset_hex)): value for asset_hex, value in amounts.items()}
+        lbtc = self.network.policy_asset
+        policy_target = {lbtc: targets.pop(lbtc, 0) + fee}
+        if index is None:
+            with self.pool.lock:
+                self.pool.expire()
+                return self._select(self.pool.index, targets, policy_target, strategy, cost_of_change)
+        return self._select(index, targets, policy_target, strategy, cost_of_change)
+
+    @staticmethod
+    def _select(index, targets, policy_target, strategy, cost_of_change):
+        # cost_of_change is in policy asset, other assets always get change
+        return select_coins(index, targets, strategy) + select_coins(index, policy_target, strategy, cost_of_change)
+
+    def _plan_outputs(self, utxos, recipients, fee):
+        """Return the outputs paying recipients and fee, as (scriptpubkey, asset, value, blinding pubkey)
+
+        recipients are ((scriptpubkey, blinding pubkey), asset hex, value),
+        one change output is added for each asset.
+        """
+        balance = _balance(utxos)
+        outputs, spent = [], {}
+        for (spk, bpub), asset_hex, value in recipients:
+            asset = bytes(h2b_rev(asset_hex))
+            outputs.append((spk, asset, value, bpub))
+            spent[asset] = spent.get(asset, 0) + value
+        policy_asset = self.network.policy_asset
+        spent[policy_asset] = spent.get(policy_asset, 0) + fee
+        for asset in list(spent) + [asset for asset in balance if asset not in spent]:
+            value_change = balance.get(asset, 0) - spent.get(asset, 0)
+            if value_change < 0:
+                raise InsufficientFunds('Missing {} of asset {}'.format(-value_change, b2h_rev(asset)))
             if value_change > 0:
-                spk_change, bpub_change = parse_address(self.address())
-                _value_change = wally.tx_confidential_value_from_satoshi(value_change)
-                txout_change = wally.tx_elements_output_init(spk_change, lbtc_tag, _value_change, bpub_change)
-                output_idx = wally.psbt_get_num_outputs(psbt)
-                wally.psbt_add_tx_output_at(psbt, output_idx, 0, txout_change)
-                wally.psbt_set_output_blinder_index(psbt, output_idx, 0)
+                spk_change, bpub_change = self.change_destination()
+                outputs.append((spk_change, asset, value_change, bpub_change))
+        return outputs
 
+    def _plan(self, utxos, recipients, feerate=None, index=None):
+        """Return the utxos, outputs, fee and estimated vsize of a transaction paying recipients
+
+        If utxos is None, they are selected with select_utxos_many from index.
+        Values must be positive integers, ValueError is raised otherwise.
+
+        If feerate (sat/vbyte) is given, the fee is computed from the
+        estimated vsize of the blinded and signed transaction, selecting
+        utxos again until they pay for it. Otherwise the fee is DEFAULT_FEE.
+        Selected utxos may exceed the amounts by less than the cost of a change
+        output at feerate (DEFAULT_FEERATE if None), the excess then goes to
+        the fee instead.
+        """
+        select = utxos is None
+        amounts = {}
+        for _, asset_hex, value in recipients:
+            if isinstance(value, bool) or not isinstance(value, int) or value <= 0:
+                raise ValueError('Invalid value: {!r}, must be a positive integer'.format(value))
+            amounts[asset_hex] = amounts.get(asset_hex, 0) + value
+        policy_asset = self.network.policy_asset
+        policy_amount = amounts.get(b2h_rev(policy_asset), 0)
+        cost_of_change = 0
+        if select:
+            cost_of_change = change_cost(self.change_destination()[0], DEFAULT_FEERATE if feerate is None else feerate)
+        # fee is the one of the transaction without policy asset change
+        fee = DEFAULT_FEE if feerate is None else 0
+        while True:
+            paid = fee
+            if select:
+                utxos = self.select_utxos_many(amounts, fee, index=index, cost_of_change=cost_of_change)
+                excess = _balance(utxos).get(policy_asset, 0) - policy_amount - fee
+                if excess <= cost_of_change:
+                    paid += excess
+                elif feerate is not None:
+                    paid += cost_of_change
+            outputs = self._plan_outputs(utxos, recipients, paid)
+            vsize = estimate_vsize([utxo.output for utxo in utxos],
+                                   [(spk, bpub is not None) for spk, _, _, bpub in outputs] + [(b'', False)])
+            if feerate is None:
+                break
+            # The fee only grows, so this ends when selection runs out of funds
+            required = fee_for(vsize, feerate)
+            if required <= paid:
+                break
+            fee += required - paid
+        return utxos, outputs, paid, vsize
+
+    @metrics.timed('build_psbt')
+    def _build(self, utxos, outputs, fee):
+        builder = PsetBuilder()
+        for utxo in utxos:
+            idx = builder.add_input(utxo)
+            self.set_witness_script(builder.psbt, idx, utxo)
+            # Add key path
+            self.set_keypaths(builder.psbt, idx, utxo)
+        for output in outputs:
+            builder.add_output(*output)
         # Add fee output
-        _fee = wally.tx_confidential_value_from_satoshi(fee)
-        txout_fee = wally.tx_elements_output_init(None, lbtc_tag, _fee)
-        output_idx = wally.psbt_get_num_outputs(psbt)
-        wally.psbt_add_tx_output_at(psbt, output_idx, 0, txout_fee)
-        return wally.psbt_to_base64(psbt, 0)
+        builder.add_fee(self.network.policy_asset, fee)
+        return builder
 
-    @staticmethod
-    def blind_psbt(psbt, used_utxos):
-        psbt = wally.psbt_from_base64(psbt, 0)
-        values = {i: wally.tx_confidential_value_from_satoshi(u.value) for i, u in enumerate(used_utxos)}
-        assets = {i: u.asset for i, u in enumerate(used_utxos)}
-        vbfs = {i: u.vbf for i, u in enumerate(used_utxos)}
-        abfs = {i: u.abf for i, u in enumerate(used_utxos)}
-
-        eph_keys = wally.psbt_blind(
-            psbt,
-            wally.map_from_dict(values),
-            wally.map_from_dict(vbfs),
-            wally.map_from_dict(assets),
-            wally.map_from_dict(abfs),
-            os.urandom(32*5*(wally.psbt_get_num_outputs(psbt)-1)),
-            wally.WALLY_PSET_BLIND_ALL,
-            0,
-        )
-        eph_keys = wally.map_to_dict(eph_keys)
-        return wally.psbt_to_base64(psbt, 0)
+    def build_psbt(self, utxos, address, asset_hex, value, feerate=None, lease=DEFAULT_LEASE):
+        """Return a PsetBuilder spending utxos and sending value of asset_hex to address
 
-    @staticmethod
-    def send_psbt(psbt, url):
-        psbt = wally.psbt_from_base64(psbt, 0)
-        wally.psbt_finalize(psbt)
-        tx = wally.psbt_extract(psbt, 0)
-        flags = wally.WALLY_TX_FLAG_USE_WITNESS | wally.WALLY_TX_FLAG_USE_ELEMENTS
-        txhex = wally.tx_to_hex(tx, flags)
-        txid = requests.post(f"{url}/api/tx", data=txhex).text
-        return txid
+        If utxos is None, they are selected with select_utxos.
+
+        If feerate (sat/vbyte) is given, the fee is computed from the
+        estimated vsize of the blinded and signed transaction, selecting
+        utxos again until they pay for it. Otherwise the fee is DEFAULT_FEE.
+
+        The spent utxos are reserved for lease seconds, release them if the
+        transaction is not sent.
+        """
+        return self.build_batch_psbt(utxos, [(address, asset_hex, value)], feerate, lease)
+
+    def create_psbt(self, utxos, address, asset_hex, value, feerate=None, lease=DEFAULT_LEASE):
+        return self.build_psbt(utxos, address, asset_hex, value, feerate, lease).to_base64()
+
+    def build_batch_psbt(self, utxos, recipients, feerate=None, lease=DEFAULT_LEASE):
+        """Return a PsetBuilder spending utxos and paying recipients, (address, asset hex, value) triples
+
+        There is a single change output for each asset, utxos, feerate and
+        lease are as in build_psbt.
+        """
+        recipients = [(self.network.parse_address(address), asset_hex, value) for address, asset_hex, value in recipients]
+        with self.pool.lock:
+            utxos, outputs, fee, _ = self._plan(utxos, recipients, feerate)
+            self.pool.reserve(utxos, lease)
+        try:
+            return self._build(utxos, outputs, fee)
+        except Exception:
+            self.pool.release(utxos)
+            raise
+
+    def build_sweep_psbt(self, utxos, feerate=None, lease=DEFAULT_LEASE):
+        """Return a PsetBuilder merging utxos into a single change output for each asset
+
+        If utxos do not pay the fee, policy asset utxos not reserved are
+        added. feerate and lease are as in build_psbt.
+        """
+        policy_asset = self.network.policy_asset
+        own = _balance(utxos).get(policy_asset, 0)
+        fee = DEFAULT_FEE if feerate is None else 0
+        with self.pool.lock:
+            self.pool.reserve(utxos, lease)
+            try:
+                while True:
+                    inputs = list(utxos) + (self.select_utxos_many({}, fee - own) if fee > own else [])
+                    outputs = self._plan_outputs(inputs, [], fee)
+                    if feerate is None:
+                        break
+                    vsize = estimate_vsize([utxo.output for utxo in inputs],
+                                           [(spk, bpub is not None) for spk, _, _, bpub in outputs] + [(b'', False)])
+                    required = fee_for(vsize, feerate)
+                    if required <= fee:
+                        break
+                    fee = required
+            except InsufficientFunds:
+                self.pool.release(utxos)
+                raise
+            self.pool.reserve(inputs, lease)
+        try:
+            return self._build(inputs, outputs, fee)
+        except Exception:
+            self.pool.release(inputs)
+            raise
+
+    def build_batch_psbts(self, recipients, feerate=None, max_outputs=None, max_vsize=MAX_STANDARD_VSIZE, lease=DEFAULT_LEASE):
+        """Return PsetBuilders paying recipients, (address, asset hex, value) triples
+
+        All addresses are parsed before building any transaction. Recipients
+        are split, in order, among as many transactions as needed to keep
+        each one within max_outputs outputs, fee and change included, and
+        max_vsize estimated vbytes. Utxos are selected so that no two
+        transactions spend the same one, and reserved for lease seconds.
+        """
+        recipients = [(self.network.parse_address(address), asset_hex, value) for address, asset_hex, value in recipients]
+        pending = [recipients]
+        if max_outputs is not None:
+            # Leave room for the fee and a change for each asset
+            size = max(1, max_outputs - len({asset_hex for _, asset_hex, _ in recipients} | {self.network.policy_asset_hex}) - 1)
+            pending = [recipients[i:i + size] for i in range(0, len(recipients), size)]
+        plans = []
+        try:
+            with self.pool.lock:
+                while pending:
+                    chunk = pending.pop(0)
+                    utxos, outputs, fee, vsize = self._plan(None, chunk, feerate)
+                    too_many = max_outputs is not None and len(outputs) + 1 > max_outputs
+                    if (too_many or vsize > max_vsize) and len(chunk) > 1:
+                        half = len(chunk) // 2
+                        pending[:0] = [chunk[:half], chunk[half:]]
+                        continue
+                    self.pool.reserve(utxos, lease)
+                    plans.append((utxos, outputs, fee))
+            return [self._build(*plan) for plan in plans]
+        except Exception:
+            # Nothing is built unless everything is
+            self.pool.release([utxo for utxos, _, _ in plans for utxo in utxos])
+            raise
+
+    def create_batch_psbts(self, recipients, feerate=None, max_outputs=None, max_vsize=MAX_STANDARD_VSIZE, lease=DEFAULT_LEASE):
+        builders = self.build_batch_psbts(recipients, feerate, max_outputs, max_vsize, lease)
+        return [builder.to_base64() for builder in builders]
+
+    def feerate(self, url, target=DEFAULT_TARGET):
+        """Feerate (sat/vbyte) to confirm within target blocks, estimates are cached for FEE_ESTIMATES_TTL"""
+        backend = self.backend(url)
+        if self._fee_estimator is None or self._fee_estimator.backend is not backend:
+            self._fee_estimator = FeeEstimator(backend)
+        return self._fee_estimator.feerate(target)
+
+    def blinding_entropy(self, builder):
+        """HmacDrbg seeded with the private blinding key and the unsigned transaction hash"""
+        return HmacDrbg(BLINDING_PERSONALIZATION + bytes(self.private_blinding_key) + bytes(builder.unsigned_id()))
+
+    @metrics.timed('blind_psbt')
+    def blind_psbt(self, psbt, used_utxos, entropy=None):
+        """Blind psbt, either a PsetBuilder or base64, return it as it was given
+
+        Blinding is deterministic, entropy defaults to blinding_entropy. The
+        blinders, kept in the builder, are also persisted in the store.
+        """
+        builder = as_builder(psbt, used_utxos)
+        blinders = builder.blind(used_utxos, self.blinding_entropy(builder) if entropy is None else entropy)
+        if self.store and blinders:
+            tx = wally.psbt_extract(builder.psbt, wally.WALLY_PSBT_EXTRACT_NON_FINAL)
+            txid = b2h_rev(wally.tx_get_txid(tx))
+            self.store.add_blinders((txid, vout, *blinder) for vout, blinder in blinders.items())
+        return like(builder, psbt)
+
+    @metrics.timed('send_psbt')
+    def send_psbt(self, psbt, url):
+        """Finalize and broadcast psbt, return the txid, see ChainBackend.broadcast
+
+        url is an Esplora url, whose client is reused, or a ChainBackend. For
+        many transactions, or to track confirmations, use a BroadcastQueue.
+        """
+        builder = as_builder(psbt)
+        builder.finalize()
+        return self.backend(url).broadcast(builder.tx_hex())
 
 
 def _balance(utxos):
+    """Dict asset (32 bytes) -> total value of utxos"""
     ret = {}
     for utxo in utxos:
-        asset_hex = b2h_rev(utxo.asset)
-        if asset_hex in ret:
-            ret[asset_hex] += utxo.value
-        else:
-            ret[asset_hex] = utxo.value
+        asset = bytes(utxo.asset)
+        ret[asset] = ret.get(asset, 0) + utxo.value
     return ret
 
 
-def parse_address(address):
-    # FIXME: add support for pre-segwit
-    unconf_address = wally.confidential_addr_to_addr_segwit(address, BLECH32_FAMILY_TESTNET_LIQUID, BECH32_FAMILY_TESTNET_LIQUID)
-    scriptpubkey = wally.addr_segwit_to_bytes(unconf_address, BECH32_FAMILY_TESTNET_LIQUID, 0)
-    blinding_public_key = wally.confidential_addr_segwit_to_ec_public_key(address, BLECH32_FAMILY_TESTNET_LIQUID)
-    return scriptpubkey, blinding_public_key
+def parse_address(address, network=LIQUID_TESTNET):
+    return network.parse_address(address)
 
 
 class WalletP2wpkh(Wallet):
     """A Simple wallet consisting in a single P2WPKH address/scriptpubkey"""
-    def __init__(self, private_key, private_blinding_key):
+    def __init__(self, private_key, private_blinding_key, store=None, network=LIQUID_TESTNET):
         self.private_key = private_key
-        output = P2wpkhElementsOutput(private_key, private_blinding_key)
-        super().__init__(output.scriptpubkey, private_blinding_key)
+        output = P2wpkhElementsOutput(private_key, private_blinding_key, network)
+        super().__init__(output.scriptpubkey, private_blinding_key, store, network)
         self.output = output
-
-    @staticmethod
-    def set_keypaths(psbt, idx, utxo):
-        fingerprint = b'\x00' * 4
-        keypaths = wally.map_keypath_public_key_init(1)
-        wally.map_keypath_add(keypaths, utxo.output.key.pub, fingerprint, [0])
-        wally.psbt_set_input_keypaths(psbt, idx, keypaths)
-
-    @staticmethod
-    def sign_psbt(psbt, used_utxos):
-        psbt = wally.psbt_from_base64(psbt, 0)
-        flags = 0
-        for utxo in used_utxos:
-            wally.psbt_sign(psbt, utxo.output.key.prv, flags)
-        return wally.psbt_to_base64(psbt, 0)
+        self.keystore.add(output.key)
 
 
 class WalletP2wsh2of3(Wallet):
     """A Simple wallet consisting in a single P2WSH-2OF3 address/scriptpubkey"""
-    def __init__(self, keys, private_blinding_key):
+    def __init__(self, keys, private_blinding_key, store=None, network=LIQUID_TESTNET):
         self.keys = keys
-        output = P2wsh2of3ElementsOutput(keys, private_blinding_key)
-        super().__init__(output.scriptpubkey, private_blinding_key)
+        output = P2wsh2of3ElementsOutput(keys, private_blinding_key, network)
+        super().__init__(output.scriptpubkey, private_blinding_key, store, network)
         self.output = output
+        for key in output.keys:
+            self.keystore.add(key)
 
     @staticmethod
     def set_witness_script(psbt, idx, utxo):
         wally.psbt_set_input_witness_script(psbt, idx, utxo.output.witness_script)
-
-    @staticmethod
-    def set_keypaths(psbt, idx, utxo):
-        fingerprint = b'\x00' * 4
-        keypaths = wally.map_keypath_public_key_init(len(utxo.output.keys))
-        for key in utxo.output.keys:
-            wally.map_keypath_add(keypaths, key.pub, fingerprint, [0])
-        wally.psbt_set_input_keypaths(psbt, idx, keypaths)
-
-    @staticmethod
-    def sign_psbt(psbt, used_utxos):
-        psbt = wally.psbt_from_base64(psbt, 0)
-        flags = 0
-        for utxo in used_utxos:
-            for key in utxo.output.keys:
-                if key.prv is not None:
-                    wally.psbt_sign(psbt, key.prv, flags)
-        return wally.psbt_to_base64(psbt, 0)
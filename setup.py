@@ -10,6 +10,9 @@ setup(
     packages=find_packages(exclude=['tests']),
     install_requires=['wallycore', 'requests'],
     url='https://github.com/LeoComandini/selw',
+    entry_points={
+        'console_scripts': ['selw-daemon=selw.daemon:main'],
+    },
     classifiers=[
         'Development Status :: 1 - Planning',
         'License :: OSI Approved :: MIT License',